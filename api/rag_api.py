@@ -1,43 +1,298 @@
 import os
+import re
+import sys
+import time
 import uuid
 import json
+import random
+import asyncio
+import hashlib
 import logging
+import mimetypes
+import threading
+import tracemalloc
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from contextlib import contextmanager
+from contextvars import ContextVar
 from functools import lru_cache
 from pathlib import Path
+from typing import NamedTuple
 from datetime import datetime
 
 from openai import AzureOpenAI
 import calc.surface_treatment as st
+import calc.unit_conversions as uc
+import calc.plating_planner as pp
+import calc.material_data as md
+import calc.line_simulator as ls
 
+import orjson
 import psycopg
-from fastapi import FastAPI, HTTPException, Query
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, ORJSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pgvector.psycopg import register_vector
 from pydantic import BaseModel, Field
 
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:  # brotli is optional, gzip is always available
+    BrotliMiddleware = None
+
 log = logging.getLogger("searchassistant")
 
 STATIC_DIR = Path(__file__).resolve().parent.parent / "static"
+# Built by scripts/build_static.py: fingerprinted assets, .gz/.br variants, rewritten index.html
+DIST_DIR = STATIC_DIR / "dist"
+DIST_PREFIX = "/static/dist/"
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+
+# Responses smaller than this are sent uncompressed
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+
+
+class SkipPrecompressed:
+    """Compression middleware that leaves precompressed static responses alone.
+
+    `/` and `/static/dist/*` pick their own .br/.gz variant, so running them
+    through the compressor again would only cost CPU (or double-encode)."""
+
+    def __init__(self, app, compressor, **options):
+        self.app = app
+        self.compressed = compressor(app, **options)
 
-app = FastAPI(title="SearchAssistant")
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and (scope["path"] == "/" or scope["path"].startswith(DIST_PREFIX)):
+            await self.app(scope, receive, send)
+        else:
+            await self.compressed(scope, receive, send)
+
+
+app = FastAPI(title="SearchAssistant", default_response_class=ORJSONResponse)
+if BrotliMiddleware is not None:
+    app.add_middleware(SkipPrecompressed, compressor=BrotliMiddleware,
+                       minimum_size=COMPRESS_MIN_BYTES, gzip_fallback=True)
+else:
+    app.add_middleware(SkipPrecompressed, compressor=GZipMiddleware, minimum_size=COMPRESS_MIN_BYTES)
+
+
+# ── Profiling ────────────────────────────────────────────────────────
+# Every request records stage timings (wall and thread CPU time, so a stage
+# that waits on the DB, the network or the GIL shows wall >> cpu). A sampled
+# request – PROFILE_SAMPLE_RATE of traffic, or any request carrying
+# PROFILE_HEADER – additionally gets a stack sampler and memory snapshots.
+# Sampled and slow requests are dumped as JSON into a bounded ring in PROFILE_DIR.
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_HEADER = os.getenv("PROFILE_HEADER", "X-Debug-Profile")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "2000"))
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", str(STATIC_DIR.parent / "data" / "profiles")))
+PROFILE_RING_SIZE = int(os.getenv("PROFILE_RING_SIZE", "50"))
+# tracemalloc slows every allocation down, so it is only started when asked for
+PROFILE_TRACEMALLOC = os.getenv("PROFILE_TRACEMALLOC", "0") == "1"
+# Stacks / allocation sites kept per dump
+PROFILE_TOP = 40
+
+
+class RequestProfile:
+    def __init__(self, method: str, path: str, sampled: bool):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.sampled = sampled
+        self.started = time.time()
+        self.stages: list[dict] = []
+        self.samples: Counter[str] = Counter()
+        # thread id -> stage nesting depth; the sampler only looks at threads inside a stage
+        self.threads: dict[int, int] = {}
+        self.rss_start_mb = _rss_mb()
+        self.snapshot = tracemalloc.take_snapshot() if sampled and tracemalloc.is_tracing() else None
+
+
+_current_profile: ContextVar[RequestProfile | None] = ContextVar("current_profile", default=None)
+
+
+def _rss_mb() -> float | None:
+    try:
+        with open("/proc/self/statm") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20, 1)
+    except (OSError, ValueError):
+        return None
+
+
+@contextmanager
+def stage(name: str):
+    """Time a named part of the current request (no-op outside a request)."""
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    tid = threading.get_ident()
+    profile.threads[tid] = profile.threads.get(tid, 0) + 1
+    wall, cpu = time.perf_counter(), time.thread_time()
+    try:
+        yield
+    finally:
+        profile.stages.append({
+            "stage": name,
+            "ms": round((time.perf_counter() - wall) * 1000, 2),
+            "cpu_ms": round((time.thread_time() - cpu) * 1000, 2),
+        })
+        depth = profile.threads.pop(tid) - 1
+        if depth:
+            profile.threads[tid] = depth
+
+
+def _collapse(frame) -> str:
+    """Folded stack (root first), the input format of flamegraph tools."""
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+class StackSampler:
+    """One daemon thread that samples the stacks of all profiled requests.
+
+    It sleeps on an event while nothing is being profiled, so unsampled
+    traffic pays nothing."""
+
+    def __init__(self, interval_s: float):
+        self.interval_s = interval_s
+        self.active: set[RequestProfile] = set()
+        self.lock = threading.Lock()
+        self.has_work = threading.Event()
+        self.thread: threading.Thread | None = None
+
+    def add(self, profile: RequestProfile):
+        with self.lock:
+            self.active.add(profile)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self.thread.start()
+        self.has_work.set()
+
+    def remove(self, profile: RequestProfile):
+        with self.lock:
+            self.active.discard(profile)
+            if not self.active:
+                self.has_work.clear()
+
+    def _run(self):
+        while True:
+            self.has_work.wait()
+            time.sleep(self.interval_s)
+            with self.lock:
+                profiles = list(self.active)
+            frames = sys._current_frames()
+            for profile in profiles:
+                for tid in list(profile.threads):
+                    frame = frames.get(tid)
+                    if frame is not None:
+                        profile.samples[_collapse(frame)] += 1
+
+
+_sampler = StackSampler(PROFILE_INTERVAL_MS / 1000)
+
+
+def _dump_profile(profile: RequestProfile, record: dict):
+    """Write one profile and drop the oldest files beyond PROFILE_RING_SIZE."""
+    if profile.snapshot is not None:
+        own = (tracemalloc.Filter(False, tracemalloc.__file__),)
+        diff = tracemalloc.take_snapshot().filter_traces(own).compare_to(profile.snapshot.filter_traces(own), "lineno")
+        record["memory"]["tracemalloc_top"] = [
+            {"site": str(d.traceback[0]), "size_diff_kb": round(d.size_diff / 1024, 1), "count_diff": d.count_diff}
+            for d in diff[:PROFILE_TOP]
+        ]
+    if profile.samples:
+        record["samples"] = {
+            "interval_ms": PROFILE_INTERVAL_MS,
+            "total": sum(profile.samples.values()),
+            "stacks": dict(profile.samples.most_common(PROFILE_TOP)),
+        }
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.fromtimestamp(profile.started).strftime("%Y%m%dT%H%M%S.%f")
+    path = PROFILE_DIR / f"{stamp}-{profile.id}.json"
+    path.write_bytes(orjson.dumps(record, option=orjson.OPT_INDENT_2))
+    for old in sorted(PROFILE_DIR.glob("*.json"))[:-PROFILE_RING_SIZE]:
+        old.unlink(missing_ok=True)
+
+
+@app.middleware("http")
+async def profile_requests(request: Request, call_next):
+    forced = PROFILE_HEADER.lower() in request.headers
+    sampled = forced or (PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE)
+    profile = RequestProfile(request.method, request.url.path, sampled)
+    token = _current_profile.set(profile)
+    if sampled:
+        _sampler.add(profile)
+    t0 = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        if sampled:
+            _sampler.remove(profile)
+        _current_profile.reset(token)
+    duration_ms = (time.perf_counter() - t0) * 1000
+
+    if forced:
+        response.headers["Server-Timing"] = ", ".join(
+            f'{s["stage"]};dur={s["ms"]}' for s in profile.stages) or f"total;dur={duration_ms:.1f}"
+    if sampled or duration_ms >= SLOW_REQUEST_MS:
+        rss_end = _rss_mb()
+        record = {
+            "id": profile.id,
+            "method": profile.method,
+            "path": profile.path,
+            "status": response.status_code,
+            "started": datetime.fromtimestamp(profile.started).isoformat(),
+            "duration_ms": round(duration_ms, 1),
+            "reason": "header" if forced else "sampled" if sampled else "slow",
+            "stages": profile.stages,
+            "memory": {
+                "rss_start_mb": profile.rss_start_mb,
+                "rss_end_mb": rss_end,
+                "rss_delta_mb": round(rss_end - profile.rss_start_mb, 1)
+                if rss_end is not None and profile.rss_start_mb is not None else None,
+            },
+        }
+        try:
+            await asyncio.to_thread(_dump_profile, profile, record)
+            response.headers["X-Profile-Id"] = profile.id
+        except OSError as e:
+            log.warning("Could not write profile %s: %s", profile.id, e)
+    return response
 
 
 # ── Models ───────────────────────────────────────────────────────────
 class SearchResult(BaseModel):
     id: str
     score: float
-    content: str
+    content: str | None
     source_url: str | None
     title: str | None
     license: str | None
     language: str | None
+    snippet: str | None = None
+
+
+SEARCH_FIELDS = tuple(SearchResult.model_fields)
 
 
 class AskRequest(BaseModel):
     question: str
     session_id: str | None = None
     k: int = 5
+    # Return a highlighted window instead of the full chunk in `sources`
+    snippet: bool = False
+    # Cross-encoder rerank of a wider candidate set; None = RERANK_ENABLED
+    rerank: bool | None = None
+    # Neighbouring chunks added around each hit; None = EXPAND_NEIGHBORS
+    expand: int | None = Field(None, ge=0, le=5)
 
 
 class AskResponse(BaseModel):
@@ -78,7 +333,7 @@ def ensure_session_tables():
             updated_at    TIMESTAMPTZ DEFAULT NOW(),
             title         TEXT,
             summary       TEXT,
-            summary_embedding VECTOR(1024)
+            summary_embedding VECTOR
         );
         CREATE TABLE IF NOT EXISTS messages (
             id            SERIAL PRIMARY KEY,
@@ -87,43 +342,685 @@ def ensure_session_tables():
             content       TEXT,
             created_at    TIMESTAMPTZ DEFAULT NOW()
         );
+        -- Lets transcript cursors stream in order without sorting the whole session first
+        CREATE INDEX IF NOT EXISTS messages_session_created_idx
+            ON messages (session_id, created_at, id);
         """)
+        # Older tables pinned the summary vector to 1024 dimensions; it follows
+        # the embedding model now (see migrate_embeddings.py)
+        cur.execute(
+            "SELECT atttypmod FROM pg_attribute "
+            "WHERE attrelid = 'sessions'::regclass AND attname = 'summary_embedding'"
+        )
+        row = cur.fetchone()
+        if row and row[0] != -1:
+            cur.execute("ALTER TABLE sessions ALTER COLUMN summary_embedding TYPE VECTOR")
     conn.commit()
 
 
-def fetch_matches(query_vector, limit: int = 5):
-    sql = """
-    SELECT id, source_url, title, license, language, content,
-           1 - (embedding <=> %(qv)s::vector) AS score
-    FROM public.documents
-    ORDER BY embedding <=> %(qv)s::vector
-    LIMIT %(limit)s
-    """
+# Rows per round trip when streaming a session's messages
+MESSAGE_FETCH_SIZE = int(os.getenv("MESSAGE_FETCH_SIZE", "200"))
+
+
+def iter_messages(session_id: str, fetch_size: int = MESSAGE_FETCH_SIZE):
+    """Yield (role, content, created_at) for a session in order.
+
+    Uses a server-side cursor on its own connection, so only `fetch_size`
+    rows are in memory at a time and a long stream does not hold the shared
+    connection's transaction open. Closing the generator (client disconnect)
+    closes the cursor and the connection."""
+    with psycopg.connect(os.getenv("DATABASE_URL")) as conn:
+        with conn.cursor(name=f"messages_{uuid.uuid4().hex[:12]}") as cur:
+            cur.execute(
+                "SELECT role, content, created_at FROM messages "
+                "WHERE session_id = %s ORDER BY created_at, id",
+                (session_id,)
+            )
+            while batch := cur.fetchmany(fetch_size):
+                yield from batch
+
+
+# ── Access tiers ─────────────────────────────────────────────────────
+# Data classification from TIETOKANNAN_RIKASTUS.md. Until authentication is
+# in place every caller gets DEFAULT_ACCESS_TIERS; with TRUST_ACCESS_HEADERS=1
+# an authenticating proxy in front of the API sets X-Access-Tiers and
+# X-Customer-Id instead. `customer` rows are only visible with a matching
+# customer id.
+ACCESS_TIERS = ("public", "proprietary", "customer")
+DEFAULT_ACCESS_TIERS = tuple(
+    t.strip() for t in os.getenv("DEFAULT_ACCESS_TIERS", "public,proprietary").split(",") if t.strip())
+TRUST_ACCESS_HEADERS = os.getenv("TRUST_ACCESS_HEADERS", "0") == "1"
+
+_ACCESS_FILTER = (
+    "access_level = ANY(%(tiers)s) "
+    "AND (access_level <> 'customer' OR customer_id = %(customer_id)s)"
+)
+
+
+class AccessScope(NamedTuple):
+    tiers: tuple[str, ...]
+    customer_id: str | None = None
+
+
+def access_scope(request: Request) -> AccessScope:
+    tiers, customer_id = DEFAULT_ACCESS_TIERS, None
+    if TRUST_ACCESS_HEADERS:
+        if "x-access-tiers" in request.headers:
+            tiers = tuple(t.strip() for t in request.headers["x-access-tiers"].split(",") if t.strip())
+        customer_id = request.headers.get("x-customer-id") or None
+    return AccessScope(
+        tuple(t for t in tiers if t in ACCESS_TIERS and (t != "customer" or customer_id)),
+        customer_id,
+    )
+
+
+def ensure_document_columns():
+    """Tier and chunk ordinal columns for a documents table created before
+    they existed (embed_and_index.py adds them too and fills chunk_index for
+    old rows; a no-op once present)."""
     conn = get_conn()
     with conn.cursor() as cur:
-        cur.execute(sql, {"qv": query_vector, "limit": limit})
+        cur.execute("""
+        ALTER TABLE IF EXISTS public.documents
+            ADD COLUMN IF NOT EXISTS access_level TEXT NOT NULL DEFAULT 'public',
+            ADD COLUMN IF NOT EXISTS customer_id TEXT,
+            ADD COLUMN IF NOT EXISTS chunk_index INT
+        """)
+    conn.commit()
+
+
+# ── Embedding model ──────────────────────────────────────────────────
+# public.embedding_state records which model `documents.embedding` holds.
+# migrate_embeddings.py cutover swaps in a new model's column and bumps the
+# generation in one transaction; queries are embedded with the model of the
+# generation they read, and fetch_matches only ranks against that generation.
+# Without a state row EMBED_MODEL is used.
+EMBED_MODEL = os.getenv("EMBED_MODEL", "BAAI/bge-m3")
+EMBED_STATE_TTL_S = float(os.getenv("EMBED_STATE_TTL_S", "10"))
+EMBEDDING_TABLE = "public.documents"
+
+
+class EmbeddingState(NamedTuple):
+    generation: int
+    model: str
+    shadow_model: str | None = None
+
+
+_embedding_state: tuple[float, EmbeddingState] | None = None
+
+
+def ensure_embedding_state():
+    """The state table (embed_and_index.py creates it too; a no-op once present)."""
+    conn = get_conn()
+    with conn.cursor() as cur:
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS public.embedding_state (
+            table_name   TEXT PRIMARY KEY,
+            generation   INT NOT NULL DEFAULT 0,
+            model        TEXT,
+            dim          INT,
+            shadow_model TEXT,
+            shadow_dim   INT,
+            prev_model   TEXT,
+            prev_dim     INT,
+            status       TEXT NOT NULL DEFAULT 'idle',
+            backfilled   BIGINT NOT NULL DEFAULT 0,
+            total        BIGINT NOT NULL DEFAULT 0,
+            updated_at   TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+        """)
+    conn.commit()
+
+
+def current_embedding(refresh: bool = False) -> EmbeddingState:
+    """The live model and generation, re-read at most every EMBED_STATE_TTL_S."""
+    global _embedding_state
+    now = time.monotonic()
+    if not refresh and _embedding_state and now - _embedding_state[0] < EMBED_STATE_TTL_S:
+        return _embedding_state[1]
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT generation, model, shadow_model FROM public.embedding_state WHERE table_name = %s",
+                (EMBEDDING_TABLE,)
+            )
+            row = cur.fetchone()
+        conn.commit()
+    except psycopg.errors.UndefinedTable:
+        # No migrations have run against this database
+        conn.rollback()
+        row = None
+    except psycopg.Error as e:
+        conn.rollback()
+        if _embedding_state:
+            log.warning("Could not read embedding state, keeping generation %d: %s",
+                        _embedding_state[1].generation, e)
+            return _embedding_state[1]
+        raise
+    state = EmbeddingState(row[0], row[1] or EMBED_MODEL, row[2]) if row else EmbeddingState(0, EMBED_MODEL)
+    previous = _embedding_state[1] if _embedding_state else None
+    _embedding_state = (now, state)
+    if state != previous:
+        log.info("Embedding model %s (generation %d)%s", state.model, state.generation,
+                 f", migrating to {state.shadow_model}" if state.shadow_model else "")
+        _drop_models(keep={state.model, state.shadow_model})
+        if state.shadow_model:
+            # Loaded ahead of the cutover so the first query after it does not wait
+            threading.Thread(target=_get_model, args=(state.shadow_model,), daemon=True,
+                             name="embed-warmup").start()
+    return state
+
+
+# ── Retrieval modes ──────────────────────────────────────────────────
+# "full" ranks on the fp32 `embedding` column. "halfvec" and "binary" take a
+# candidate set from the compressed column's index (see embed_and_index.py
+# --quantize) and rescore it with the full-precision vectors.
+VECTOR_SEARCH_MODE = os.getenv("VECTOR_SEARCH_MODE", "full")
+RESCORE_OVERSAMPLE = int(os.getenv("RESCORE_OVERSAMPLE", "4"))
+
+_CANDIDATE_ORDER = {
+    "halfvec": "embedding_half <=> %(qv)s::halfvec({dim})",
+    "binary": "embedding_bin <~> binary_quantize(%(qv)s::vector)::bit({dim})",
+}
+# Evaluated once per statement: after a cutover the query returns no rows
+# instead of comparing a vector from the old model with the new column
+_GENERATION_FILTER = (
+    "COALESCE((SELECT generation FROM public.embedding_state "
+    f"WHERE table_name = '{EMBEDDING_TABLE}'), 0) = %(generation)s"
+)
+
+_MATCH_SQL = """
+SELECT id, source_url, title, license, language, content,
+       1 - (embedding <=> %(qv)s::vector) AS score, chunk_index
+FROM public.documents
+{where}
+ORDER BY embedding <=> %(qv)s::vector
+LIMIT %(limit)s
+"""
+
+_RESCORE_SQL = """
+SELECT id, source_url, title, license, language, content,
+       1 - (embedding <=> %(qv)s::vector) AS score, chunk_index
+FROM (
+    SELECT id, source_url, title, license, language, content, embedding, chunk_index
+    FROM public.documents
+    {where}
+    ORDER BY {candidate_order}
+    LIMIT %(candidates)s
+) c
+ORDER BY embedding <=> %(qv)s::vector
+LIMIT %(limit)s
+"""
+
+# ── Neighbour expansion ──────────────────────────────────────────────
+# A hit cut mid-explanation is widened with the ±N chunks around it (same
+# source_url, chunk_index within N, see embed_and_index.py) instead of
+# raising k. The neighbours come back with the hits in one statement;
+# _merge_passages joins overlapping windows into contiguous passages.
+EXPAND_NEIGHBORS = int(os.getenv("EXPAND_NEIGHBORS", "0"))
+MAX_EXPAND_NEIGHBORS = 5
+
+# `ranked` yields (id, source_url, chunk_index, score, rank) per hit
+_EXPAND_SQL = """
+WITH ranked AS ({ranked})
+SELECT h.rank, h.score, h.id, d.id, d.source_url, d.title, d.license, d.language, d.content, d.chunk_index
+FROM ranked h
+CROSS JOIN LATERAL (
+    SELECT id, source_url, title, license, language, content, chunk_index
+    FROM public.documents
+    WHERE (id = h.id OR (source_url = h.source_url
+           AND chunk_index BETWEEN h.chunk_index - %(expand)s AND h.chunk_index + %(expand)s))
+    {and_where}
+) d
+ORDER BY h.rank, d.chunk_index
+"""
+_RANKED_HITS = """
+SELECT id, source_url, chunk_index, score, row_number() OVER (ORDER BY score DESC) AS rank
+FROM ({hits}) hits
+"""
+# Hits already ordered in Python (after a rerank)
+_RANKED_IDS = """
+SELECT d.id, d.source_url, d.chunk_index, u.score, u.rank
+FROM unnest(%(ids)s::text[], %(scores)s::float8[]) WITH ORDINALITY AS u(id, score, rank)
+JOIN public.documents d ON d.id = u.id
+"""
+# Chunks overlap by whole sentences; a shared run shorter than this is not
+# looked for and the chunks are joined as they are
+_OVERLAP_PROBE = 24
+# Between chunks that are not adjacent in the document (a chunk removed by
+# dedup_chunks.py or by the access filter lies between them)
+_GAP_SEPARATOR = "\n…\n"
+
+
+def _overlap(a: str, b: str) -> int:
+    """Length of the longest suffix of `a` that is a prefix of `b`."""
+    probe = b[:_OVERLAP_PROBE]
+    if not probe:
+        return 0
+    pos = a.find(probe, max(0, len(a) - len(b)))
+    while pos != -1:
+        if b.startswith(a[pos:]):
+            return len(a) - pos
+        pos = a.find(probe, pos + 1)
+    return 0
+
+
+def _join_chunks(texts: list[str]) -> str:
+    out = texts[0]
+    for text in texts[1:]:
+        n = _overlap(out, text)
+        if n:
+            out += text[n:]
+        elif out[-1:].isspace() or text[:1].isspace():
+            out += text
+        else:
+            out += "\n" + text
+    return out
+
+
+def _join_runs(chunks: list) -> str:
+    """Join chunks sorted by chunk_index, each run of consecutive indexes as
+    one text and the runs separated by _GAP_SEPARATOR."""
+    runs: list[list[str]] = []
+    prev = None
+    for c in chunks:
+        if prev is None or c[6] is None or c[6] - prev > 1:
+            runs.append([])
+        runs[-1].append(c[5] or "")
+        prev = c[6]
+    return _GAP_SEPARATOR.join(_join_chunks(run) for run in runs)
+
+
+def _merge_passages(rows) -> list:
+    """Turn per-hit neighbour rows (rank, score, hit id, chunk fields...) into
+    passages shaped like fetch_matches rows, in hit order.
+
+    Windows of the same document that overlap or touch become one passage
+    with the id, rank and score of its best-ranked hit. Where chunk indexes
+    skip (missing chunks), the passage text is marked with "…"."""
+    windows: dict[int, dict] = {}
+    for rank, score, hit_id, *chunk in rows:
+        w = windows.setdefault(rank, {"rank": rank, "score": score, "id": hit_id, "chunks": {}})
+        w["chunks"][chunk[0]] = chunk
+    groups: list[list[dict]] = []
+    by_source: dict[str, list[dict]] = {}
+    for w in windows.values():
+        ordinals = [c[6] for c in w["chunks"].values() if c[6] is not None]
+        hit = w["chunks"].get(w["id"])
+        if not ordinals or hit is None:
+            groups.append([w])
+            continue
+        w["span"] = (min(ordinals), max(ordinals))
+        by_source.setdefault(hit[1], []).append(w)
+    for ws in by_source.values():
+        ws.sort(key=lambda w: w["span"])
+        group, end = [ws[0]], ws[0]["span"][1]
+        for w in ws[1:]:
+            if w["span"][0] <= end + 1:
+                group.append(w)
+                end = max(end, w["span"][1])
+            else:
+                groups.append(group)
+                group, end = [w], w["span"][1]
+        groups.append(group)
+
+    out = []
+    for group in sorted(groups, key=lambda g: min(w["rank"] for w in g)):
+        best = min(group, key=lambda w: w["rank"])
+        chunks = {}
+        for w in group:
+            chunks.update(w["chunks"])
+        ordered = sorted(chunks.values(), key=lambda c: (c[6] is None, c[6] or 0))
+        hit = chunks.get(best["id"], ordered[0])
+        text = _join_runs(ordered)
+        out.append((best["id"], hit[1], hit[2], hit[3], hit[4], text, best["score"], hit[6]))
+    return out
+
+
+def _neighbor_filter(access: AccessScope | None, params: dict) -> str:
+    if access is None:
+        return ""
+    params.update(tiers=list(access.tiers), customer_id=access.customer_id)
+    return "AND " + _ACCESS_FILTER
+
+
+def fetch_matches(query_vector, limit: int = 5, mode: str | None = None,
+                  oversample: int | None = None, access: AccessScope | None = None,
+                  generation: int | None = None, expand: int = 0):
+    """Nearest chunks to `query_vector`. With an access scope only the allowed
+    tiers are searched; on a partitioned table (embed_and_index.py
+    --partitioning) the other tiers' partitions and indexes are pruned.
+    With a generation, nothing is returned unless the table still holds the
+    embeddings of that generation (see current_embedding).
+
+    With `expand` each hit is widened with its ±expand neighbouring chunks in
+    the same statement and merged into passages (see _merge_passages), so
+    fewer than `limit` rows may come back."""
+    mode = mode or VECTOR_SEARCH_MODE
+    params = {"qv": query_vector, "limit": limit}
+    conditions = []
+    if access is not None:
+        if not access.tiers:
+            return []
+        conditions.append(_ACCESS_FILTER)
+        params.update(tiers=list(access.tiers), customer_id=access.customer_id)
+    if generation is not None:
+        conditions.append(_GENERATION_FILTER)
+        params["generation"] = generation
+    where = "WHERE " + " AND ".join(conditions) if conditions else ""
+    if mode == "full":
+        sql = _MATCH_SQL.format(where=where)
+    elif mode in _CANDIDATE_ORDER:
+        candidate_order = _CANDIDATE_ORDER[mode].format(dim=len(query_vector))
+        sql = _RESCORE_SQL.format(candidate_order=candidate_order, where=where)
+        params["candidates"] = limit * (oversample or RESCORE_OVERSAMPLE)
+    else:
+        raise ValueError(f"Unknown vector search mode: {mode}")
+    if expand:
+        sql = _EXPAND_SQL.format(ranked=_RANKED_HITS.format(hits=sql),
+                                 and_where=_neighbor_filter(access, params))
+        params["expand"] = expand
+    conn = get_conn()
+    with stage("vector_search"), conn.cursor() as cur:
+        if "candidates" in params:
+            # HNSW returns at most ef_search rows, so it must cover the oversample.
+            # SET LOCAL: the value ends with the transaction committed below
+            # instead of staying on the connection for later queries.
+            cur.execute(f"SET LOCAL hnsw.ef_search = {max(40, int(params['candidates']))}")
+        cur.execute(sql, params)
         rows = cur.fetchall()
-    return rows
+    # End the read transaction: an idle one would hold a lock that blocks a
+    # migration cutover's column renames
+    conn.commit()
+    return _merge_passages(rows) if expand else rows
 
 
-# ── Embedding helper ─────────────────────────────────────────────────
-def _get_model():
-    from sentence_transformers import SentenceTransformer
-    if not hasattr(_get_model, "_inst"):
-        model_name = os.getenv("EMBED_MODEL", "BAAI/bge-m3")
-        _get_model._inst = SentenceTransformer(model_name)  # type: ignore[attr-defined]
-    return _get_model._inst  # type: ignore[attr-defined]
+def expand_matches(rows, expand: int, access: AccessScope | None = None) -> list:
+    """Neighbour expansion for rows already in their final order (after a
+    rerank): one statement for all of them, passages in the same order."""
+    if not rows or not expand:
+        return rows
+    params = {"ids": [r[0] for r in rows], "scores": [float(r[6]) for r in rows], "expand": expand}
+    sql = _EXPAND_SQL.format(ranked=_RANKED_IDS, and_where=_neighbor_filter(access, params))
+    conn = get_conn()
+    with stage("expand"), conn.cursor() as cur:
+        cur.execute(sql, params)
+        expanded = cur.fetchall()
+    conn.commit()
+    return _merge_passages(expanded)
+
+
+def _row_to_dict(r) -> dict:
+    return {"id": r[0], "score": float(r[6]), "content": r[5], "source_url": r[1],
+            "title": r[2], "license": r[3], "language": r[4]}
+
 
+# ── Snippets ─────────────────────────────────────────────────────────
+_WORD_RE = re.compile(r"\w+")
 
-def embed_query(text: str) -> list[float]:
-    model = _get_model()
-    return model.encode([text], normalize_embeddings=True)[0].tolist()
+
+def _query_pattern(query: str) -> re.Pattern | None:
+    """Build a regex matching words that start with a query term stem.
+
+    Finnish is heavily inflected ("kupari" / "kuparin" / "kuparia"), so each
+    term is cut to a short stem and matched as a word prefix.
+    """
+    stems = {w[:6] for w in _WORD_RE.findall(query.lower()) if len(w) >= 3}
+    if not stems:
+        return None
+    alts = "|".join(re.escape(s) for s in sorted(stems, key=len, reverse=True))
+    return re.compile(rf"\b(?:{alts})\w*", re.IGNORECASE)
+
+
+def make_snippet(content: str, query: str, width: int = 240,
+                 pattern: re.Pattern | None = None) -> str:
+    """Return the `width`-character window of `content` with the most query
+    term hits, hits wrapped in **bold** and cut points marked with an ellipsis."""
+    if pattern is None:
+        pattern = _query_pattern(query)
+    hits = [(m.start(), m.end()) for m in pattern.finditer(content)] if pattern else []
+
+    if len(content) <= width:
+        start, end = 0, len(content)
+    elif not hits:
+        start, end = 0, width
+    else:
+        # Sliding window over hit positions: pick the start hit that has the
+        # most other hits within `width` characters after it.
+        best_i, best_n, j = 0, 0, 0
+        for i, (hs, _) in enumerate(hits):
+            while j < len(hits) and hits[j][1] <= hs + width:
+                j += 1
+            if j - i > best_n:
+                best_i, best_n = i, j - i
+        # Leave a little leading context before the first hit
+        start = max(0, hits[best_i][0] - width // 5)
+        end = min(len(content), start + width)
+        start = max(0, end - width)
+        # Snap to whitespace so words are not cut in half
+        if start > 0:
+            ws = content.find(" ", start, hits[best_i][0])
+            if ws != -1:
+                start = ws + 1
+    if end < len(content):
+        ws = content.rfind(" ", start, end)
+        if ws > start:
+            end = ws
+
+    parts = []
+    pos = start
+    for hs, he in hits:
+        if he <= start or hs >= end:
+            continue
+        hs, he = max(hs, start), min(he, end)
+        parts.append(content[pos:hs])
+        parts.append(f"**{content[hs:he]}**")
+        pos = he
+    parts.append(content[pos:end])
+    text = "".join(parts).strip()
+    if start > 0:
+        text = "…" + text
+    if end < len(content):
+        text = text + "…"
+    return text
+
+
+# ── Embedding helper ─────────────────────────────────────────────────
+# Loaded models by name; during a migration the shadow model is kept next to
+# the live one, older ones are dropped after a cutover
+_models: dict[str, object] = {}
+_model_locks: dict[str, threading.Lock] = {}
+_models_lock = threading.Lock()
+
+
+def _get_model(name: str | None = None):
+    name = name or current_embedding().model
+    model = _models.get(name)
+    if model is None:
+        # One lock per model, so warming up the next model never blocks queries
+        with _models_lock:
+            lock = _model_locks.setdefault(name, threading.Lock())
+        with lock:
+            model = _models.get(name)
+            if model is None:
+                from sentence_transformers import SentenceTransformer
+                model = _models[name] = SentenceTransformer(name)
+    return model
+
+
+def _drop_models(keep: set):
+    with _models_lock:
+        for name in [n for n in _models if n not in keep]:
+            del _models[name]
+            _model_locks.pop(name, None)
+
+
+def embed_query(text: str, model_name: str | None = None) -> list[float]:
+    with stage("embed"):
+        model = _get_model(model_name)
+        return model.encode([text], normalize_embeddings=True)[0].tolist()
+
+
+# ── Reranking ────────────────────────────────────────────────────────
+# Optional cross-encoder pass over a wider vector candidate set. Scoring runs
+# on a single background thread so a request can stop waiting when the
+# latency budget runs out; late scores still land in the cache. Timed-out
+# jobs keep the thread busy, so at most RERANK_MAX_PENDING jobs may be
+# running or queued; beyond that requests skip the rerank.
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "0") == "1"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "BAAI/bge-reranker-base")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "800"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "4096"))
+RERANK_MAX_PENDING = max(1, int(os.getenv("RERANK_MAX_PENDING", "2")))
+# Chunks are cut to this many characters before scoring
+RERANK_MAX_CHARS = 2000
+
+_rerank_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+_rerank_slots = threading.BoundedSemaphore(RERANK_MAX_PENDING)
+_rerank_cache: OrderedDict[tuple[str, str], float] = OrderedDict()
+_rerank_lock = threading.Lock()
+
+
+def _get_reranker():
+    from sentence_transformers import CrossEncoder
+    if not hasattr(_get_reranker, "_inst"):
+        _get_reranker._inst = CrossEncoder(RERANK_MODEL, max_length=512)  # type: ignore[attr-defined]
+    return _get_reranker._inst  # type: ignore[attr-defined]
+
+
+def _score_pairs(qkey: str, query: str, items: list[tuple[str, str]]) -> dict[str, float]:
+    """Score (chunk id, text) pairs against the query in one batch and cache them."""
+    scores = _get_reranker().predict([(query, text[:RERANK_MAX_CHARS]) for _, text in items],
+                                     batch_size=len(items))
+    out = {cid: float(s) for (cid, _), s in zip(items, scores)}
+    with _rerank_lock:
+        for cid, s in out.items():
+            _rerank_cache[(qkey, cid)] = s
+            _rerank_cache.move_to_end((qkey, cid))
+        while len(_rerank_cache) > RERANK_CACHE_SIZE:
+            _rerank_cache.popitem(last=False)
+    return out
+
+
+def rerank(query: str, rows: list, k: int, budget_ms: float | None = None) -> list:
+    """Return the top-k rows by cross-encoder score.
+
+    Scores are cached per (query hash, chunk id), so only unseen pairs are
+    sent to the model. If scoring does not finish within the budget (e.g. the
+    model is still loading), or the scoring queue is full, the rows keep
+    their vector order.
+    """
+    if len(rows) <= 1:
+        return rows[:k]
+    qkey = hashlib.sha1(query.strip().lower().encode("utf-8")).hexdigest()
+    with _rerank_lock:
+        scores = {r[0]: _rerank_cache[(qkey, r[0])] for r in rows if (qkey, r[0]) in _rerank_cache}
+    missing = [(r[0], r[5] or "") for r in rows if r[0] not in scores]
+    if missing:
+        budget = (budget_ms if budget_ms is not None else RERANK_BUDGET_MS) / 1000
+        if not _rerank_slots.acquire(blocking=False):
+            log.warning("Rerank queue full (%d pending), using vector order", RERANK_MAX_PENDING)
+            return rows[:k]
+        future = _rerank_pool.submit(_score_pairs, qkey, query, missing)
+        # Released when scoring ends, also for jobs the request stopped waiting for
+        future.add_done_callback(lambda _: _rerank_slots.release())
+        try:
+            scores.update(future.result(timeout=budget))
+        except FuturesTimeout:
+            log.warning("Rerank exceeded %.0f ms budget, using vector order", budget * 1000)
+            return rows[:k]
+        except Exception as e:
+            log.warning("Rerank failed, using vector order: %s", e)
+            return rows[:k]
+    return sorted(rows, key=lambda r: scores[r[0]], reverse=True)[:k]
+
+
+def retrieve(query: str, k: int, use_rerank: bool | None = None, access: AccessScope | None = None,
+             expand: int | None = None) -> list:
+    """Vector search, widened and reranked when reranking is enabled, with
+    each hit expanded to its neighbouring chunks when `expand` (default
+    EXPAND_NEIGHBORS) is set."""
+    use_rerank = RERANK_ENABLED if use_rerank is None else use_rerank
+    expand = min(EXPAND_NEIGHBORS if expand is None else expand, MAX_EXPAND_NEIGHBORS)
+    limit = max(k, RERANK_CANDIDATES) if use_rerank else k
+    # Without a rerank the neighbours come back with the hits; a rerank has
+    # to see single chunks, so its top k are expanded afterwards
+    search_expand = 0 if use_rerank else expand
+    state = current_embedding()
+    rows = fetch_matches(embed_query(query, state.model), limit=limit, access=access,
+                         generation=state.generation, expand=search_expand)
+    if not rows:
+        # Empty either genuinely or because a cutover happened since the state
+        # was read; in the latter case embed again with the new model
+        fresh = current_embedding(refresh=True)
+        if fresh.generation != state.generation:
+            rows = fetch_matches(embed_query(query, fresh.model), limit=limit, access=access,
+                                 generation=fresh.generation, expand=search_expand)
+    if not use_rerank:
+        return rows
+    with stage("rerank"):
+        rows = rerank(query, rows, k)
+    return expand_matches(rows, expand, access)
+
+
+# ── Static files ─────────────────────────────────────────────────────
+@lru_cache(maxsize=64)
+def _file_etag(path: str, mtime_ns: int, size: int) -> str:
+    with open(path, "rb") as f:
+        return '"' + hashlib.sha256(f.read()).hexdigest()[:16] + '"'
+
+
+def _encoded_variant(path: Path, accept_encoding: str) -> tuple[Path, str | None]:
+    """Pick the precompressed .br / .gz sibling the client accepts, else the file itself."""
+    accepted = {part.split(";")[0].strip() for part in accept_encoding.lower().split(",")}
+    for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+        candidate = path.with_name(path.name + suffix)
+        if encoding in accepted and candidate.is_file():
+            return candidate, encoding
+    return path, None
+
+
+def static_response(request: Request, path: Path, cache_control: str):
+    """FileResponse with a content ETag, 304 on If-None-Match and a precompressed variant.
+
+    Each encoding is a different representation, so .br / .gz bodies get the
+    content ETag with the encoding appended; a strong ETag must not be shared
+    between byte-different responses.
+    """
+    stat = path.stat()
+    variant, encoding = _encoded_variant(path, request.headers.get("accept-encoding", ""))
+    etag = _file_etag(str(path), stat.st_mtime_ns, stat.st_size)
+    if encoding:
+        etag = f'{etag[:-1]}-{encoding}"'
+    headers = {"Cache-Control": cache_control, "ETag": etag, "Vary": "Accept-Encoding"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+    return FileResponse(variant, media_type=media_type, headers=headers)
 
 
 # ── Routes ───────────────────────────────────────────────────────────
 @app.get("/")
-def index():
-    return FileResponse(STATIC_DIR / "index.html")
+def index(request: Request):
+    """The UI page. Always revalidated (no-cache), so a repeat load is one 304;
+    the fingerprinted assets it references are cached for good."""
+    built = DIST_DIR / "index.html"
+    return static_response(request, built if built.is_file() else STATIC_DIR / "index.html", "no-cache")
+
+
+@app.get(DIST_PREFIX + "{asset:path}")
+def dist_asset(asset: str, request: Request):
+    """Fingerprinted build output: the name changes with the content, so it never needs revalidation."""
+    path = (DIST_DIR / asset).resolve()
+    if not path.is_relative_to(DIST_DIR.resolve()) or not path.is_file() or path.suffix in (".gz", ".br"):
+        raise HTTPException(status_code=404, detail="Not found")
+    cache = "no-cache" if path.name in ("index.html", "manifest.json") else IMMUTABLE_CACHE
+    return static_response(request, path, cache)
 
 
 @app.get("/healthz")
@@ -132,16 +1029,42 @@ def healthz():
 
 
 @app.get("/search", response_model=list[SearchResult])
-def search(q: str = Query(..., description="Natural language query"), k: int = 5):
-    vec = embed_query(q)
-    rows = fetch_matches(vec, limit=k)
+def search(
+    request: Request,
+    q: str = Query(..., description="Natural language query"),
+    k: int = 5,
+    fields: str | None = Query(None, description="Comma-separated fields to return, e.g. 'id,title,snippet'"),
+    snippet: bool = Query(False, description="Return a highlighted window instead of the full content"),
+    snippet_chars: int = Query(240, ge=40, le=2000),
+    rerank: bool | None = Query(None, description="Cross-encoder rerank (default: RERANK_ENABLED)"),
+    expand: int | None = Query(None, ge=0, le=5,
+                               description="Merge ±N neighbouring chunks into each hit (default: EXPAND_NEIGHBORS)"),
+):
+    if fields:
+        wanted = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in wanted if f not in SEARCH_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    else:
+        wanted = [f for f in SEARCH_FIELDS if f != "snippet"]
+    if snippet:
+        wanted = [f for f in wanted if f != "content"]
+        if "snippet" not in wanted:
+            wanted.append("snippet")
+
+    rows = retrieve(q, k, rerank, access_scope(request), expand)
     if not rows:
         raise HTTPException(status_code=404, detail="No results")
-    return [
-        SearchResult(id=r[0], source_url=r[1], title=r[2], license=r[3],
-                     language=r[4], content=r[5], score=float(r[6]))
-        for r in rows
-    ]
+
+    pattern = _query_pattern(q) if "snippet" in wanted else None
+    out = []
+    for r in rows:
+        d = _row_to_dict(r)
+        if "snippet" in wanted:
+            d["snippet"] = make_snippet(r[5] or "", q, snippet_chars, pattern)
+        out.append({f: d.get(f) for f in wanted})
+    # Plain dicts go straight to orjson, skipping response_model validation
+    return ORJSONResponse(out)
 
 
 
@@ -158,9 +1081,10 @@ TOOLS = [
                     "current_a": {"type": "number", "description": "Sähkövirta ampeereina (A)"},
                     "time_s": {"type": "number", "description": "Aika sekunteina (s)"},
                     "molar_mass": {"type": "number", "description": "Aineen moolimassa (g/mol), esim. Cu=63.546"},
-                    "electrons": {"type": "integer", "description": "Siirtyvien elektronien hapetusluku (z), esim. Cu=2"}
+                    "electrons": {"type": "integer", "description": "Siirtyvien elektronien hapetusluku (z), esim. Cu=2"},
+                    "material": {"type": "string", "description": "Metalli tai kylpy, esim. 'Cu', 'kupari', 'Watts-nikkeli'; täyttää moolimassan ja z:n"}
                 },
-                "required": ["current_a", "time_s", "molar_mass", "electrons"]
+                "required": ["current_a", "time_s"]
             }
         }
     },
@@ -174,9 +1098,10 @@ TOOLS = [
                 "properties": {
                     "mass_g": {"type": "number", "description": "Saostunut massa grammoina (g)"},
                     "density_g_cm3": {"type": "number", "description": "Pinnoitteen tiheys (g/cm³), esim Cu=8.96"},
-                    "area_dm2": {"type": "number", "description": "Pinta-ala neliödesimetreinä (dm²)"}
+                    "area_dm2": {"type": "number", "description": "Pinta-ala neliödesimetreinä (dm²)"},
+                    "material": {"type": "string", "description": "Pinnoitemetalli, esim. 'Ni' tai 'nikkeli'; täyttää tiheyden"}
                 },
-                "required": ["mass_g", "density_g_cm3", "area_dm2"]
+                "required": ["mass_g", "area_dm2"]
             }
         }
     },
@@ -227,14 +1152,150 @@ TOOLS = [
                 "required": ["value", "from_prefix", "to_prefix", "unit_symbol"]
             }
         }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "domain_unit_conversion",
+            "description": (
+                "Muuntaa arvon mielivaltaisten (myös yhdistettyjen) yksiköiden välillä ja tarkistaa dimensiot. "
+                "Esim. µm ↔ mil, A/dm² ↔ ASF, g/L ↔ oz/gal, kWh ↔ MJ, °C ↔ °F, L/h ↔ gpm. "
+                "Moolimassalla tai tiheydellä myös suureiden välillä: g/L → mol/L, µm → g/dm², ppm → mg/L."
+            ),
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "value": {"type": "number", "description": "Muunnettava lukuarvo"},
+                    "from_unit": {"type": "string", "description": "Lähtöyksikkö, esim. 'A/dm²', 'µm', 'g/L', '°C'"},
+                    "to_unit": {"type": "string", "description": "Kohdeyksikkö, esim. 'ASF', 'mil', 'oz/gal', '°F'"},
+                    "molar_mass_g_mol": {"type": "number", "description": "Moolimassa (g/mol), tarvitaan esim. g/L → mol/L"},
+                    "density_g_cm3": {"type": "number", "description": "Tiheys (g/cm³), tarvitaan esim. µm → g/dm²"}
+                },
+                "required": ["value", "from_unit", "to_unit"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "material_lookup",
+            "description": (
+                "Hakee metallin, seoksen tai pinnoituskylvyn ominaisuudet (moolimassa, elektronit z, tiheys, "
+                "normaalipotentiaali; kylvyille koostumus, hyötysuhde ja virtatiheysalue). "
+                "Hyväksyy kemiallisen merkin sekä suomen- tai englanninkielisen nimen."
+            ),
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string", "description": "Esim. 'Cu', 'kupari', 'brass', 'Watts-nikkeli'"}
+                },
+                "required": ["name"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "plating_plan",
+            "description": (
+                "Käänteinen pinnoitussuunnittelu yhdellä kutsulla: ratkaisee pinnoitusajan, virtatiheyden tai "
+                "pinnoitettavan pinta-alan tavoitepaksuudelle parametriruudukon yli (virtatiheydet, ajat, "
+                "virtahyötysuhteet, kappaleiden pinta-alat). Palauttaa toteuttamiskelpoisen alueen, parhaat "
+                "vaihtoehdot ja optimin. Käytä tätä useiden peräkkäisten Faraday-laskujen sijaan."
+            ),
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "target_thickness_um": {"type": "number", "description": "Tavoitepaksuus (µm)"},
+                    "molar_mass": {"type": "number", "description": "Moolimassa (g/mol), esim. Cu=63.546"},
+                    "electrons": {"type": "integer", "description": "Elektronien lukumäärä (z), esim. Cu=2"},
+                    "density_g_cm3": {"type": "number", "description": "Pinnoitteen tiheys (g/cm³), esim. Cu=8.96"},
+                    "solve_for": {
+                        "type": "string",
+                        "enum": ["time", "current_density", "area"],
+                        "description": "Ratkaistava suure: aika, virtatiheys tai pinta-ala (kappalemäärä)"
+                    },
+                    "current_density_a_dm2": {"type": "array", "items": {"type": "number"},
+                                              "description": "Kokeiltavat virtatiheydet (A/dm²), solve_for=time"},
+                    "time_s": {"type": "array", "items": {"type": "number"},
+                               "description": "Kokeiltavat ajat (s), solve_for=current_density tai area"},
+                    "current_efficiency": {"type": "array", "items": {"type": "number"},
+                                           "description": "Virtahyötysuhteet osuuksina (0–1) tai prosentteina (1–100), ei sekaisin; oletus 1.0"},
+                    "area_dm2": {"type": "array", "items": {"type": "number"},
+                                 "description": "Yhden kappaleen pinta-ala(t) (dm²)"},
+                    "parts": {"type": "integer", "description": "Kappalemäärä samassa erässä"},
+                    "current_a": {"type": "number", "description": "Käytettävissä oleva virta (A), solve_for=area"},
+                    "max_current_a": {"type": "number", "description": "Tasasuuntaajan maksimivirta (A)"},
+                    "max_time_s": {"type": "number", "description": "Suurin sallittu pinnoitusaika (s)"},
+                    "current_density_range": {"type": "array", "items": {"type": "number"},
+                                              "description": "Kylvyn käyttöikkuna [min, max] (A/dm²)"},
+                    "material": {"type": "string", "description": (
+                        "Metalli, seos tai kylpy, esim. 'Cu', 'messinki', 'kovakromi'; täyttää M:n, z:n, tiheyden "
+                        "sekä kylvyille hyötysuhteen ja virtatiheysikkunan")}
+                },
+                "required": ["target_thickness_um", "solve_for"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "plating_line_simulation",
+            "description": (
+                "Simuloi pinnoituslinjan läpäisyä (diskreettitapahtumasimulaatio, Monte Carlo -toistot): "
+                "asemat järjestyksessä, allaspaikat, nostimet, siirtoajat ja prosessiaikojen vaihtelu. "
+                "Palauttaa kappaleet tunnissa (keskiarvo, p5, p95), läpimenoajan, asemien käyttöasteet, "
+                "nostimen käyttöasteen ja pullonkaulan. Pinnoitusaseman ajan voi antaa paksuutena ja "
+                "virtatiheytenä, jolloin aika lasketaan Faradayn laista."
+            ),
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "stations": {
+                        "type": "array",
+                        "description": "Linjan asemat järjestyksessä",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "name": {"type": "string", "description": "Aseman nimi"},
+                                "time_s": {"type": "number", "description": "Prosessiaika (s)"},
+                                "capacity": {"type": "integer", "description": "Rinnakkaiset allaspaikat, oletus 1"},
+                                "kind": {"type": "string", "description": "'rinse' = huuhtelu ilman vaihtelua"},
+                                "cv": {"type": "number", "description": "Prosessiajan variaatiokerroin"},
+                                "plating": {
+                                    "type": "object",
+                                    "description": (
+                                        "Aika time_s:n sijaan: {thickness_um, current_density_a_dm2, material} "
+                                        "tai material-kentän sijaan molar_mass, electrons, density_g_cm3")
+                                }
+                            },
+                            "required": ["name"]
+                        }
+                    },
+                    "hoists": {"type": "integer", "description": "Nostimien lukumäärä, oletus 1"},
+                    "transfer_time_s": {"type": "number", "description": "Yhden siirron kesto (s), oletus 30"},
+                    "load_interval_s": {"type": "number",
+                                        "description": "Lastausväli (s); puuttuessa linja lastataan niin nopeasti kuin ehtii"},
+                    "parts_per_carrier": {"type": "integer", "description": "Kappaleita per teline/rumpu"},
+                    "duration_h": {"type": "number", "description": "Simuloitu vuoron pituus (h), oletus 8, enintään 24"},
+                    "variability": {"type": "number", "description": "Prosessiaikojen oletusvariaatiokerroin, oletus 0.05"},
+                    "replications": {"type": "integer", "description": "Monte Carlo -toistojen määrä, oletus 20, enintään 50"}
+                },
+                "required": ["stations"]
+            }
+        }
     }
 ]
 
 TOOL_DISPATCH = {
-    "faraday_mass_calculation": st.faraday_mass_calculation,
-    "faraday_thickness_calculation": st.faraday_thickness_calculation,
+    "faraday_mass_calculation": md.with_material(st.faraday_mass_calculation),
+    "faraday_thickness_calculation": md.with_material(st.faraday_thickness_calculation),
     "current_density_calculation": st.current_density_calculation,
     "unit_conversion": st.unit_conversion,
+    "domain_unit_conversion": uc.domain_unit_conversion,
+    "material_lookup": md.material_lookup,
+    "plating_plan": md.with_material(pp.plating_plan),
+    "plating_line_simulation": ls.plating_line_simulation,
 }
 
 
@@ -326,20 +1387,32 @@ def generate_summary(client, deployment_name: str, old_summary: str | None,
 @app.on_event("startup")
 def on_startup():
     ensure_session_tables()
+    ensure_document_columns()
+    ensure_embedding_state()
+    current_embedding(refresh=True)
+    if PROFILE_TRACEMALLOC and not tracemalloc.is_tracing():
+        tracemalloc.start(1)
+    if RERANK_ENABLED:
+        # Load the cross-encoder in the background so the first request
+        # falls back to vector order instead of waiting for it
+        _rerank_pool.submit(_get_reranker)
 
 
 # ── POST /ask ────────────────────────────────────────────────────────
 @app.post("/ask", response_model=AskResponse)
-def ask(req: AskRequest):
+def ask(req: AskRequest, request: Request):
     q = req.question
-    vec = embed_query(q)
-    rows = fetch_matches(vec, limit=req.k)
-
-    results = [
-        SearchResult(id=r[0], source_url=r[1], title=r[2], license=r[3],
-                     language=r[4], content=r[5], score=float(r[6]))
-        for r in rows
-    ]
+    rows = retrieve(q, req.k, req.rerank, access_scope(request), req.expand)
+
+    results = [SearchResult(**_row_to_dict(r)) for r in rows]
+    if req.snippet:
+        pattern = _query_pattern(q)
+        sources = [
+            r.model_copy(update={"content": None, "snippet": make_snippet(r.content or "", q, pattern=pattern)})
+            for r in results
+        ]
+    else:
+        sources = results
 
     client = None
     api_key = os.getenv("AZURE_OPENAI_API_KEY")
@@ -354,8 +1427,9 @@ def ask(req: AskRequest):
         )
 
     # Session management
-    session_id = get_or_create_session(req.session_id, q)
-    old_summary = get_session_summary(session_id)
+    with stage("session"):
+        session_id = get_or_create_session(req.session_id, q)
+        old_summary = get_session_summary(session_id)
 
     if not client:
         # Fallback: no LLM
@@ -371,11 +1445,12 @@ def ask(req: AskRequest):
         fallback_answer = "".join(answer_parts)
         save_message(session_id, "user", q)
         save_message(session_id, "assistant", fallback_answer)
-        return AskResponse(answer=fallback_answer, sources=results, session_id=session_id)
+        return AskResponse(answer=fallback_answer, sources=sources, session_id=session_id)
 
     # Context building
-    context_texts = [f"Lähde: {r.title}\n{r.content}" for r in results]
-    context_str = "\n\n---\n\n".join(context_texts)
+    with stage("prompt"):
+        context_texts = [f"Lähde: {r.title}\n{r.content}" for r in results]
+        context_str = "\n\n---\n\n".join(context_texts)
 
     summary_block = ""
     if old_summary:
@@ -401,12 +1476,13 @@ def ask(req: AskRequest):
     ]
 
     try:
-        response = client.chat.completions.create(
-            model=deployment_name,
-            messages=messages,
-            tools=TOOLS,
-            tool_choice="auto"
-        )
+        with stage("llm"):
+            response = client.chat.completions.create(
+                model=deployment_name,
+                messages=messages,
+                tools=TOOLS,
+                tool_choice="auto"
+            )
         msg = response.choices[0].message
 
         # Tool execution loop
@@ -416,37 +1492,41 @@ def ask(req: AskRequest):
                 func_name = tool_call.function.name
                 args = json.loads(tool_call.function.arguments)
                 handler = TOOL_DISPATCH.get(func_name)
-                tool_result = handler(**args) if handler else {"error": f"Unknown tool: {func_name}"}
+                with stage(f"tool:{func_name}"):
+                    tool_result = handler(**args) if handler else {"error": f"Unknown tool: {func_name}"}
                 messages.append({
                     "role": "tool",
                     "tool_call_id": tool_call.id,
                     "content": json.dumps(tool_result)
                 })
 
-            second_response = client.chat.completions.create(
-                model=deployment_name,
-                messages=messages
-            )
+            with stage("llm_followup"):
+                second_response = client.chat.completions.create(
+                    model=deployment_name,
+                    messages=messages
+                )
             final_answer = second_response.choices[0].message.content
         else:
             final_answer = msg.content
 
         # Persist Q+A and update summary
-        save_message(session_id, "user", q)
-        save_message(session_id, "assistant", final_answer)
+        with stage("persist"):
+            save_message(session_id, "user", q)
+            save_message(session_id, "assistant", final_answer)
 
-        new_summary = generate_summary(client, deployment_name, old_summary, q, final_answer)
-        if new_summary:
-            update_session_summary(session_id, new_summary)
+        with stage("summary"):
+            new_summary = generate_summary(client, deployment_name, old_summary, q, final_answer)
+            if new_summary:
+                update_session_summary(session_id, new_summary)
 
-        return AskResponse(answer=final_answer, sources=results, session_id=session_id)
+        return AskResponse(answer=final_answer, sources=sources, session_id=session_id)
     except Exception as e:
         import traceback
         traceback.print_exc()
         save_message(session_id, "user", q)
         err_answer = f"Virhe kielimallin käytössä: {str(e)}"
         save_message(session_id, "assistant", err_answer)
-        return AskResponse(answer=err_answer, sources=results, session_id=session_id)
+        return AskResponse(answer=err_answer, sources=sources, session_id=session_id)
 
 
 # ── Session CRUD endpoints ───────────────────────────────────────────
@@ -468,8 +1548,7 @@ def list_sessions():
     ]
 
 
-@app.get("/sessions/{session_id}", response_model=SessionDetail)
-def get_session(session_id: str):
+def _session_info(session_id: str) -> SessionInfo:
     conn = get_conn()
     with conn.cursor() as cur:
         cur.execute(
@@ -479,24 +1558,33 @@ def get_session(session_id: str):
         s = cur.fetchone()
     if not s:
         raise HTTPException(status_code=404, detail="Session not found")
-
-    with conn.cursor() as cur:
-        cur.execute(
-            "SELECT role, content, created_at FROM messages "
-            "WHERE session_id = %s ORDER BY created_at",
-            (session_id,)
-        )
-        msgs = cur.fetchall()
-
-    return SessionDetail(
-        session=SessionInfo(
-            id=str(s[0]), title=s[1], summary=s[2],
-            created_at=s[3].isoformat(), updated_at=s[4].isoformat()
-        ),
-        messages=[{"role": m[0], "content": m[1], "created_at": m[2].isoformat()} for m in msgs]
+    return SessionInfo(
+        id=str(s[0]), title=s[1], summary=s[2],
+        created_at=s[3].isoformat(), updated_at=s[4].isoformat()
     )
 
 
+def _message_dict(m) -> dict:
+    return {"role": m[0], "content": m[1], "created_at": m[2].isoformat()}
+
+
+@app.get("/sessions/{session_id}", response_model=SessionDetail)
+def get_session(session_id: str, format: str = Query("json", pattern="^(json|ndjson)$")):
+    """Session with its messages. format=ndjson streams one JSON object per
+    line – first {"session": ...}, then one line per message – so memory stays
+    flat however long the session is."""
+    info = _session_info(session_id)
+    if format == "ndjson":
+        def lines():
+            yield orjson.dumps({"session": info.model_dump()}) + b"\n"
+            for m in iter_messages(session_id):
+                yield orjson.dumps(_message_dict(m)) + b"\n"
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    return SessionDetail(session=info, messages=[_message_dict(m) for m in iter_messages(session_id)])
+
+
 @app.delete("/sessions/{session_id}")
 def delete_session(session_id: str):
     conn = get_conn()
@@ -516,41 +1604,46 @@ class ReportResponse(BaseModel):
     report_markdown: str
 
 
-@app.get("/sessions/{session_id}/report", response_model=ReportResponse)
-def session_report(session_id: str):
-    """Generate a structured Markdown report of the entire session."""
-    conn = get_conn()
-    with conn.cursor() as cur:
-        cur.execute(
-            "SELECT id, title, summary FROM sessions WHERE id = %s",
-            (session_id,)
-        )
-        s = cur.fetchone()
-    if not s:
-        raise HTTPException(status_code=404, detail="Session not found")
+def _transcript_block(m) -> str:
+    role_label = "Käyttäjä" if m[0] == "user" else "Assistentti"
+    return f"**{role_label}** ({m[2].strftime('%H:%M')}):\n{m[1]}"
 
-    with conn.cursor() as cur:
-        cur.execute(
-            "SELECT role, content, created_at FROM messages "
-            "WHERE session_id = %s ORDER BY created_at",
-            (session_id,)
+
+def _stream_transcript_markdown(session: SessionInfo):
+    """Markdown export of a session, produced message by message from the cursor."""
+    yield f"# {session.title or 'Keskustelu'}\n\n"
+    if session.summary:
+        yield f"> {session.summary}\n\n"
+    first = True
+    for m in iter_messages(session.id):
+        yield ("" if first else "\n\n---\n\n") + _transcript_block(m)
+        first = False
+    yield "\n" if not first else "Ei viestejä tässä sessiossa.\n"
+
+
+@app.get("/sessions/{session_id}/report", response_model=ReportResponse)
+def session_report(session_id: str, format: str = Query("json", pattern="^(json|markdown)$")):
+    """Generate a structured Markdown report of the entire session.
+
+    format=markdown streams the full transcript as a .md download instead
+    (no LLM call), with memory use independent of the session length."""
+    info = _session_info(session_id)
+    if format == "markdown":
+        return StreamingResponse(
+            _stream_transcript_markdown(info),
+            media_type="text/markdown; charset=utf-8",
+            headers={"Content-Disposition": f'attachment; filename="session-{session_id}.md"'},
         )
-        msgs = cur.fetchall()
 
-    if not msgs:
+    # Build conversation transcript for LLM
+    transcript = "\n\n---\n\n".join(_transcript_block(m) for m in iter_messages(session_id))
+    if not transcript:
         return ReportResponse(
             session_id=session_id,
-            title=s[1],
+            title=info.title,
             report_markdown="Ei viestejä tässä sessiossa."
         )
 
-    # Build conversation transcript for LLM
-    transcript_lines = []
-    for m in msgs:
-        role_label = "Käyttäjä" if m[0] == "user" else "Assistentti"
-        transcript_lines.append(f"**{role_label}** ({m[2].strftime('%H:%M')}):\n{m[1]}")
-    transcript = "\n\n---\n\n".join(transcript_lines)
-
     api_key = os.getenv("AZURE_OPENAI_API_KEY")
     endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
     deployment_name = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-35-turbo")
@@ -559,8 +1652,8 @@ def session_report(session_id: str):
         # Fallback: return raw transcript
         return ReportResponse(
             session_id=session_id,
-            title=s[1],
-            report_markdown=f"# {s[1] or 'Keskustelu'}\n\n{transcript}"
+            title=info.title,
+            report_markdown=f"# {info.title or 'Keskustelu'}\n\n{transcript}"
         )
 
     client = AzureOpenAI(
@@ -593,15 +1686,48 @@ def session_report(session_id: str):
         report_md = resp.choices[0].message.content
     except Exception as e:
         log.warning("Report generation failed: %s", e)
-        report_md = f"# {s[1] or 'Keskustelu'}\n\nRaportin generointi epäonnistui: {e}\n\n---\n\n{transcript}"
+        report_md = f"# {info.title or 'Keskustelu'}\n\nRaportin generointi epäonnistui: {e}\n\n---\n\n{transcript}"
 
     return ReportResponse(
         session_id=session_id,
-        title=s[1],
+        title=info.title,
         report_markdown=report_md
     )
 
 
+# ── Calculation endpoints ────────────────────────────────────────────
+GridSpec = float | list[float] | dict[str, float]
+
+
+class PlatingPlanRequest(BaseModel):
+    target_thickness_um: float
+    # Either the material parameters or a material name ("Cu", "kupari", "hard chrome")
+    material: str | None = None
+    molar_mass: float | None = None
+    electrons: int | None = None
+    density_g_cm3: float | None = None
+    solve_for: str = "time"
+    current_density_a_dm2: GridSpec | None = None
+    time_s: GridSpec | None = None
+    current_efficiency: GridSpec | None = None
+    area_dm2: GridSpec | None = None
+    parts: int = 1
+    current_a: float | None = None
+    max_current_a: float | None = None
+    max_time_s: float | None = None
+    current_density_range: tuple[float, float] | None = None
+    top: int = Field(5, ge=1, le=100)
+
+
+@app.post("/calc/plating-plan")
+def plating_plan(req: PlatingPlanRequest):
+    """Inverse plating solve over parameter grids (same as the plating_plan tool)."""
+    result = TOOL_DISPATCH["plating_plan"](**req.model_dump(exclude_none=True))
+    if "error" in result:
+        raise HTTPException(status_code=400, detail=result["error"])
+    return result
+
+
 # Serve static files (CSS, JS, images, etc.)
 app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 
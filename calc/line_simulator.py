@@ -0,0 +1,335 @@
+"""
+Pinnoituslinjan diskreettitapahtumasimulaatio.
+
+Linja on järjestetty lista asemia (prosessialtaat, huuhtelut, kuivaimet),
+joista jokaisella on yksi tai useampi rinnakkainen allaspaikka. Telineet
+tulevat lastausasemalle lastausvälin mukaan, ja yhteiset nostimet siirtävät
+niitä asemalta toiselle. Teline varaa altaansa, kunnes nostin ehtii siirtää
+sen ja seuraavalla asemalla on vapaa allaspaikka (esto palvelun jälkeen).
+Nostimet palvelevat ensin linjassa pisimmällä odottavaa telinettä, jolloin
+linja ei lukkiudu.
+
+Pinnoitusaseman ajan voi antaa suoraan tai laskea tavoitepaksuudesta
+Faradayn laista (pinnoitussuunnittelijan kautta). Prosessi- ja siirtoajat
+vaihtelevat lognormaalisti annetulla variaatiokertoimella. Monte Carlo
+-toistot ajetaan prosessipoolissa, ja niiden hajonta raportoidaan läpäisyn,
+allaskäyttöasteiden ja pullonkaulan kanssa.
+"""
+
+import heapq
+import math
+import multiprocessing
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from calc.material_data import find_material
+from calc.plating_planner import plating_plan
+
+# Tätä pienemmillä toistomäärillä poolin käynnistys maksaa enemmän kuin säästää
+_PARALLEL_MIN_RUNS = 4
+# Ylärajat, jotta työkalukutsu vastaa interaktiivisesti (noin 5–10 ms
+# simuloitua tuntia ja toistoa kohden)
+MAX_DURATION_H = 24.0
+MAX_REPLICATIONS = 50
+_pool: ProcessPoolExecutor | None = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: API-prosessi on monisäikeinen, joten sen forkkaaminen ei ole turvallista
+        _pool = ProcessPoolExecutor(max_workers=min(os.cpu_count() or 1, 8),
+                                    mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def _sample(rng: random.Random, mean: float, cv: float) -> float:
+    """Lognormaali arvonta annetulla keskiarvolla ja variaatiokertoimella."""
+    if cv <= 0 or mean <= 0:
+        return mean
+    sigma2 = math.log1p(cv * cv)
+    return rng.lognormvariate(math.log(mean) - sigma2 / 2, math.sqrt(sigma2))
+
+
+def _overlap(a: float, b: float, lo: float, hi: float) -> float:
+    return max(0.0, min(b, hi) - max(a, lo))
+
+
+def station_time_s(station: dict) -> float:
+    """Aseman prosessiaika: `time_s` tai pinnoitusmäärittelystä ratkaistu aika.
+
+    plating = {"thickness_um", "current_density_a_dm2" sekä joko "material"
+    tai "molar_mass"/"electrons"/"density_g_cm3", valinnainen "current_efficiency"}
+    """
+    if "time_s" in station:
+        time_s = float(station["time_s"])
+        if not time_s > 0:
+            raise ValueError(f"Aseman {station.get('name')} prosessiajan (time_s) on oltava positiivinen")
+        return time_s
+    spec = dict(station["plating"])
+    m = None
+    if "material" in spec:
+        name = spec.pop("material")
+        m = find_material(name)
+        if m is None:
+            raise ValueError(f"Aseman {station.get('name')} materiaali on tuntematon: '{name}'")
+        spec.setdefault("molar_mass", m["molar_mass"])
+        spec.setdefault("electrons", m["electrons"])
+        spec.setdefault("density_g_cm3", m["density_g_cm3"])
+        if m.get("current_efficiency"):
+            spec.setdefault("current_efficiency", m["current_efficiency"])
+    plan = plating_plan(
+        spec["thickness_um"], spec["molar_mass"], spec["electrons"], spec["density_g_cm3"],
+        solve_for="time", current_density_a_dm2=spec["current_density_a_dm2"],
+        current_efficiency=spec.get("current_efficiency", 1.0), area_dm2=1.0,
+    )
+    if plan.get("optimum") is None:
+        raise ValueError(f"Aseman {station.get('name')} pinnoitusaikaa ei voitu laskea: {plan.get('error')}")
+    return plan["optimum"]["time_s"]
+
+
+def simulate_once(times: list[float], caps: list[int], cvs: list[float], hoists: int,
+                  transfer_s: float, transfer_cv: float, load_interval_s: float | None,
+                  duration_s: float, warmup_s: float, seed: int) -> dict:
+    """Yksi toisto. Palauttaa valmistuneet telineet sekä asemakohtaiset
+    käyttö- ja estosekunnit, kaikki lämpenemisjakson jälkeen mitattuina."""
+    if not transfer_s > 0 or (load_interval_s is not None and not load_interval_s > 0):
+        # Nollaväli ajoittaisi tapahtuman aina samaan hetkeen, eikä simulointi etenisi
+        raise ValueError("Siirtoajan ja lastausvälin on oltava positiivisia")
+    rng = random.Random(seed)
+    n = len(times)
+    occupied = [0] * n
+    busy = [0.0] * n
+    blocked = [0.0] * n
+    hoist_busy = 0.0
+    free_hoists = hoists
+    load_queue = math.inf if load_interval_s is None else 0
+    ready: list[tuple[int, float, float]] = []  # (asema, valmistumisaika, telineen aloitusaika)
+    events: list[tuple] = []
+    seq = 0
+    completed = 0
+    lead_times: list[float] = []
+
+    def push(t, kind, payload):
+        nonlocal seq
+        heapq.heappush(events, (t, seq, kind, payload))
+        seq += 1
+
+    def dispatch(t):
+        nonlocal free_hoists, hoist_busy, load_queue
+        while free_hoists > 0:
+            # Linjassa pisimmällä oleva teline ensin; lastausasema viimeisenä
+            ready.sort(key=lambda r: (-r[0], r[1]))
+            pick = None
+            for k, (i, _, _) in enumerate(ready):
+                if i + 1 == n or occupied[i + 1] < caps[i + 1]:
+                    pick = k
+                    break
+            if pick is not None:
+                i, ready_t, start = ready.pop(pick)
+                occupied[i] -= 1
+                blocked[i] += _overlap(ready_t, t, warmup_s, duration_s)
+            elif load_queue > 0 and occupied[0] < caps[0]:
+                load_queue -= 1
+                i, start = -1, t
+            else:
+                return
+            j = i + 1
+            if j < n:
+                occupied[j] += 1  # varattu nostimen siirron ajaksi
+            dur = _sample(rng, transfer_s, transfer_cv)
+            free_hoists -= 1
+            hoist_busy += _overlap(t, t + dur, warmup_s, duration_s)
+            push(t + dur, "moved", (j, start))
+
+    if load_interval_s is not None:
+        push(0.0, "arrive", None)
+    dispatch(0.0)
+    while events:
+        t, _, kind, payload = heapq.heappop(events)
+        if t > duration_s:
+            break
+        if kind == "arrive":
+            load_queue += 1
+            push(t + load_interval_s, "arrive", None)
+        elif kind == "moved":
+            free_hoists += 1
+            j, start = payload
+            if j == n:
+                if t >= warmup_s:
+                    completed += 1
+                    lead_times.append(t - start)
+            else:
+                dur = _sample(rng, times[j], cvs[j])
+                busy[j] += _overlap(t, t + dur, warmup_s, duration_s)
+                push(t + dur, "done", (j, start))
+        else:  # done
+            j, start = payload
+            ready.append((j, t, start))
+        dispatch(t)
+
+    # Lopussa yhä odottavat telineet olivat estyneinä simuloinnin loppuun asti
+    for i, ready_t, _ in ready:
+        blocked[i] += _overlap(ready_t, duration_s, warmup_s, duration_s)
+    return {
+        "completed": completed,
+        "busy_s": busy,
+        "blocked_s": blocked,
+        "hoist_busy_s": hoist_busy,
+        "lead_time_s": float(np.mean(lead_times)) if lead_times else None,
+    }
+
+
+def _run(args: tuple) -> dict:
+    return simulate_once(*args)
+
+
+def plating_line_simulation(
+    stations: list[dict],
+    hoists: int = 1,
+    transfer_time_s: float = 30.0,
+    load_interval_s: float | None = None,
+    parts_per_carrier: int = 1,
+    duration_h: float = 8.0,
+    warmup_h: float | None = None,
+    variability: float = 0.05,
+    replications: int = 20,
+    seed: int = 1,
+) -> dict:
+    """
+    Simuloi pinnoituslinjan ja raportoi läpäisyn, allaskäyttöasteet ja pullonkaulan.
+
+    Argumentit:
+    - stations (list[dict]): Asemat linjajärjestyksessä. Kullakin on "name" ja joko "time_s"
+      tai "plating" (ks. station_time_s), valinnainen "capacity" (rinnakkaiset allaspaikat,
+      oletus 1), "kind" ("process", "rinse", "dryer"; huuhteluilla ei oletuksena vaihtelua) ja "cv".
+    - hoists (int): Linjan yhteisten nostimien lukumäärä
+    - transfer_time_s (float): Yhden siirron keskimääräinen kesto: nosto, siirto, valutus ja lasku (s)
+    - load_interval_s (float, valinnainen): Telineiden väli lastausasemalla (s);
+      None lastaa niin nopeasti kuin linja ottaa vastaan
+    - parts_per_carrier (int): Kappaleita yhdessä telineessä
+    - duration_h (float): Simuloitu aika per toisto (h), enintään MAX_DURATION_H
+    - warmup_h (float, valinnainen): Hylättävä käynnistysjakso, oletus 20 % kestosta (enintään 1 h)
+    - variability (float): Prosessi- ja siirtoaikojen oletusvariaatiokerroin
+    - replications (int): Monte Carlo -toistot (enintään MAX_REPLICATIONS), ajetaan prosessipoolissa
+    - seed (int): Satunnaislukujen perussiemen
+
+    Esimerkki:
+      plating_line_simulation([
+          {"name": "rasvanpoisto", "time_s": 600},
+          {"name": "huuhtelu 1", "time_s": 60, "kind": "rinse"},
+          {"name": "hapan kupari", "plating": {"thickness_um": 25, "current_density_a_dm2": 3,
+                                               "material": "acid copper"}, "capacity": 3},
+          {"name": "huuhtelu 2", "time_s": 60, "kind": "rinse"},
+      ], hoists=1, transfer_time_s=45, parts_per_carrier=20)
+
+    Palauttaa:
+    - dict: Sisältää:
+        'parts_per_hour' (dict): Kappaleet tunnissa (mean, p5, p95)
+        'carriers_per_hour' (float): Telineet tunnissa
+        'stations' (list): Asemittain aika, käyttöaste ja estyneen ajan osuus
+        'hoist_utilization' (float): Nostimien käyttöaste
+        'bottleneck' (dict): Kuormitetuin resurssi
+        'capacity_bound_parts_per_hour' (float): Staattinen kapasiteettiraja
+        'calculation_steps' (str): Laskukaava ja vaiheet LaTeX-muodossa
+    """
+    try:
+        if not stations:
+            raise ValueError("Linjalla on oltava vähintään yksi asema")
+        if hoists < 1:
+            raise ValueError("Linjalla on oltava vähintään yksi nostin")
+        if not transfer_time_s > 0:
+            raise ValueError("Siirtoajan (transfer_time_s) on oltava positiivinen")
+        if load_interval_s is not None and not load_interval_s > 0:
+            raise ValueError("Lastausvälin (load_interval_s) on oltava positiivinen tai puuttua")
+        if parts_per_carrier < 1:
+            raise ValueError("Telineessä on oltava vähintään yksi kappale")
+        if not 0 < duration_h <= MAX_DURATION_H:
+            raise ValueError(f"Simuloidun ajan (duration_h) on oltava yli 0 ja enintään {MAX_DURATION_H:g} h")
+        if not 1 <= replications <= MAX_REPLICATIONS:
+            raise ValueError(f"Toistoja (replications) on oltava 1–{MAX_REPLICATIONS}")
+        names = [s.get("name", f"asema {i + 1}") for i, s in enumerate(stations)]
+        times = [station_time_s(s) for s in stations]
+        caps = [max(1, int(s.get("capacity", 1))) for s in stations]
+    except KeyError as e:
+        return {"error": f"Aseman tieto puuttuu: {e.args[0]}"}
+    except (TypeError, ValueError) as e:
+        return {"error": str(e)}
+    cvs = [float(s.get("cv", 0.0 if s.get("kind") == "rinse" else variability)) for s in stations]
+    duration_s = duration_h * 3600
+    warmup_s = (warmup_h * 3600) if warmup_h is not None else min(0.2 * duration_s, 3600.0)
+    window_h = (duration_s - warmup_s) / 3600
+    if window_h <= 0:
+        return {"error": "Lämpenemisjakson (warmup_h) on oltava lyhyempi kuin simuloitu aika (duration_h)"}
+
+    jobs = [(times, caps, cvs, hoists, transfer_time_s, variability, load_interval_s,
+             duration_s, warmup_s, seed + r) for r in range(replications)]
+    if len(jobs) >= _PARALLEL_MIN_RUNS:
+        runs = list(_get_pool().map(_run, jobs))
+    else:
+        runs = [_run(job) for job in jobs]
+
+    window_s = window_h * 3600
+    carriers_h = np.array([r["completed"] for r in runs]) / window_h
+    parts_h = carriers_h * parts_per_carrier
+    busy = np.array([r["busy_s"] for r in runs]) / (np.array(caps) * window_s)
+    blocked = np.array([r["blocked_s"] for r in runs]) / (np.array(caps) * window_s)
+    hoist_util = float(np.mean([r["hoist_busy_s"] for r in runs]) / (hoists * window_s))
+    leads = [r["lead_time_s"] for r in runs if r["lead_time_s"] is not None]
+
+    station_rows = []
+    for i, name in enumerate(names):
+        station_rows.append({
+            "name": name,
+            "time_s": round(times[i], 1),
+            "capacity": caps[i],
+            "utilization": round(float(busy[:, i].mean()), 3),
+            "blocked_share": round(float(blocked[:, i].mean()), 3),
+        })
+
+    # Staattiset rajat: asema tarvitsee telinettä ja allaspaikkaa kohden
+    # prosessiajan ja yhden siirron; teline tarvitsee n + 1 nostimen siirtoa.
+    station_bound = [3600 * caps[i] / (times[i] + transfer_time_s) for i in range(len(times))]
+    hoist_bound = 3600 * hoists / ((len(times) + 1) * transfer_time_s)
+    limit_i = int(np.argmin(station_bound))
+    bound = min(min(station_bound), hoist_bound)
+    if load_interval_s:
+        bound = min(bound, 3600 / load_interval_s)
+    busiest = int(np.argmax(busy.mean(axis=0)))
+    if hoist_util >= float(busy.mean(axis=0)[busiest]):
+        bottleneck = {"resource": "hoist", "utilization": round(hoist_util, 3)}
+    else:
+        bottleneck = {"resource": names[busiest], "utilization": station_rows[busiest]["utilization"]}
+
+    mean_parts = float(parts_h.mean())
+    bottleneck_name = "nostin" if bottleneck["resource"] == "hoist" else bottleneck["resource"]
+    latex_string = (
+        f"Simuloidaan {len(runs)} toistoa, kukin {duration_h} h "
+        f"(ensimmäiset {warmup_s / 3600:.2f} h hylätään lämpenemisjaksona).\n"
+        f"$$ \\text{{läpäisy}} = \\frac{{\\text{{valmiit telineet}} \\cdot {parts_per_carrier}}}"
+        f"{{{window_h:.2f}\\text{{ h}}}} \\approx {mean_parts:.1f}\\text{{ kpl/h}} $$\n\n"
+        f"Staattinen kapasiteettiraja: asema "
+        f"$\\frac{{3600 \\cdot c_i}}{{t_i + t_{{siirto}}}}$ (tiukin: {names[limit_i]}, "
+        f"${station_bound[limit_i] * parts_per_carrier:.1f}$ kpl/h), nostin "
+        f"$\\frac{{3600 \\cdot h}}{{(n+1) \\cdot t_{{siirto}}}} = {hoist_bound * parts_per_carrier:.1f}$ kpl/h.\n\n"
+        f"Tulos:\n"
+        f"Simuloinnin pullonkaula: {bottleneck_name} "
+        f"(käyttöaste {bottleneck['utilization'] * 100:.0f} %)."
+    )
+    return {
+        "parts_per_hour": {
+            "mean": round(mean_parts, 2),
+            "p5": round(float(np.percentile(parts_h, 5)), 2),
+            "p95": round(float(np.percentile(parts_h, 95)), 2),
+        },
+        "carriers_per_hour": round(float(carriers_h.mean()), 3),
+        "mean_lead_time_min": round(float(np.mean(leads)) / 60, 2) if leads else None,
+        "stations": station_rows,
+        "hoist_utilization": round(hoist_util, 3),
+        "bottleneck": bottleneck,
+        "capacity_bound_parts_per_hour": round(bound * parts_per_carrier, 2),
+        "calculation_steps": latex_string,
+    }
@@ -0,0 +1,265 @@
+"""
+Materiaaliominaisuustaulukot laskentafunktioille.
+
+Metallit, pinnoiteseokset ja yleiset kylpykemiat niillä parametreilla, joita
+Faradayn laskut tarvitsevat: moolimassa M (g/mol), elektronit z, tiheys rho
+(g/cm³) ja normaalipotentiaali E0 (V). Nimet tunnistetaan kemiallisista
+merkeistä, englannin- ja suomenkielisistä nimistä sekä aliaksista.
+Taivutetut tai väärin kirjoitetut syötteet ("kuparin", "nikel") haetaan
+moduulin latauksessa rakennetusta trigrammi-indeksistä.
+
+`with_material` käärii laskentafunktion niin, että työkalukutsut voivat
+antaa `material="Cu"` tai `material="kupari"` numeeristen parametrien sijaan.
+"""
+
+import functools
+import inspect
+import re
+from collections import defaultdict
+from functools import lru_cache
+
+METALS = {
+    "Cu": {"M": 63.546,  "z": 2, "rho": 8.96,  "E0": +0.34,   "en": "copper",    "fi": "kupari"},
+    "Ni": {"M": 58.693,  "z": 2, "rho": 8.90,  "E0": -0.257,  "en": "nickel",    "fi": "nikkeli"},
+    "Zn": {"M": 65.38,   "z": 2, "rho": 7.13,  "E0": -0.763,  "en": "zinc",      "fi": "sinkki"},
+    "Cr": {"M": 51.996,  "z": 6, "rho": 7.19,  "E0": -0.744,  "en": "chromium",  "fi": "kromi"},
+    "Sn": {"M": 118.71,  "z": 2, "rho": 7.29,  "E0": -0.138,  "en": "tin",       "fi": "tina"},
+    "Au": {"M": 196.97,  "z": 3, "rho": 19.30, "E0": +1.498,  "en": "gold",      "fi": "kulta"},
+    "Ag": {"M": 107.87,  "z": 1, "rho": 10.49, "E0": +0.799,  "en": "silver",    "fi": "hopea"},
+    "Cd": {"M": 112.41,  "z": 2, "rho": 8.65,  "E0": -0.403,  "en": "cadmium",   "fi": "kadmium"},
+    "Pb": {"M": 207.2,   "z": 2, "rho": 11.34, "E0": -0.126,  "en": "lead",      "fi": "lyijy"},
+    "Fe": {"M": 55.845,  "z": 2, "rho": 7.87,  "E0": -0.447,  "en": "iron",      "fi": "rauta"},
+    "Co": {"M": 58.933,  "z": 2, "rho": 8.90,  "E0": -0.28,   "en": "cobalt",    "fi": "koboltti"},
+    "Pd": {"M": 106.42,  "z": 2, "rho": 12.02, "E0": +0.951,  "en": "palladium", "fi": "palladium"},
+    "Pt": {"M": 195.08,  "z": 2, "rho": 21.45, "E0": +1.18,   "en": "platinum",  "fi": "platina"},
+    "Rh": {"M": 102.91,  "z": 3, "rho": 12.41, "E0": +0.76,   "en": "rhodium",   "fi": "rodium"},
+    "In": {"M": 114.82,  "z": 3, "rho": 7.31,  "E0": -0.338,  "en": "indium",    "fi": "indium"},
+    "Al": {"M": 26.982,  "z": 3, "rho": 2.70,  "E0": -1.662,  "en": "aluminium", "fi": "alumiini"},
+}
+
+# Pinnoitteen koostumus massaosuuksina
+ALLOYS = {
+    "CuZn30": {"composition": {"Cu": 0.70, "Zn": 0.30}, "en": "brass",       "fi": "messinki"},
+    "CuSn10": {"composition": {"Cu": 0.90, "Sn": 0.10}, "en": "bronze",      "fi": "pronssi"},
+    "ZnNi15": {"composition": {"Zn": 0.85, "Ni": 0.15}, "en": "zinc-nickel", "fi": "sinkki-nikkeli"},
+    "SnPb40": {"composition": {"Sn": 0.60, "Pb": 0.40}, "en": "tin-lead",    "fi": "tina-lyijy"},
+    "NiCo20": {"composition": {"Ni": 0.80, "Co": 0.20}, "en": "nickel-cobalt", "fi": "nikkeli-koboltti"},
+}
+
+# Tyypilliset käyttöarvot; `z` korvaa metallin arvon, kun kylpy saostaa
+# metallin eri hapetusasteelta.
+BATHS = {
+    "watts_nickel": {
+        "deposit": "Ni", "en": "Watts nickel", "fi": "Watts-nikkeli",
+        "composition_g_l": {"NiSO4·6H2O": 300, "NiCl2·6H2O": 45, "H3BO3": 40},
+        "current_efficiency": 0.96, "current_density_a_dm2": (2.0, 7.0), "temperature_c": (45, 65),
+    },
+    "nickel_sulfamate": {
+        "deposit": "Ni", "en": "nickel sulfamate", "fi": "sulfamaattinikkeli",
+        "composition_g_l": {"Ni(SO3NH2)2": 450, "NiCl2·6H2O": 5, "H3BO3": 40},
+        "current_efficiency": 0.97, "current_density_a_dm2": (2.0, 15.0), "temperature_c": (40, 60),
+    },
+    "acid_copper": {
+        "deposit": "Cu", "en": "acid copper", "fi": "happokupari",
+        "composition_g_l": {"CuSO4·5H2O": 200, "H2SO4": 60, "Cl-": 0.06},
+        "current_efficiency": 0.98, "current_density_a_dm2": (1.0, 5.0), "temperature_c": (20, 30),
+    },
+    "cyanide_copper": {
+        "deposit": "Cu", "z": 1, "en": "cyanide copper", "fi": "syanidikupari",
+        "composition_g_l": {"CuCN": 60, "NaCN": 75},
+        "current_efficiency": 0.6, "current_density_a_dm2": (1.0, 4.0), "temperature_c": (50, 70),
+    },
+    "hard_chrome": {
+        "deposit": "Cr", "en": "hard chrome", "fi": "kovakromi",
+        "composition_g_l": {"CrO3": 250, "H2SO4": 2.5},
+        "current_efficiency": 0.18, "current_density_a_dm2": (30.0, 60.0), "temperature_c": (50, 60),
+    },
+    "acid_zinc": {
+        "deposit": "Zn", "en": "acid zinc", "fi": "happosinkki",
+        "composition_g_l": {"ZnCl2": 70, "KCl": 200, "H3BO3": 25},
+        "current_efficiency": 0.95, "current_density_a_dm2": (0.5, 4.0), "temperature_c": (20, 35),
+    },
+    "alkaline_zinc": {
+        "deposit": "Zn", "en": "alkaline zinc", "fi": "alkalinen sinkki",
+        "composition_g_l": {"Zn": 10, "NaOH": 130},
+        "current_efficiency": 0.75, "current_density_a_dm2": (0.5, 3.0), "temperature_c": (20, 30),
+    },
+    "cyanide_gold": {
+        "deposit": "Au", "z": 1, "en": "cyanide gold", "fi": "syanidikulta",
+        "composition_g_l": {"KAu(CN)2": 12, "KCN": 15},
+        "current_efficiency": 0.9, "current_density_a_dm2": (0.1, 0.5), "temperature_c": (50, 65),
+    },
+    "acid_tin": {
+        "deposit": "Sn", "en": "acid tin", "fi": "happotina",
+        "composition_g_l": {"SnSO4": 40, "H2SO4": 100},
+        "current_efficiency": 0.95, "current_density_a_dm2": (1.0, 3.0), "temperature_c": (15, 30),
+    },
+}
+
+# Lisänimet merkin ja en/fi-nimien lisäksi
+_EXTRA_ALIASES = {
+    "Cr": ["chrome", "kromaus"], "Al": ["aluminum"], "Zn": ["galvanizing", "sinkitys"],
+    "Ni": ["nikkelöinti"], "Cu": ["kuparointi"],
+    "watts_nickel": ["watts"], "hard_chrome": ["hard chromium", "kromikylpy"],
+    "ZnNi15": ["znni", "zn-ni"], "CuZn30": ["cuzn"], "CuSn10": ["cusn"],
+}
+
+# Sumea haku vain merkkiä pidemmille nimille. Osuma hylätään, jos sen
+# Dice-samankaltaisuus jää kynnyksen alle tai jos toiseksi paras materiaali
+# on lähempänä kuin FUZZY_MARGIN ("iron-nickel" ei ole nikkeliä eikä rautaa).
+FUZZY_MIN_LENGTH = 4
+FUZZY_THRESHOLD = 0.55
+FUZZY_MARGIN = 0.1
+
+
+def _alloy_properties(composition: dict[str, float]) -> dict:
+    """Seospinnoitteen Faraday-ekvivalentit.
+
+    Varaus grammaa kohden on additiivinen: 1/E = Σ w_i z_i / M_i, ja tiheys
+    noudattaa seossääntöä 1/rho = Σ w_i / rho_i. Seos tallennetaan arvolla
+    z = 1 ja M:nä sen ekvivalenttipaino, joten M / z on tarkka.
+    """
+    inv_eq = sum(w * METALS[s]["z"] / METALS[s]["M"] for s, w in composition.items())
+    inv_rho = sum(w / METALS[s]["rho"] for s, w in composition.items())
+    return {"M": round(1 / inv_eq, 4), "z": 1, "rho": round(1 / inv_rho, 3), "E0": None}
+
+
+def _normalize(name: str) -> str:
+    return re.sub(r"[\s_\-–·/]+", " ", name.strip().lower())
+
+
+def _trigrams(text: str) -> set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _build_index():
+    """Materiaalit avaimittain, tarkka alias -> avain, trigrammi -> aliakset
+    ja trigrammien määrä aliasta kohden."""
+    materials: dict[str, dict] = {}
+    for sym, p in METALS.items():
+        materials[sym] = {"key": sym, "kind": "metal", "symbol": sym, "name_en": p["en"], "name_fi": p["fi"],
+                          "molar_mass": p["M"], "electrons": p["z"], "density_g_cm3": p["rho"], "E0_v": p["E0"]}
+    for key, a in ALLOYS.items():
+        props = _alloy_properties(a["composition"])
+        materials[key] = {"key": key, "kind": "alloy", "symbol": key, "name_en": a["en"], "name_fi": a["fi"],
+                          "composition": a["composition"], "molar_mass": props["M"], "electrons": props["z"],
+                          "density_g_cm3": props["rho"], "E0_v": None}
+    for key, b in BATHS.items():
+        metal = METALS[b["deposit"]]
+        materials[key] = {"key": key, "kind": "bath", "symbol": b["deposit"], "name_en": b["en"],
+                          "name_fi": b["fi"], "molar_mass": metal["M"], "electrons": b.get("z", metal["z"]),
+                          "density_g_cm3": metal["rho"], "E0_v": metal["E0"],
+                          "current_efficiency": b["current_efficiency"],
+                          "current_density_range": list(b["current_density_a_dm2"]),
+                          "temperature_c": list(b["temperature_c"]), "composition_g_l": b["composition_g_l"]}
+
+    aliases: dict[str, str] = {}
+    for key, m in materials.items():
+        for name in [key, m["name_en"], m["name_fi"], *_EXTRA_ALIASES.get(key, [])]:
+            aliases.setdefault(_normalize(name), key)
+
+    trigrams: dict[str, set[str]] = defaultdict(set)
+    sizes: dict[str, int] = {}
+    for alias in aliases:
+        tgs = _trigrams(alias)
+        sizes[alias] = len(tgs)
+        for tg in tgs:
+            trigrams[tg].add(alias)
+    return materials, aliases, dict(trigrams), sizes
+
+
+MATERIALS, _ALIASES, _TRIGRAMS, _TRIGRAM_SIZES = _build_index()
+
+
+@lru_cache(maxsize=2048)
+def find_material(name: str) -> dict | None:
+    """Hakee materiaalitietueen merkin tai fi/en-nimen perusteella (ensin tarkasti, sitten sumeasti).
+
+    Palauttaa None, kun nimeä ei tunnisteta yksiselitteisesti; väärän
+    materiaalin tiedoilla laskeminen olisi pahempi kuin virheilmoitus.
+    """
+    if not name or not name.strip():
+        return None
+    norm = _normalize(name)
+    if norm in _ALIASES:
+        return MATERIALS[_ALIASES[norm]]
+    if len(norm) < FUZZY_MIN_LENGTH:
+        return None
+
+    query = _trigrams(norm)
+    hits: dict[str, int] = defaultdict(int)
+    for tg in query:
+        for alias in _TRIGRAMS.get(tg, ()):
+            hits[alias] += 1
+    # Paras pistemäärä materiaalia kohden, jotta saman materiaalin aliakset
+    # eivät kilpaile keskenään
+    scores: dict[str, float] = defaultdict(float)
+    for alias, common in hits.items():
+        key = _ALIASES[alias]
+        scores[key] = max(scores[key], 2 * common / (len(query) + _TRIGRAM_SIZES[alias]))
+    ranked = sorted(scores.values(), reverse=True)
+    if not ranked or ranked[0] < FUZZY_THRESHOLD:
+        return None
+    if len(ranked) > 1 and ranked[0] - ranked[1] < FUZZY_MARGIN:
+        return None
+    return MATERIALS[max(scores, key=scores.get)]
+
+
+def material_lookup(name: str) -> dict:
+    """
+    Hakee metallin, seoksen tai pinnoituskylvyn sähkökemialliset ominaisuudet.
+
+    Argumentit:
+    - name (str): Kemiallinen merkki tai suomen-/englanninkielinen nimi, esim. "Cu", "kupari", "Watts nickel"
+
+    Palauttaa:
+    - dict: Materiaalitietue (molar_mass, electrons, density_g_cm3, E0_v, ...)
+      tai 'error', jossa luetellaan tunnetut materiaalit
+    """
+    m = find_material(name)
+    if m is None:
+        return {"error": f"Tuntematon materiaali '{name}'. Tunnetut: {', '.join(sorted(MATERIALS))}"}
+    return dict(m)
+
+
+# Materiaalitietueen kenttä -> laskentafunktion parametri
+_PARAM_FIELDS = {
+    "molar_mass": "molar_mass",
+    "electrons": "electrons",
+    "density_g_cm3": "density_g_cm3",
+    "current_efficiency": "current_efficiency",
+    "current_density_range": "current_density_range",
+}
+
+
+def with_material(func):
+    """Sallii laskentafunktiolle `material=`-argumentin materiaaliparametrien sijaan.
+
+    Erikseen annetut parametrit voittavat; puuttuvat täydennetään
+    materiaalitietueesta, jos funktio ottaa ne vastaan.
+    """
+    sig = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, material: str | None = None, **kwargs):
+        m = None
+        if material is not None:
+            m = find_material(material)
+            if m is None:
+                return {"error": f"Tuntematon materiaali '{material}'. Tunnetut: {', '.join(sorted(MATERIALS))}"}
+            for field, param in _PARAM_FIELDS.items():
+                if param in sig.parameters and kwargs.get(param) is None and m.get(field) is not None:
+                    kwargs[param] = m[field]
+        try:
+            sig.bind(*args, **kwargs)
+        except TypeError as e:
+            return {"error": f"{e}; anna arvot tai tunnettu 'material'"}
+        result = func(*args, **kwargs)
+        if m is None:
+            return result
+        if isinstance(result, dict) and "error" not in result:
+            result["material"] = {"key": m["key"], "name_en": m["name_en"], "kind": m["kind"]}
+        return result
+
+    return wrapper
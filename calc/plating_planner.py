@@ -0,0 +1,224 @@
+"""
+Käänteinen pinnoitussuunnittelija.
+
+Faradayn lain ja paksuusyhtälön yhdistelmä antaa suljetun muodon
+pinnoitteen paksuuden d (µm), virtatiheyden J (A/dm²), pinnoitusajan t (s)
+ja virtahyötysuhteen η välille:
+
+    d = 100 · J · t · M · η / (z · F · ρ)
+
+Kukin käänteinen kysymys ratkaisee yhtälön yhden tuntemattoman suhteen.
+Ratkaisija laskee yhtälön vapaiden parametrien NumPy-ruudukoille yhdellä
+vektoroidulla ajolla, soveltaa tasasuuntaajan, ajan ja virtatiheyden rajat
+ja palauttaa sallitun alueen sekä parhaat vaihtoehdot. Valittu optimi
+tarkistetaan eteenpäin funktioilla faraday_mass_calculation ja
+faraday_thickness_calculation.
+"""
+
+import numpy as np
+
+from calc.surface_treatment import (FARADAY_CONSTANT, faraday_mass_calculation,
+                                    faraday_thickness_calculation)
+
+SOLVE_FOR = ("time", "current_density", "area")
+# µm·dm²/cm³: 1 dm² = 100 cm², 1 cm = 10 000 µm
+_UM_FACTOR = 100.0
+
+
+def _grid_values(spec, name: str) -> np.ndarray:
+    """Hyväksyy luvun, lukulistan tai {"min", "max", "steps"}."""
+    if spec is None:
+        raise ValueError(f"'{name}' vaaditaan tähän laskuun")
+    if isinstance(spec, dict):
+        values = np.linspace(float(spec["min"]), float(spec["max"]), int(spec.get("steps", 10)))
+    else:
+        values = np.atleast_1d(np.asarray(spec, dtype=float)).ravel()
+    if values.size == 0 or np.any(values <= 0):
+        raise ValueError(f"'{name}'-arvojen on oltava positiivisia")
+    return values
+
+
+def _efficiency_values(spec) -> np.ndarray:
+    """Virtahyötysuhteet osuuksina. Koko ruudukko annetaan joko osuuksina
+    (0–1) tai prosentteina (1–100); sekaisin annettuja arvoja ei arvata."""
+    eff = _grid_values(spec, "current_efficiency")
+    if np.all(eff <= 1):
+        return eff
+    if np.all((eff > 1) & (eff <= 100)):
+        return eff / 100.0
+    raise ValueError("'current_efficiency' on annettava kokonaan joko osuuksina (0–1) "
+                     "tai prosentteina (1–100), ei sekaisin")
+
+
+def plating_plan(
+    target_thickness_um: float,
+    molar_mass: float,
+    electrons: int,
+    density_g_cm3: float,
+    solve_for: str = "time",
+    current_density_a_dm2=None,
+    time_s=None,
+    current_efficiency=1.0,
+    area_dm2=None,
+    parts: int = 1,
+    current_a: float | None = None,
+    max_current_a: float | None = None,
+    max_time_s: float | None = None,
+    current_density_range: tuple[float, float] | None = None,
+    top: int = 5,
+) -> dict:
+    """
+    Ratkaisee pinnoitusyhtälön ajan, virtatiheyden tai pinnoitettavan pinta-alan
+    suhteen parametriruudukoissa.
+
+    Ruudukkoparametrit (`current_density_a_dm2`, `time_s`, `current_efficiency`,
+    `area_dm2`) hyväksyvät luvun, listan tai {"min", "max", "steps"}.
+
+    solve_for:
+    - "time": tavoitepaksuuden aika kullekin (J, η, pinta-ala); optimi = lyhin sallittu aika
+    - "current_density": J ja virta kullekin (t, η, pinta-ala); optimi = pienin sallittu virta
+    - "area": pinta-ala (ja kokonaiset kappaleet), jonka kiinteä virta kattaa kullekin (t, η);
+      optimi = suurin pinta-ala
+
+    Argumentit:
+    - target_thickness_um (float): Vaadittu pinnoitteen paksuus (µm)
+    - molar_mass (float): Metallin moolimassa (g/mol), esim. Cu = 63.546
+    - electrons (int): Elektronien lukumäärä ionia kohden (z), esim. Cu2+ = 2
+    - density_g_cm3 (float): Pinnoitteen tiheys (g/cm³), esim. Cu = 8.96
+    - current_efficiency: Virtahyötysuhde osuutena (0–1) tai prosentteina (1–100), ei sekaisin
+    - area_dm2: Yhden kappaleen pinta-ala (dm²); kokonaisala = area_dm2 * parts.
+      Kun solve_for="area", yksi valinnainen arvo, josta lasketaan kokonaiset kappaleet
+    - parts (int): Yhdessä pinnoitettavien kappaleiden määrä
+    - current_a (float): Käytettävissä oleva virta, kun solve_for="area" (A)
+    - max_current_a (float): Tasasuuntaajan raja (A)
+    - max_time_s (float): Pisin hyväksyttävä pinnoitusaika (s)
+    - current_density_range ([min, max]): Kylvyn käyttöalue (A/dm²)
+    - top (int): Palautettavien parhaiden vaihtoehtojen määrä
+
+    Esimerkki:
+      plating_plan(25, 63.546, 2, 8.96, "time", current_density_a_dm2=[1, 2, 3, 4],
+                   current_efficiency=[0.95, 0.98], area_dm2=0.5, parts=300, max_current_a=500)
+
+    Palauttaa:
+    - dict: Sisältää:
+        'solve_for' (str): Ratkaistu suure
+        'grid_size' (int) ja 'feasible' (int): Ruudukon koko ja sallittujen yhdistelmien määrä
+        'optimum' (dict): Paras vaihtoehto, 'options' (list): parhaat vaihtoehdot
+        'ranges' (dict): Sallitun alueen vaihteluvälit
+        'calculation_steps' (str): Laskukaava ja vaiheet LaTeX-muodossa
+    """
+    if solve_for not in SOLVE_FOR:
+        return {"error": f"Tuntematon solve_for '{solve_for}'. Tuetut: {', '.join(SOLVE_FOR)}"}
+    try:
+        eff = _efficiency_values(current_efficiency)
+        d, M, z, rho = float(target_thickness_um), float(molar_mass), int(electrons), float(density_g_cm3)
+        k = d * z * FARADAY_CONSTANT * rho / (_UM_FACTOR * M)  # = J·t·η yksikössä A·s/dm²
+        part_area = None  # kokonaisten kappaleiden laskuun, kun solve_for="area"
+
+        if solve_for == "time":
+            j = _grid_values(current_density_a_dm2, "current_density_a_dm2")
+            area = _grid_values(area_dm2, "area_dm2") * parts
+            J, E, A = np.meshgrid(j, eff, area, indexing="ij")
+            T = k / (J * E)
+            I = J * A
+            objective = T
+        elif solve_for == "current_density":
+            t = _grid_values(time_s, "time_s")
+            area = _grid_values(area_dm2, "area_dm2") * parts
+            T, E, A = np.meshgrid(t, eff, area, indexing="ij")
+            J = k / (T * E)
+            I = J * A
+            objective = I
+        else:
+            t = _grid_values(time_s, "time_s")
+            current = current_a if current_a is not None else max_current_a
+            if current is None:
+                raise ValueError("'current_a' (tai 'max_current_a') vaaditaan, kun solve_for='area'")
+            if area_dm2 is not None:
+                part_areas = _grid_values(area_dm2, "area_dm2")
+                if part_areas.size != 1:
+                    raise ValueError("'area_dm2' on annettava yhtenä kappaleen pinta-alana, kun solve_for='area'")
+                part_area = float(part_areas[0])
+            T, E = np.meshgrid(t, eff, indexing="ij")
+            J = k / (T * E)
+            I = np.full_like(J, float(current))
+            A = I / J
+            objective = -A
+    except (ValueError, KeyError, TypeError) as e:
+        return {"error": str(e)}
+
+    feasible = np.ones(J.shape, dtype=bool)
+    if max_current_a is not None:
+        feasible &= I <= max_current_a
+    if max_time_s is not None:
+        feasible &= T <= max_time_s
+    if current_density_range is not None:
+        lo, hi = current_density_range
+        feasible &= (J >= lo) & (J <= hi)
+
+    n_feasible = int(feasible.sum())
+    result = {
+        "solve_for": solve_for,
+        "grid_size": int(J.size),
+        "feasible": n_feasible,
+        "optimum": None,
+        "options": [],
+        "ranges": None,
+    }
+    if not n_feasible:
+        result["calculation_steps"] = _latex_steps(solve_for, d, M, z, rho, k, None)
+        return result
+
+    order = np.argsort(np.where(feasible, objective, np.inf), axis=None)[:min(top, n_feasible)]
+    options = []
+    for flat in order:
+        idx = np.unravel_index(flat, J.shape)
+        opt = {
+            "current_density_a_dm2": round(float(J[idx]), 4),
+            "time_s": round(float(T[idx]), 1),
+            "time_min": round(float(T[idx]) / 60, 2),
+            "current_efficiency": round(float(E[idx]), 4),
+            "area_dm2": round(float(A[idx]), 4),
+            "current_a": round(float(I[idx]), 3),
+        }
+        if part_area is not None:
+            opt["parts"] = int(float(A[idx]) // part_area)
+        options.append(opt)
+    result["options"] = options
+    result["optimum"] = options[0]
+    result["ranges"] = {
+        name: [round(float(arr[feasible].min()), 4), round(float(arr[feasible].max()), 4)]
+        for name, arr in (("current_density_a_dm2", J), ("time_s", T), ("current_a", I), ("area_dm2", A))
+    }
+    result["calculation_steps"] = _latex_steps(solve_for, d, M, z, rho, k, options[0])
+    return result
+
+
+def _latex_steps(solve_for, d, M, z, rho, k, best) -> str:
+    unknown = {"time": "t = \\frac{d \\cdot z \\cdot F \\cdot \\rho}{100 \\cdot J \\cdot M \\cdot \\eta}",
+               "current_density": "J = \\frac{d \\cdot z \\cdot F \\cdot \\rho}{100 \\cdot t \\cdot M \\cdot \\eta}",
+               "area": "A = \\frac{I}{J}, \\quad J = \\frac{d \\cdot z \\cdot F \\cdot \\rho}{100 \\cdot t \\cdot M \\cdot \\eta}"}
+    steps = (
+        f"Yhdistetään Faradayn laki ja paksuusyhtälö:\n"
+        f"$$ d = \\frac{{100 \\cdot J \\cdot t \\cdot M \\cdot \\eta}}{{z \\cdot F \\cdot \\rho}} "
+        f"\\Rightarrow {unknown[solve_for]} $$\n\n"
+        f"Sijoitetaan arvot $d = {d}\\ \\mu\\text{{m}}$, $M = {M}\\text{{ g/mol}}$, $z = {z}$, "
+        f"$\\rho = {rho}\\text{{ g/cm}}^3$:\n"
+        f"$$ J \\cdot t \\cdot \\eta = {k:.6g}\\text{{ A s/dm}}^2 $$\n\n"
+    )
+    if best is None:
+        return steps + "Tulos:\nMikään parametriyhdistelmä ei täytä annettuja rajoja."
+
+    # Optimin tarkistus eteenpäin Faradayn perusfunktioilla
+    mass = faraday_mass_calculation(best["current_a"], best["time_s"], M, z)["mass_g"] * best["current_efficiency"]
+    check = faraday_thickness_calculation(mass, rho, best["area_dm2"])["thickness_um"]
+    return steps + (
+        f"Tulos:\n"
+        f"Paras vaihtoehto: $J = {best['current_density_a_dm2']}\\text{{ A/dm}}^2$, "
+        f"$t = {best['time_s']}\\text{{ s}}$ (${best['time_min']}\\text{{ min}}$), "
+        f"$\\eta = {best['current_efficiency']}$, $I = {best['current_a']}\\text{{ A}}$, "
+        f"$A = {best['area_dm2']}\\text{{ dm}}^2$\n\n"
+        f"Tarkistus eteenpäin:\n"
+        f"$$ m = \\eta \\cdot \\frac{{I \\cdot t \\cdot M}}{{z \\cdot F}} = {mass:.4f}\\text{{ g}}, \\quad "
+        f"d = \\frac{{m}}{{\\rho \\cdot A}} = {check:.2f}\\ \\mu\\text{{m}} $$"
+    )
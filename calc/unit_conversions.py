@@ -0,0 +1,308 @@
+"""
+Yksikkö- ja dimensiomoottori laskentatyökalujen muunnoksiin.
+
+Yksiköt jäsennetään SI-perusyksiköihin suhteutetuksi kertoimeksi (ja
+lämpötiloille siirroksi) sekä dimensiovektoriksi (m, kg, s, A, K, mol).
+Yhdistetyt yksiköt, kuten "A/dm²", "oz/gal", "kW·h" tai "mol/L", kootaan
+nimettyjen yksiköiden ja SI-etuliitteiden rekisteristä. Kaksi yksikköä
+muuntuvat suoraan, kun niiden dimensiovektorit ovat samat. Suureesta toiseen
+muunnos voi kulkea yhden materiaalisillan (moolimassa tai tiheys) kautta,
+esim. g/L -> mol/L tai µm -> g/dm².
+
+Jäsennys ja yksikköparien ratkaisu on välimuistitettu, joten ensimmäisen
+kutsun jälkeen yksikköpari maksaa sanakirjahaun ja yhden kerto-yhteenlaskun.
+`convert_array` soveltaa samoja kertoimia NumPy-taulukoihin kerralla.
+"""
+
+import re
+from functools import lru_cache
+from typing import NamedTuple
+
+import numpy as np
+
+# Dimensiovektorin järjestys
+BASE_DIMENSIONS = ("m", "kg", "s", "A", "K", "mol")
+DIMENSIONLESS = (0, 0, 0, 0, 0, 0)
+
+
+class Unit(NamedTuple):
+    scale: float          # 1 yksikön SI-arvo (siirron poiston jälkeen)
+    dims: tuple           # eksponentit BASE_DIMENSIONS-järjestyksessä
+    offset: float = 0.0   # SI-arvo = arvo * scale + offset (vain lämpötilat)
+
+
+def _dims(m=0, kg=0, s=0, A=0, K=0, mol=0) -> tuple:
+    return (m, kg, s, A, K, mol)
+
+
+SI_PREFIX_FACTORS = {
+    "p": 1e-12, "n": 1e-9, "µ": 1e-6, "u": 1e-6, "m": 1e-3, "c": 1e-2, "d": 1e-1,
+    "da": 1e1, "h": 1e2, "k": 1e3, "M": 1e6, "G": 1e9,
+}
+
+# tunnus -> (Unit, hyväksyykö SI-etuliitteen)
+UNITS: dict[str, tuple[Unit, bool]] = {
+    # Pituus
+    "m": (Unit(1.0, _dims(m=1)), True),
+    "in": (Unit(0.0254, _dims(m=1)), False),
+    "ft": (Unit(0.3048, _dims(m=1)), False),
+    "mil": (Unit(2.54e-5, _dims(m=1)), False),
+    "micron": (Unit(1e-6, _dims(m=1)), False),
+    # Massa
+    "g": (Unit(1e-3, _dims(kg=1)), True),
+    "t": (Unit(1e3, _dims(kg=1)), False),
+    "lb": (Unit(0.45359237, _dims(kg=1)), False),
+    "oz": (Unit(0.028349523125, _dims(kg=1)), False),
+    "ozt": (Unit(0.0311034768, _dims(kg=1)), False),
+    # Aika
+    "s": (Unit(1.0, _dims(s=1)), True),
+    "min": (Unit(60.0, _dims(s=1)), False),
+    "h": (Unit(3600.0, _dims(s=1)), False),
+    "d": (Unit(86400.0, _dims(s=1)), False),
+    "yr": (Unit(31557600.0, _dims(s=1)), False),
+    # Virta, lämpötila, ainemäärä
+    "A": (Unit(1.0, _dims(A=1)), True),
+    "K": (Unit(1.0, _dims(K=1)), True),
+    "°C": (Unit(1.0, _dims(K=1), 273.15), False),
+    "°F": (Unit(5 / 9, _dims(K=1), 273.15 - 32 * 5 / 9), False),
+    "mol": (Unit(1.0, _dims(mol=1)), True),
+    # Tilavuus
+    "L": (Unit(1e-3, _dims(m=3)), True),
+    "gal": (Unit(3.785411784e-3, _dims(m=3)), False),
+    "galUK": (Unit(4.54609e-3, _dims(m=3)), False),
+    # Johdetut SI-yksiköt
+    "Hz": (Unit(1.0, _dims(s=-1)), True),
+    "N": (Unit(1.0, _dims(m=1, kg=1, s=-2)), True),
+    "Pa": (Unit(1.0, _dims(m=-1, kg=1, s=-2)), True),
+    "J": (Unit(1.0, _dims(m=2, kg=1, s=-2)), True),
+    "W": (Unit(1.0, _dims(m=2, kg=1, s=-3)), True),
+    "C": (Unit(1.0, _dims(s=1, A=1)), True),
+    "V": (Unit(1.0, _dims(m=2, kg=1, s=-3, A=-1)), True),
+    "Ω": (Unit(1.0, _dims(m=2, kg=1, s=-3, A=-2)), True),
+    "S": (Unit(1.0, _dims(m=-2, kg=-1, s=3, A=2)), True),
+    # Muut energian, varauksen ja paineen yksiköt
+    "Wh": (Unit(3600.0, _dims(m=2, kg=1, s=-2)), True),
+    "Ah": (Unit(3600.0, _dims(s=1, A=1)), True),
+    "cal": (Unit(4.184, _dims(m=2, kg=1, s=-2)), True),
+    "eV": (Unit(1.602176634e-19, _dims(m=2, kg=1, s=-2)), True),
+    "bar": (Unit(1e5, _dims(m=-1, kg=1, s=-2)), True),
+    "atm": (Unit(101325.0, _dims(m=-1, kg=1, s=-2)), False),
+    "psi": (Unit(6894.757293168, _dims(m=-1, kg=1, s=-2)), False),
+    # Suhdeluvut
+    "%": (Unit(1e-2, DIMENSIONLESS), False),
+    "ppm": (Unit(1e-6, DIMENSIONLESS), False),
+}
+
+# Vaihtoehtoiset kirjoitusasut ja alan lyhenteet, avataan ennen jäsennystä
+ALIASES = {
+    "l": "L", "ohm": "Ω", "um": "µm", "μm": "µm", "μ": "µ",
+    "degC": "°C", "℃": "°C", "degF": "°F", "℉": "°F",
+    "sec": "s", "hr": "h", "year": "yr", "a": "yr",
+    "gal_us": "gal", "gal_uk": "galUK",
+    "ASF": "A/ft^2", "ASD": "A/dm^2", "mpy": "mil/yr", "gpm": "gal/min",
+}
+
+# Eri suureita yhdistävät materiaaliominaisuudet: nimi -> (dimensiot, annetun yksikön SI-kerroin)
+BRIDGES = {
+    "molar_mass_g_mol": (_dims(kg=1, mol=-1), 1e-3),
+    "density_g_cm3": (_dims(m=-3, kg=1), 1e3),
+}
+
+_SUPERSCRIPTS = str.maketrans("⁰¹²³⁴⁵⁶⁷⁸⁹⁻", "0123456789-")
+_TOKEN_RE = re.compile(r"^(?P<sym>.*?[^\d^⁰¹²³⁴⁵⁶⁷⁸⁹⁻-])(?:\^?(?P<exp>-?\d+))?$")
+
+
+class UnitError(ValueError):
+    pass
+
+
+def _lookup(symbol: str) -> Unit:
+    symbol = ALIASES.get(symbol, symbol)
+    if symbol in UNITS:
+        return UNITS[symbol][0]
+    for plen in (2, 1):
+        prefix, rest = symbol[:plen], ALIASES.get(symbol[plen:], symbol[plen:])
+        if prefix in SI_PREFIX_FACTORS and rest in UNITS and UNITS[rest][1]:
+            base = UNITS[rest][0]
+            return Unit(base.scale * SI_PREFIX_FACTORS[prefix], base.dims)
+    raise UnitError(f"Tuntematon yksikkö '{symbol}'")
+
+
+@lru_cache(maxsize=1024)
+def parse_unit(expr: str) -> Unit:
+    """Jäsentää yksikkölausekkeen SI-kertoimeksi ja dimensiovektoriksi.
+
+    Termit erotetaan välilyönnillä, '*', '·' tai '⋅'; kaikki ensimmäisen
+    '/'-merkin jälkeen on nimittäjässä. Eksponentit voi kirjoittaa muodossa
+    m2, m^2, m² tai s⁻¹.
+
+    Esimerkki:
+        parse_unit("A/dm²") -> Unit(scale=100.0, dims=(-2, 0, 0, 1, 0, 0))
+    """
+    text = ALIASES.get(expr.strip(), expr.strip())
+    text = re.sub(r"\b(ASF|ASD|mpy|gpm)\b", lambda m: f"({ALIASES[m.group()]})", text)
+    text = text.replace("(", " ").replace(")", " ").translate(_SUPERSCRIPTS)
+    if not text:
+        return Unit(1.0, DIMENSIONLESS)
+    num, _, den = text.partition("/")
+    scale, dims, offset = 1.0, [0] * len(BASE_DIMENSIONS), 0.0
+    n_terms = 0
+    for part, sign in ((num, 1), (den.replace("/", " "), -1)):
+        for token in re.split(r"[\s*·⋅]+", part):
+            if not token or token == "1":
+                continue
+            m = _TOKEN_RE.match(token)
+            if not m:
+                raise UnitError(f"Yksikkötermiä '{token}' ei voitu jäsentää lausekkeessa '{expr}'")
+            unit = _lookup(m.group("sym"))
+            exp = sign * int(m.group("exp") or 1)
+            scale *= unit.scale ** exp
+            dims = [d + exp * u for d, u in zip(dims, unit.dims)]
+            offset = unit.offset
+            n_terms += 1
+    if n_terms != 1 or den.strip() or exp != 1:
+        # Yhdistetyssä yksikössä (°C/min) lämpötila on lämpötilaero
+        offset = 0.0
+    return Unit(scale, tuple(dims), offset)
+
+
+def format_dims(dims: tuple) -> str:
+    parts = [f"{b}^{e}" if e != 1 else b for b, e in zip(BASE_DIMENSIONS, dims) if e]
+    return " ".join(parts) or "1"
+
+
+@lru_cache(maxsize=4096)
+def _resolve(from_unit: str, to_unit: str, bridge: str | None, bridge_exp: int) -> tuple[float, float]:
+    """(scale, offset), joilla kohdearvo = lähtöarvo * scale + offset,
+    ennen materiaalisillan arvon soveltamista."""
+    src, dst = parse_unit(from_unit), parse_unit(to_unit)
+    if bridge and (src.offset or dst.offset):
+        raise UnitError("Lämpötiloja ei voi muuntaa materiaaliominaisuuden kautta")
+    scale = src.scale / dst.scale
+    if bridge:
+        scale *= BRIDGES[bridge][1] ** bridge_exp
+    return scale, (src.offset - dst.offset) / dst.scale
+
+
+@lru_cache(maxsize=4096)
+def conversion_path(from_unit: str, to_unit: str, available: frozenset = frozenset()) -> tuple[str | None, int]:
+    """Selvittää, miten kaksi yksikköä liittyvät toisiinsa: suoraan (None, 0)
+    tai yhden materiaalisillan kautta potenssiin ±1. `available` luettelee
+    siltaominaisuudet, jotka kutsuja voi antaa."""
+    src, dst = parse_unit(from_unit), parse_unit(to_unit)
+    if src.dims == dst.dims:
+        return None, 0
+    diff = tuple(d - s for s, d in zip(src.dims, dst.dims))
+    for name, (bdims, _) in BRIDGES.items():
+        for exp in (1, -1):
+            if tuple(exp * b for b in bdims) == diff:
+                if name not in available:
+                    raise UnitError(f"Muunnos {from_unit} -> {to_unit} vaatii arvon '{name}'")
+                return name, exp
+    raise UnitError(
+        f"Yhteensopimattomat yksiköt: {from_unit} [{format_dims(src.dims)}] -> {to_unit} [{format_dims(dst.dims)}]"
+    )
+
+
+def conversion_factor(from_unit: str, to_unit: str, **bridges: float) -> tuple[float, float]:
+    """Palauttaa (scale, offset) muunnokselle kohde = lähtö * scale + offset."""
+    available = frozenset(k for k, v in bridges.items() if v is not None)
+    unknown = available - BRIDGES.keys()
+    if unknown:
+        raise UnitError(f"Tuntemattomat materiaaliominaisuudet: {', '.join(sorted(unknown))}")
+    bridge, exp = conversion_path(from_unit, to_unit, available)
+    scale, offset = _resolve(from_unit, to_unit, bridge, exp)
+    if bridge:
+        scale *= bridges[bridge] ** exp
+    return scale, offset
+
+
+def convert(value: float, from_unit: str, to_unit: str, **bridges: float) -> float:
+    scale, offset = conversion_factor(from_unit, to_unit, **bridges)
+    return value * scale + offset
+
+
+def convert_array(values, from_unit: str, to_unit: str, **bridges: float) -> np.ndarray:
+    """Vektoroitu `convert` listoille ja minkä tahansa muotoisille NumPy-taulukoille."""
+    scale, offset = conversion_factor(from_unit, to_unit, **bridges)
+    out = np.asarray(values, dtype=float) * scale
+    if offset:
+        out += offset
+    return out
+
+
+def _latex_unit(unit: str) -> str:
+    """Yksikkö LaTeX-muodossa: teksti \\text{}-lohkoissa, eksponentit ja µ matematiikkatilassa."""
+    out = []
+    parts = re.split(r"\^?(-?\d+)(?=$|[\s/*·⋅])", unit.translate(_SUPERSCRIPTS))
+    for i, part in enumerate(parts):
+        if i % 2:
+            out.append(f"^{{{part}}}")
+        elif part:
+            for j, run in enumerate(part.replace("%", "\\%").split("µ")):
+                if j:
+                    out.append("\\mu")
+                if run:
+                    out.append(f"\\text{{{run}}}")
+    return "".join(out)
+
+
+def domain_unit_conversion(value: float, from_unit: str, to_unit: str,
+                           molar_mass_g_mol: float | None = None,
+                           density_g_cm3: float | None = None) -> dict:
+    """
+    Muuntaa arvon yksiköstä toiseen, myös yhdistetyt ja alakohtaiset yksiköt.
+
+    Käsittelee kaikki samadimensioiset yksiköt (µm <-> mil, A/dm² <-> ASF,
+    g/L <-> oz/gal, kWh <-> MJ, °C <-> °F). Moolimassan tai tiheyden kanssa
+    muuntaa myös suureesta toiseen (g/L -> mol/L, µm -> g/dm², ppm -> mg/L).
+
+    Argumentit:
+    - value (float): Muunnettava arvo
+    - from_unit (str): Lähtöyksikkö, esim. "A/dm²"
+    - to_unit (str): Kohdeyksikkö, esim. "ASF"
+    - molar_mass_g_mol (float, valinnainen): Moolimassa ainemäärä <-> massa -muunnoksiin
+    - density_g_cm3 (float, valinnainen): Tiheys massa <-> tilavuus -muunnoksiin
+
+    Esimerkki:
+      domain_unit_conversion(5, "A/dm²", "ASF") -> 46.45 ASF
+
+    Palauttaa:
+    - dict: Sisältää:
+        'result' (float): Muunnettu arvo
+        'from', 'to' (str): Lähtö- ja kohdearvo yksiköineen
+        'factor' (float): Muuntokerroin
+        'calculation_steps' (str): Laskukaava ja vaiheet LaTeX-muodossa
+    """
+    try:
+        scale, offset = conversion_factor(from_unit, to_unit, molar_mass_g_mol=molar_mass_g_mol,
+                                          density_g_cm3=density_g_cm3)
+        bridge, exp = conversion_path(from_unit, to_unit, frozenset(
+            k for k, v in (("molar_mass_g_mol", molar_mass_g_mol), ("density_g_cm3", density_g_cm3))
+            if v is not None))
+    except UnitError as e:
+        return {"error": str(e)}
+
+    result = value * scale + offset
+    src, dst = _latex_unit(from_unit), _latex_unit(to_unit)
+    if offset:
+        formula = f"{value}\\,{src} \\times {scale:.6g} + {offset:.6g}"
+    else:
+        formula = f"{value}\\,{src} \\times {scale:.6g}"
+    steps = f"Muuntokerroin yksiköstä ${src}$ yksikköön ${dst}$: ${scale:.6g}$"
+    if bridge:
+        label = {"molar_mass_g_mol": "M", "density_g_cm3": "\\rho"}[bridge]
+        op = "\\times" if exp > 0 else "\\div"
+        steps += f" (sisältää ${op}\\ {label}$)"
+    latex_string = (
+        f"{steps}\n\n"
+        f"Sijoitetaan arvot:\n"
+        f"$$ {formula} = {result:.6g}\\,{dst} $$"
+    )
+    return {
+        "result": result,
+        "from": f"{value} {from_unit}",
+        "to": f"{result:.6g} {to_unit}",
+        "factor": scale,
+        "calculation_steps": latex_string,
+    }
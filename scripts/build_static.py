@@ -0,0 +1,207 @@
+"""
+build_static.py – Vendor, fingerprint and precompress the frontend assets.
+
+The page loads KaTeX from a CDN during development. This script replaces
+those references with local copies so the UI works without internet access:
+
+    static/vendor/<package>/    vendored package files (fetched once with --fetch)
+    static/dist/                content-hashed copies, e.g. katex.min.3f2a9c1d.css,
+                                plus .gz / .br variants and index.html rewritten
+                                to point at them
+    static/dist/manifest.json   logical path -> fingerprinted path
+
+The API serves static/dist/ with `Cache-Control: immutable` and falls back to
+static/index.html when no build exists.
+
+    python scripts/build_static.py --fetch   # download vendored packages if missing
+    python scripts/build_static.py
+"""
+
+import argparse
+import base64
+import gzip
+import hashlib
+import io
+import json
+import posixpath
+import re
+import shutil
+import tarfile
+import urllib.request
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip variants are always written
+    brotli = None
+
+
+STATIC_DIR = Path(__file__).resolve().parent.parent / "static"
+VENDOR_DIR = STATIC_DIR / "vendor"
+DIST_DIR = STATIC_DIR / "dist"
+DIST_URL = "/static/dist/"
+
+# name -> (npm tarball, its npm `integrity` (SRI sha512), CDN prefix used in
+# index.html, directory inside the tarball). Bump the integrity together with
+# the version: `npm view katex@<version> dist.integrity`.
+VENDOR = {
+    "katex": (
+        "https://registry.npmjs.org/katex/-/katex-0.16.9.tgz",
+        "sha512-fsSYjWS0EEOwvy81j3vRA8TEAhQhKiqO+FQaKWp0m39qwOzHVBgAUBIXWj1pB+O2W3fIpNa6Y9KSKCVbfPhyAQ==",
+        "https://cdn.jsdelivr.net/npm/katex@0.16.9/dist/",
+        "package/dist/",
+    ),
+}
+# Only the files the page uses (and what they reference) are copied to dist/
+VENDOR_FILES = {
+    "katex": ["katex.min.css", "katex.min.js", "contrib/auto-render.min.js", "fonts/"],
+}
+
+COMPRESSIBLE = {".html", ".css", ".js", ".json", ".svg", ".ttf", ".txt"}
+HASH_LEN = 8
+CSS_URL_RE = re.compile(r"url\((['\"]?)([^'\")]+)\1\)")
+
+
+def sri_digest(data: bytes) -> str:
+    """Subresource-integrity string as npm records it: sha512-<base64>."""
+    return "sha512-" + base64.b64encode(hashlib.sha512(data).digest()).decode("ascii")
+
+
+def fetch_vendor(name: str, force: bool = False) -> None:
+    """Download an npm tarball, check it against the pinned integrity and
+    unpack its dist directory under static/vendor/<name>/."""
+    tarball, integrity, _, inner = VENDOR[name]
+    target = VENDOR_DIR / name
+    if target.exists() and not force:
+        print(f"[vendor] {name}: already present")
+        return
+    print(f"[vendor] {name}: {tarball}")
+    with urllib.request.urlopen(tarball, timeout=60) as resp:
+        data = resp.read()
+    digest = sri_digest(data)
+    if digest != integrity:
+        raise SystemExit(f"[vendor] {name}: integrity mismatch for {tarball}\n"
+                         f"  expected {integrity}\n  got      {digest}")
+    if target.exists():
+        shutil.rmtree(target)
+    with tarfile.open(fileobj=io.BytesIO(data), mode="r:gz") as tar:
+        for member in tar.getmembers():
+            if not member.isfile() or not member.name.startswith(inner):
+                continue
+            rel = Path(member.name[len(inner):])
+            if rel.is_absolute() or ".." in rel.parts:
+                continue
+            out = target / rel
+            out.parent.mkdir(parents=True, exist_ok=True)
+            out.write_bytes(tar.extractfile(member).read())
+
+
+def fingerprint(rel: str, data: bytes) -> str:
+    """katex/katex.min.css -> katex/katex.min.<hash>.css"""
+    digest = hashlib.sha256(data).hexdigest()[:HASH_LEN]
+    path = Path(rel)
+    return str(path.with_name(f"{path.stem}.{digest}{path.suffix}"))
+
+
+def precompress(path: Path) -> None:
+    if path.suffix not in COMPRESSIBLE:
+        return
+    data = path.read_bytes()
+    # mtime=0 keeps the .gz byte-identical between builds
+    path.with_name(path.name + ".gz").write_bytes(gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        path.with_name(path.name + ".br").write_bytes(brotli.compress(data, quality=11))
+
+
+def collect(name: str) -> list[Path]:
+    root = VENDOR_DIR / name
+    if not root.exists():
+        raise SystemExit(f"static/vendor/{name} is missing – run with --fetch on a machine with internet access")
+    files = []
+    for entry in VENDOR_FILES[name]:
+        path = root / entry
+        if entry.endswith("/"):
+            files.extend(sorted(p for p in path.rglob("*") if p.is_file()))
+        elif path.is_file():
+            files.append(path)
+        else:
+            raise SystemExit(f"static/vendor/{name}/{entry} not found")
+    return files
+
+
+def write_asset(rel: str, data: bytes, manifest: dict) -> str:
+    hashed = fingerprint(rel, data)
+    out = DIST_DIR / hashed
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_bytes(data)
+    precompress(out)
+    manifest[rel] = hashed
+    return hashed
+
+
+def rewrite_css(rel: str, css: str, manifest: dict) -> str:
+    """Point relative url(...) references (KaTeX fonts) at their fingerprinted names."""
+    base = posixpath.dirname(rel)
+
+    def repl(m):
+        ref = m.group(2)
+        if ref.startswith(("data:", "http:", "https:", "/")):
+            return m.group(0)
+        path, sep, query = ref.partition("?")
+        hashed = manifest.get(posixpath.normpath(posixpath.join(base, path)))
+        if hashed is None:
+            return m.group(0)
+        return f"url({m.group(1)}{posixpath.relpath(hashed, base)}{sep}{query}{m.group(1)})"
+
+    return CSS_URL_RE.sub(repl, css)
+
+
+def build() -> dict:
+    if DIST_DIR.exists():
+        shutil.rmtree(DIST_DIR)
+    DIST_DIR.mkdir(parents=True)
+    manifest: dict[str, str] = {}
+    html = (STATIC_DIR / "index.html").read_text(encoding="utf-8")
+
+    for name, (_, _, cdn_prefix, _) in VENDOR.items():
+        root = VENDOR_DIR / name
+        files = collect(name)
+        # Fonts and other referenced files first, so stylesheets can be rewritten
+        for path in sorted(files, key=lambda p: p.suffix == ".css"):
+            rel = f"{name}/{path.relative_to(root).as_posix()}"
+            data = path.read_bytes()
+            if path.suffix == ".css":
+                data = rewrite_css(rel, data.decode("utf-8"), manifest).encode("utf-8")
+            write_asset(rel, data, manifest)
+        for rel, hashed in manifest.items():
+            if rel.startswith(f"{name}/"):
+                html = html.replace(cdn_prefix + rel[len(name) + 1:], DIST_URL + hashed)
+
+    leftover = re.findall(r"(?:src|href)=\"(https?://[^\"]+)\"", html)
+    if leftover:
+        raise SystemExit(f"index.html still references external assets: {', '.join(leftover)}")
+
+    index = DIST_DIR / "index.html"
+    index.write_text(html, encoding="utf-8")
+    precompress(index)
+    (DIST_DIR / "manifest.json").write_text(json.dumps(manifest, indent=2, sort_keys=True), encoding="utf-8")
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vendor, fingerprint and precompress static assets")
+    parser.add_argument("--fetch", action="store_true", help="Download vendored packages that are missing")
+    parser.add_argument("--refetch", action="store_true", help="Download vendored packages even if present")
+    args = parser.parse_args()
+
+    if args.fetch or args.refetch:
+        for name in VENDOR:
+            fetch_vendor(name, force=args.refetch)
+    manifest = build()
+    size = sum(p.stat().st_size for p in DIST_DIR.rglob("*") if p.is_file())
+    print(f"[build] {len(manifest)} assets → {DIST_DIR} ({size / 1024:.0f} KiB incl. .gz/.br)"
+          f"{'' if brotli else ' – brotli not installed, .br skipped'}")
+
+
+if __name__ == "__main__":
+    main()
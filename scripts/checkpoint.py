@@ -0,0 +1,80 @@
+"""
+checkpoint.py – Append-only checkpoint manifests for resumable batch jobs.
+
+A manifest is a JSONL journal next to the job's output. The first line holds
+the run's parameters, and every later line records one completed unit of work
+(a fetched source, a committed DB batch). Each record is fsync'd after the
+work it describes is durable. A crash therefore loses at most the unit in
+flight, and a half-written last line is simply ignored on resume.
+"""
+
+import json
+import os
+from pathlib import Path
+
+
+class Checkpoint:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._f = None
+
+    def _read(self) -> tuple[dict | None, list[dict]]:
+        if not self.path.exists():
+            return None, []
+        meta, records = None, []
+        with self.path.open("r", encoding="utf-8") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    break  # torn write from a crash
+                rec = json.loads(line)
+                if meta is None:
+                    meta = rec.get("meta")
+                else:
+                    records.append(rec)
+        return meta, records
+
+    def start(self, meta: dict, resume: bool) -> list[dict]:
+        """Open the manifest for a run and return records to resume from.
+
+        Resuming only happens when the stored parameters equal `meta`;
+        otherwise the manifest is reset and an empty list returned.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        records: list[dict] = []
+        if resume:
+            old_meta, records = self._read()
+            if old_meta != meta:
+                if old_meta is not None:
+                    print(f"Checkpoint {self.path} is for different inputs, starting over")
+                records = []
+        if records:
+            # Rewrite without any torn tail so new records append cleanly
+            lines = [json.dumps({"meta": meta})] + [json.dumps(r) for r in records]
+            tmp = self.path.with_name(self.path.name + ".tmp")
+            tmp.write_text("\n".join(lines) + "\n", encoding="utf-8")
+            os.replace(tmp, self.path)
+            self._f = self.path.open("a", encoding="utf-8")
+        else:
+            self._f = self.path.open("w", encoding="utf-8")
+            self._write({"meta": meta})
+        return records
+
+    def _write(self, rec: dict):
+        self._f.write(json.dumps(rec) + "\n")
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def record(self, **rec):
+        self._write(rec)
+
+    def finish(self):
+        """Close and remove the manifest once the run's output is final."""
+        if self._f:
+            self._f.close()
+            self._f = None
+        self.path.unlink(missing_ok=True)
+
+    def close(self):
+        if self._f:
+            self._f.close()
+            self._f = None
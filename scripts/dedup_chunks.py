@@ -0,0 +1,170 @@
+"""
+dedup_chunks.py – Drop near-duplicate chunks before embedding.
+
+Runs between fetch_and_chunk.py and embed_and_index.py. Every chunk gets a
+MinHash signature over word 3-grams. LSH banding turns those signatures into
+bucket keys, so only chunks that share a bucket are compared, which keeps
+the pass roughly linear in corpus size. A candidate whose estimated Jaccard
+similarity reaches the threshold is folded into the first chunk seen with
+that content. The canonical chunk keeps the duplicate's source_url in
+`alt_source_urls`.
+"""
+
+import argparse
+import json
+import os
+import re
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+
+
+SHINGLE_WORDS = 3
+# Texts per pool task; at most 2 * workers tasks are in flight
+BATCH_SIZE = 256
+_PRIME = np.uint64(4294967311)  # smallest prime above 2**32
+_WORD_RE = re.compile(r"\w+")
+
+
+class MinHasher:
+    """MinHash over 32-bit shingle hashes using a*x+b mod p permutations.
+
+    With a, b < 2**32 and x < 2**32 the products fit in uint64, so the hashing
+    is exact and vectorised over all permutations at once.
+    """
+
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 2**32, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 2**32, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        words = _WORD_RE.findall(text.lower())
+        if len(words) > SHINGLE_WORDS:
+            shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+        else:
+            shingles = {" ".join(words)}
+        x = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64,
+                        count=len(shingles))
+        return ((np.outer(x, self.a) + self.b) % _PRIME).min(axis=0).astype(np.uint32)
+
+
+_hasher: MinHasher | None = None
+
+
+def _init_worker(num_perm: int):
+    global _hasher
+    _hasher = MinHasher(num_perm)
+
+
+def _signatures(texts: list[str]) -> list[np.ndarray]:
+    return [_hasher.signature(text) for text in texts]
+
+
+def _iter_signatures(pool: ProcessPoolExecutor, texts, workers: int):
+    """Signatures in input order, reading `texts` only as far as the bounded
+    in-flight window needs. Executor.map would drain the iterator up front
+    and queue every text as a pending work item."""
+    texts = iter(texts)
+    pending: deque = deque()
+    while True:
+        while len(pending) < 2 * workers and (batch := list(islice(texts, BATCH_SIZE))):
+            pending.append(pool.submit(_signatures, batch))
+        if not pending:
+            return
+        yield from pending.popleft().result()
+
+
+def find_duplicates(texts, num_perm: int = 64, bands: int = 16, threshold: float = 0.8,
+                    workers: int | None = None) -> tuple[dict[int, int], int]:
+    """Map each near-duplicate chunk index to its canonical (first seen) index.
+
+    Only canonical signatures are kept in memory, and each LSH bucket stores
+    a single representative, so large boilerplate clusters cost one
+    comparison per band rather than one per member. Returns (dups, n_chunks).
+    """
+    if num_perm % bands:
+        raise ValueError(f"num_perm ({num_perm}) must be divisible by bands ({bands})")
+    rows = num_perm // bands
+    buckets: list[dict[bytes, int]] = [{} for _ in range(bands)]
+    canon_sigs: dict[int, np.ndarray] = {}
+    dups: dict[int, int] = {}
+    n = 0
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(num_perm,)) as pool:
+        for i, sig in enumerate(_iter_signatures(pool, texts, workers)):
+            n += 1
+            keys = [sig[b * rows:(b + 1) * rows].tobytes() for b in range(bands)]
+            match = None
+            for band, key in enumerate(keys):
+                j = buckets[band].get(key)
+                if j is not None and np.mean(canon_sigs[j] == sig) >= threshold:
+                    match = j
+                    break
+            if match is not None:
+                dups[i] = match
+                continue
+            canon_sigs[i] = sig
+            for band, key in enumerate(keys):
+                buckets[band].setdefault(key, i)
+    return dups, n
+
+
+def _iter_texts(path: Path):
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)["text"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Remove near-duplicate chunks with MinHash LSH")
+    parser.add_argument("--chunks", default="data/chunks.jsonl")
+    parser.add_argument("--out", default=None, help="Output JSONL (default: rewrite --chunks in place)")
+    parser.add_argument("--threshold", type=float, default=0.8, help="Estimated Jaccard similarity for a duplicate")
+    parser.add_argument("--num-perm", type=int, default=64, help="MinHash permutations")
+    parser.add_argument("--bands", type=int, default=16, help="LSH bands (num_perm must be divisible)")
+    parser.add_argument("--workers", type=int, default=None, help="Signature processes (default: all cores)")
+    args = parser.parse_args()
+
+    chunks_path = Path(args.chunks)
+    out_path = Path(args.out) if args.out else chunks_path
+
+    # Pass 1: cluster. Pass 2: stream rows again and write canonicals only.
+    dups, n = find_duplicates(_iter_texts(chunks_path), args.num_perm, args.bands,
+                              args.threshold, args.workers)
+    alt_urls: dict[int, list[str]] = {}
+    dup_urls: dict[int, str] = {}
+    with chunks_path.open("r", encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            if i in dups:
+                dup_urls[i] = json.loads(line)["source_url"]
+    for i, canon in dups.items():
+        alt_urls.setdefault(canon, []).append(dup_urls[i])
+
+    partial = out_path.with_name(out_path.name + ".partial")
+    with chunks_path.open("r", encoding="utf-8") as src, partial.open("w", encoding="utf-8") as dst:
+        for i, line in enumerate(src):
+            if i in dups:
+                continue
+            if i in alt_urls:
+                row = json.loads(line)
+                urls = [u for u in dict.fromkeys(alt_urls[i]) if u != row["source_url"]]
+                if urls:
+                    row["alt_source_urls"] = urls
+                line = json.dumps(row, ensure_ascii=False) + "\n"
+            dst.write(line)
+    os.replace(partial, out_path)
+
+    kept = n - len(dups)
+    ratio = len(dups) / n if n else 0.0
+    print(f"Dedup: {n} chunks → {kept} kept, {len(dups)} near-duplicates removed "
+          f"({ratio:.1%}) in {len(alt_urls)} clusters; wrote {out_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,15 @@
 import argparse
+import hashlib
 import json
+import re
 from pathlib import Path
 
 import numpy as np
 import psycopg
 import yaml
 from pgvector.psycopg import register_vector
-from sentence_transformers import SentenceTransformer
+
+from checkpoint import Checkpoint
 
 
 CREATE_EXTENSION = "CREATE EXTENSION IF NOT EXISTS vector"
@@ -19,21 +22,382 @@ CREATE TABLE IF NOT EXISTS {schema}.{table} (
     language TEXT,
     content TEXT,
     tokens INT,
-    embedding vector(1024)
+    embedding vector({dim}),
+    content_hash TEXT,
+    embed_model TEXT,
+    page_start INT,
+    page_end INT,
+    alt_source_urls TEXT[],
+    access_level TEXT NOT NULL DEFAULT 'public',
+    customer_id TEXT,
+    chunk_index INT
+)
+"""
+# Columns added after the original schema, for tables created by older versions
+ADD_COLUMNS = """
+ALTER TABLE {schema}.{table}
+    ADD COLUMN IF NOT EXISTS content_hash TEXT,
+    ADD COLUMN IF NOT EXISTS embed_model TEXT,
+    ADD COLUMN IF NOT EXISTS page_start INT,
+    ADD COLUMN IF NOT EXISTS page_end INT,
+    ADD COLUMN IF NOT EXISTS alt_source_urls TEXT[],
+    ADD COLUMN IF NOT EXISTS access_level TEXT NOT NULL DEFAULT 'public',
+    ADD COLUMN IF NOT EXISTS customer_id TEXT,
+    ADD COLUMN IF NOT EXISTS chunk_index INT
+"""
+# Chunk ids are `{url}#c{ordinal}`; rows indexed before chunk_index existed
+# get it from their id
+FILL_CHUNK_INDEX = """
+UPDATE {schema}.{table} SET chunk_index = substring(id from '#c([0-9]+)$')::int
+WHERE chunk_index IS NULL AND id ~ '#c[0-9]+$'
+"""
+CHUNK_ID_RE = re.compile(r"#c(\d+)$")
+# Neighbouring chunks of a hit (rag_api.fetch_matches expand=N)
+CREATE_CHUNK_INDEX = """
+CREATE INDEX IF NOT EXISTS {table}_source_chunk_idx ON {schema}.{table} (source_url, chunk_index)
+"""
+# Data classification tiers (TIETOKANNAN_RIKASTUS.md). `customer` rows also
+# carry the customer_id they belong to.
+TIERS = ("public", "proprietary", "customer")
+# Partitioned layout (postgres.partitioning): list partitions per tier,
+# optionally sub-partitioned by language, each with its own HNSW index. The
+# primary key has to include the partition columns, and language becomes
+# NOT NULL ('und' when unknown) when it is a partition column.
+PARTITIONING = ("none", "tier", "tier_language")
+UNKNOWN_LANGUAGE = "und"
+CREATE_PARTITIONED_TABLE = """
+CREATE TABLE IF NOT EXISTS {schema}.{table} (
+    id TEXT NOT NULL,
+    source_url TEXT,
+    title TEXT,
+    license TEXT,
+    language TEXT{language_constraint},
+    content TEXT,
+    tokens INT,
+    embedding vector({dim}),
+    content_hash TEXT,
+    embed_model TEXT,
+    page_start INT,
+    page_end INT,
+    alt_source_urls TEXT[],
+    access_level TEXT NOT NULL DEFAULT 'public',
+    customer_id TEXT,
+    chunk_index INT,
+    PRIMARY KEY ({key})
+) PARTITION BY LIST (access_level)
+"""
+CREATE_TIER_PARTITION = """
+CREATE TABLE IF NOT EXISTS {schema}.{table}_{tier} PARTITION OF {schema}.{table}
+    FOR VALUES IN ('{tier}'){subpartition}
+"""
+CREATE_LANGUAGE_PARTITION = """
+CREATE TABLE IF NOT EXISTS {schema}.{table}_{tier}_{language} PARTITION OF {schema}.{table}_{tier}
+    FOR VALUES IN ('{language}')
+"""
+CREATE_OTHER_LANGUAGE_PARTITION = """
+CREATE TABLE IF NOT EXISTS {schema}.{table}_{tier}_other PARTITION OF {schema}.{table}_{tier} DEFAULT
+"""
+# Created on the parent, so Postgres builds one index per leaf partition
+CREATE_EMBEDDING_INDEX = """
+CREATE INDEX IF NOT EXISTS {table}_embedding_idx ON {schema}.{table}
+    USING hnsw (embedding vector_cosine_ops)
+"""
+SELECT_RELKIND = """
+SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname = %s AND c.relname = %s
+"""
+# Bulk load path: binary COPY into an unlogged staging table, then one
+# INSERT ... ON CONFLICT per write batch.
+COLUMNS = ("id", "source_url", "title", "license", "language", "content", "tokens", "embedding",
+           "content_hash", "embed_model", "page_start", "page_end", "alt_source_urls",
+           "access_level", "customer_id", "chunk_index")
+COPY_TYPES = ["text", "text", "text", "text", "text", "text", "int4", "vector", "text", "text",
+              "int4", "int4", "text[]", "text", "text", "int4"]
+CREATE_STAGING = """
+DROP TABLE IF EXISTS {schema}.{table}_staging;
+CREATE UNLOGGED TABLE {schema}.{table}_staging (LIKE {schema}.{table} INCLUDING DEFAULTS)
+"""
+# Without the parent's NOT NULL constraints, so the merge can fill in defaults
+CREATE_STAGING_PARTITIONED = """
+DROP TABLE IF EXISTS {schema}.{table}_staging;
+CREATE UNLOGGED TABLE {schema}.{table}_staging AS SELECT {cols} FROM {schema}.{table} WITH NO DATA
+"""
+COPY_STAGING = "COPY {schema}.{table}_staging ({cols}) FROM STDIN WITH (FORMAT BINARY)"
+MERGE_STAGING = """
+INSERT INTO {schema}.{table} ({cols})
+SELECT DISTINCT ON (id) {cols} FROM {schema}.{table}_staging ORDER BY id
+ON CONFLICT (id) DO UPDATE SET {updates}
+"""
+# A chunk whose tier or language changed lives in another partition, where
+# ON CONFLICT cannot see it, so its old row is deleted first.
+MERGE_STAGING_PARTITIONED = """
+DELETE FROM {schema}.{table} d USING {schema}.{table}_staging s
+WHERE d.id = s.id AND (d.access_level, d.language) IS DISTINCT FROM (s.access_level, {staging_language});
+INSERT INTO {schema}.{table} ({cols})
+SELECT DISTINCT ON (id) {select_cols} FROM {schema}.{table}_staging ORDER BY id
+ON CONFLICT ({key}) DO UPDATE SET {updates}
+"""
+TRUNCATE_STAGING = "TRUNCATE {schema}.{table}_staging"
+# Compressed copies of `embedding` for fast first-pass retrieval. They are
+# generated columns, so the loader never writes them; rag_api.fetch_matches
+# rescores their candidates with the fp32 vectors.
+QUANTIZED_COLUMNS = {
+    "halfvec": """
+ALTER TABLE {schema}.{table} ADD COLUMN IF NOT EXISTS embedding_half halfvec({dim})
+    GENERATED ALWAYS AS (embedding::halfvec({dim})) STORED;
+CREATE INDEX IF NOT EXISTS {table}_embedding_half_idx ON {schema}.{table}
+    USING hnsw (embedding_half halfvec_cosine_ops)
+""",
+    "binary": """
+ALTER TABLE {schema}.{table} ADD COLUMN IF NOT EXISTS embedding_bin bit({dim})
+    GENERATED ALWAYS AS (binary_quantize(embedding)::bit({dim})) STORED;
+CREATE INDEX IF NOT EXISTS {table}_embedding_bin_idx ON {schema}.{table}
+    USING hnsw (embedding_bin bit_hamming_ops)
+""",
+}
+# The skip key: a chunk is re-written when its content, model, tier or owner changed
+SELECT_HASHES = "SELECT id, content_hash, embed_model, access_level, customer_id FROM {schema}.{table}"
+DELETE_IDS = "DELETE FROM {schema}.{table} WHERE id = ANY(%s)"
+SELECT_COLUMN_DIM = """
+SELECT a.atttypmod FROM pg_attribute a
+JOIN pg_class c ON c.oid = a.attrelid JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname = %s AND c.relname = %s AND a.attname = %s AND NOT a.attisdropped
+"""
+
+DEFAULT_DIM = 1024
+# Model migrations (migrate_embeddings.py). One row per documents table: the
+# model the `embedding` column holds, and while a migration runs the model
+# being backfilled into `embedding_next`. `generation` is bumped by every
+# cutover; rag_api checks it in the same statement as the vector search, so a
+# query embedded with the old model never ranks against the new column.
+CREATE_EMBEDDING_STATE = """
+CREATE TABLE IF NOT EXISTS public.embedding_state (
+    table_name   TEXT PRIMARY KEY,
+    generation   INT NOT NULL DEFAULT 0,
+    model        TEXT,
+    dim          INT,
+    shadow_model TEXT,
+    shadow_dim   INT,
+    prev_model   TEXT,
+    prev_dim     INT,
+    status       TEXT NOT NULL DEFAULT 'idle',
+    backfilled   BIGINT NOT NULL DEFAULT 0,
+    total        BIGINT NOT NULL DEFAULT 0,
+    updated_at   TIMESTAMPTZ NOT NULL DEFAULT NOW()
 )
 """
-UPSERT = """
-INSERT INTO {schema}.{table} (id, source_url, title, license, language, content, tokens, embedding)
-VALUES (%(id)s, %(source_url)s, %(title)s, %(license)s, %(language)s, %(content)s, %(tokens)s, %(embedding)s)
-ON CONFLICT (id) DO UPDATE SET
-    source_url = EXCLUDED.source_url,
-    title = EXCLUDED.title,
-    license = EXCLUDED.license,
-    language = EXCLUDED.language,
-    content = EXCLUDED.content,
-    tokens = EXCLUDED.tokens,
-    embedding = EXCLUDED.embedding
+SELECT_EMBEDDING_STATE = """
+SELECT generation, model, dim, shadow_model, shadow_dim, prev_model, prev_dim,
+       status, backfilled, total, updated_at
+FROM public.embedding_state WHERE table_name = %s
 """
+STATE_FIELDS = ("generation", "model", "dim", "shadow_model", "shadow_dim", "prev_model", "prev_dim",
+                "status", "backfilled", "total", "updated_at")
+SHADOW_COLUMN = "embedding_next"
+SHADOW_MODEL_COLUMN = "embed_model_next"
+# Shadow vectors go through a temp table and land by id, only where the row
+# still has the content they were computed from.
+CREATE_SHADOW_BATCH = """
+CREATE TEMP TABLE IF NOT EXISTS shadow_batch (id TEXT, content_hash TEXT, embedding vector)
+    ON COMMIT DELETE ROWS
+"""
+COPY_SHADOW_BATCH = "COPY shadow_batch (id, content_hash, embedding) FROM STDIN WITH (FORMAT BINARY)"
+APPLY_SHADOW_BATCH = """
+UPDATE {schema}.{table} d SET embedding_next = b.embedding, embed_model_next = %s
+FROM shadow_batch b
+WHERE d.id = b.id AND d.content_hash IS NOT DISTINCT FROM b.content_hash
+"""
+
+
+def partitioning(db_cfg) -> str:
+    mode = db_cfg.get("partitioning") or "none"
+    if mode not in PARTITIONING:
+        raise ValueError(f"Unknown partitioning {mode!r}; expected one of {PARTITIONING}")
+    return mode
+
+
+def partition_key(db_cfg) -> tuple[str, ...]:
+    return {"none": ("id",), "tier": ("id", "access_level"),
+            "tier_language": ("id", "access_level", "language")}[partitioning(db_cfg)]
+
+
+def _language_expr(key: tuple[str, ...], prefix: str = "") -> str:
+    if "language" in key:
+        return f"COALESCE({prefix}language, '{UNKNOWN_LANGUAGE}')"
+    return f"{prefix}language"
+
+
+def _select_cols(key: tuple[str, ...]) -> str:
+    """COLUMNS as a select list that fills in the partitioned layout's defaults."""
+    return ", ".join(_language_expr(key) if c == "language" else c for c in COLUMNS)
+
+
+def build_sql(db_cfg) -> dict[str, str]:
+    """Format the bulk-load statements once per run."""
+    names = {"schema": db_cfg["schema"], "table": db_cfg["table"]}
+    cols = ", ".join(COLUMNS)
+    key = partition_key(db_cfg)
+    updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in COLUMNS if c not in key)
+    if key == ("id",):
+        create_staging = CREATE_STAGING.format(**names)
+        merge = MERGE_STAGING.format(cols=cols, updates=updates, **names)
+    else:
+        create_staging = CREATE_STAGING_PARTITIONED.format(cols=cols, **names)
+        merge = MERGE_STAGING_PARTITIONED.format(
+            cols=cols, select_cols=_select_cols(key), key=", ".join(key), updates=updates,
+            staging_language=_language_expr(key, "s."), **names)
+    return {
+        "create_staging": create_staging,
+        "copy": COPY_STAGING.format(cols=cols, **names),
+        "merge": merge,
+        "truncate": TRUNCATE_STAGING.format(**names),
+    }
+
+
+def build_conn_str(db_cfg) -> str:
+    return (
+        f"host={db_cfg['host']} port={db_cfg['port']} dbname={db_cfg['database']} "
+        f"user={db_cfg['user']} password={db_cfg['password']}"
+    )
+
+
+def _relkind(cur, db_cfg) -> str | None:
+    """'r' for a plain table, 'p' for a partitioned one, None if missing."""
+    cur.execute(SELECT_RELKIND, (db_cfg["schema"], db_cfg["table"]))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def table_name(db_cfg) -> str:
+    return f"{db_cfg['schema']}.{db_cfg['table']}"
+
+
+def column_dim(cur, db_cfg, column: str = "embedding") -> int | None:
+    """Declared dimension of a vector column, None if the column is missing."""
+    cur.execute(SELECT_COLUMN_DIM, (db_cfg["schema"], db_cfg["table"], column))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def load_embedding_state(cur, db_cfg) -> dict | None:
+    cur.execute(SELECT_EMBEDDING_STATE, (table_name(db_cfg),))
+    row = cur.fetchone()
+    return dict(zip(STATE_FIELDS, row)) if row else None
+
+
+def check_embedding_model(conn, db_cfg, model_id: str) -> str | None:
+    """Refuse to write vectors from a model other than the one the table holds.
+    Returns the shadow model when a migration is backfilling, else None."""
+    with conn.cursor() as cur:
+        state = load_embedding_state(cur, db_cfg)
+    if state is None:
+        return None
+    if state["model"] and state["model"] != model_id:
+        raise SystemExit(f"{table_name(db_cfg)} holds {state['model']} embeddings, not {model_id}; "
+                         "update embedding.model_name / embedding.dim (see migrate_embeddings.py status)")
+    return state["shadow_model"]
+
+
+def write_shadow(cur, db_cfg, rows, embeddings, model_id: str) -> int:
+    """Set embedding_next for (id, content_hash) rows in the caller's transaction."""
+    cur.execute(CREATE_SHADOW_BATCH)
+    with cur.copy(COPY_SHADOW_BATCH) as copy:
+        copy.set_types(["text", "text", "vector"])
+        for (doc_id, chash), emb in zip(rows, embeddings):
+            copy.write_row((doc_id, chash, np.asarray(emb, dtype=np.float32)))
+    cur.execute(APPLY_SHADOW_BATCH.format(schema=db_cfg["schema"], table=db_cfg["table"]), (model_id,))
+    return cur.rowcount
+
+
+def _create_tables(cur, db_cfg, dim: int):
+    names = {"schema": db_cfg["schema"], "table": db_cfg["table"], "dim": dim}
+    mode = partitioning(db_cfg)
+    if mode == "none":
+        cur.execute(CREATE_TABLE.format(**names))
+        cur.execute(ADD_COLUMNS.format(**names))
+        return
+    by_language = mode == "tier_language"
+    cur.execute(CREATE_PARTITIONED_TABLE.format(
+        key=", ".join(partition_key(db_cfg)),
+        language_constraint=f" NOT NULL DEFAULT '{UNKNOWN_LANGUAGE}'" if by_language else "", **names))
+    languages = db_cfg.get("partition_languages") or []
+    for language in languages:
+        if not re.fullmatch(r"[a-z]{2,3}", language):
+            raise ValueError(f"partition_languages: {language!r} is not an ISO 639 code")
+    for tier in TIERS:
+        cur.execute(CREATE_TIER_PARTITION.format(
+            tier=tier, subpartition=" PARTITION BY LIST (language)" if by_language else "", **names))
+        if by_language:
+            for language in languages:
+                cur.execute(CREATE_LANGUAGE_PARTITION.format(tier=tier, language=language, **names))
+            cur.execute(CREATE_OTHER_LANGUAGE_PARTITION.format(tier=tier, **names))
+    cur.execute(ADD_COLUMNS.format(**names))
+
+
+def _create_indexes(cur, db_cfg, dim: int):
+    names = {"schema": db_cfg["schema"], "table": db_cfg["table"], "dim": dim}
+    if partitioning(db_cfg) != "none":
+        cur.execute(CREATE_EMBEDDING_INDEX.format(**names))
+    cur.execute(CREATE_CHUNK_INDEX.format(**names))
+    for kind in db_cfg.get("quantize") or []:
+        if kind not in QUANTIZED_COLUMNS:
+            raise ValueError(f"Unknown quantization {kind!r}; expected one of {sorted(QUANTIZED_COLUMNS)}")
+        cur.execute(QUANTIZED_COLUMNS[kind].format(**names))
+
+
+def ensure_schema(conn, db_cfg, sql: dict[str, str], dim: int = DEFAULT_DIM):
+    with conn.cursor() as cur:
+        cur.execute(CREATE_EXTENSION)
+        cur.execute(CREATE_EMBEDDING_STATE)
+        kind, mode = _relkind(cur, db_cfg), partitioning(db_cfg)
+        if kind == "r" and mode != "none":
+            raise SystemExit(f"{db_cfg['schema']}.{db_cfg['table']} is not partitioned; "
+                             "run embed_and_index.py --repartition once to convert it")
+        if kind == "p" and mode == "none":
+            raise SystemExit(f"{db_cfg['schema']}.{db_cfg['table']} is partitioned; "
+                             "set postgres.partitioning to match it")
+        table_dim = column_dim(cur, db_cfg) if kind else None
+        if table_dim not in (None, dim):
+            raise SystemExit(f"{db_cfg['schema']}.{db_cfg['table']}.embedding is vector({table_dim}), "
+                             f"not vector({dim}); switch models with migrate_embeddings.py")
+        fill_ordinals = kind is not None and column_dim(cur, db_cfg, "chunk_index") is None
+        _create_tables(cur, db_cfg, dim)
+        if fill_ordinals:
+            cur.execute(FILL_CHUNK_INDEX.format(schema=db_cfg["schema"], table=db_cfg["table"]))
+        _create_indexes(cur, db_cfg, dim)
+        cur.execute(sql["create_staging"])
+    conn.commit()
+
+
+def repartition(conn, db_cfg) -> int:
+    """Convert a plain documents table into the configured partitioned layout
+    in one transaction: rename, create partitions, copy rows, build indexes."""
+    schema, table = db_cfg["schema"], db_cfg["table"]
+    if partitioning(db_cfg) == "none":
+        raise SystemExit("Set postgres.partitioning to 'tier' or 'tier_language' first")
+    with conn.transaction(), conn.cursor() as cur:
+        cur.execute(CREATE_EXTENSION)
+        if _relkind(cur, db_cfg) != "r":
+            return 0
+        if column_dim(cur, db_cfg, SHADOW_COLUMN) is not None:
+            raise SystemExit("A model migration is in progress; cut over or abort it before repartitioning")
+        dim = column_dim(cur, db_cfg)
+        cur.execute(ADD_COLUMNS.format(schema=schema, table=table))
+        cur.execute(FILL_CHUNK_INDEX.format(schema=schema, table=table))
+        cur.execute(f"ALTER TABLE {schema}.{table} RENAME TO {table}_flat")
+        # Free the index names for the new table
+        cur.execute(f"ALTER INDEX IF EXISTS {schema}.{table}_pkey RENAME TO {table}_flat_pkey")
+        for kind in QUANTIZED_COLUMNS:
+            suffix = "half" if kind == "halfvec" else "bin"
+            cur.execute(f"DROP INDEX IF EXISTS {schema}.{table}_embedding_{suffix}_idx")
+        cur.execute(f"DROP INDEX IF EXISTS {schema}.{table}_source_chunk_idx")
+        _create_tables(cur, db_cfg, dim)
+        cur.execute(f"INSERT INTO {schema}.{table} ({', '.join(COLUMNS)}) "
+                    f"SELECT {_select_cols(partition_key(db_cfg))} FROM {schema}.{table}_flat")
+        moved = cur.rowcount
+        cur.execute(f"DROP TABLE {schema}.{table}_flat")
+        _create_indexes(cur, db_cfg, dim)
+    return moved
 
 
 def load_config(path: Path) -> dict:
@@ -47,63 +411,221 @@ def load_chunks(path: Path):
             yield json.loads(line)
 
 
+def iter_chunks(path: Path, start: int = 0, stop: int | None = None):
+    """Yield (end_offset, row) from byte `start` up to byte `stop`."""
+    with path.open("rb") as f:
+        f.seek(start)
+        offset = start
+        for line in f:
+            offset += len(line)
+            if stop is not None and offset > stop:
+                return
+            yield offset, json.loads(line)
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_source(chunk_id: str) -> str:
+    """`https://host/page#c12` -> `https://host/page`, the source as listed
+    in sources.jsonl (source_url holds the URL after redirects)."""
+    return chunk_id.rsplit("#c", 1)[0]
+
+
+def stale_ids(existing, seen_ids: set[str]) -> list[str]:
+    """Indexed chunks of the sources in this run that the run no longer
+    produced (re-chunked pages). Sources absent from the run (failed or
+    skipped fetches, other chunk files) keep their rows, so a web run never
+    touches internal documents (file:// sources) and vice versa."""
+    sources = {chunk_source(doc_id) for doc_id in seen_ids}
+    return [doc_id for doc_id in existing if doc_id not in seen_ids and chunk_source(doc_id) in sources]
+
+
+def chunk_ordinal(chunk_id: str) -> int | None:
+    """`https://host/page#c12` -> 12; None for ids in another format."""
+    m = CHUNK_ID_RE.search(chunk_id)
+    return int(m.group(1)) if m else None
+
+
+def fetch_existing_hashes(conn, db_cfg) -> dict[str, tuple]:
+    """Return {id: (content_hash, embed_model, access_level, customer_id)}
+    for every indexed chunk; compare with skip_key()."""
+    with conn.cursor() as cur:
+        cur.execute(SELECT_HASHES.format(schema=db_cfg["schema"], table=db_cfg["table"]))
+        return {r[0]: tuple(r[1:]) for r in cur}
+
+
+def skip_key(row: dict, model_id: str) -> tuple:
+    """What fetch_existing_hashes returns for a row that needs no rewrite. A
+    tier or customer change is not skipped, so the merge moves the row."""
+    return row["content_hash"], model_id, row.get("access_level", "public"), row.get("customer_id")
+
+
+def tier_error(row: dict) -> str | None:
+    tier = row.get("access_level", "public")
+    if tier not in TIERS or (tier == "customer") != bool(row.get("customer_id")):
+        return (f"{row['id']}: access_level {tier!r} / customer_id {row.get('customer_id')!r} "
+                f"is invalid (tiers: {', '.join(TIERS)}; customer_id only for customer)")
+    return None
+
+
 def main():
     parser = argparse.ArgumentParser(description="Embed chunks and upsert into Postgres/pgvector")
     parser.add_argument("--config", default="config.yaml")
     parser.add_argument("--chunks", default="data/chunks.jsonl")
+    parser.add_argument("--encode-batch", type=int, help="Texts per model.encode call (embedding.batch_size)")
+    parser.add_argument("--write-batch", type=int, help="Rows per COPY + merge (postgres.write_batch_size)")
+    parser.add_argument("--quantize", nargs="*", choices=sorted(QUANTIZED_COLUMNS),
+                        help="Compressed vector columns + indexes to maintain (postgres.quantize)")
+    parser.add_argument("--force", action="store_true",
+                        help="Re-embed every chunk even if its content hash is unchanged")
+    parser.add_argument("--keep-stale", action="store_true",
+                        help="Do not delete rows of the indexed sources whose ids are missing "
+                             "from the chunks file")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue after the last committed batch of an interrupted run")
+    parser.add_argument("--partitioning", choices=PARTITIONING,
+                        help="Table layout: flat, per tier or per tier and language (postgres.partitioning)")
+    parser.add_argument("--repartition", action="store_true",
+                        help="Convert an existing flat table into the partitioned layout before indexing")
     args = parser.parse_args()
 
     cfg = load_config(Path(args.config))
     db_cfg = cfg["postgres"]
     emb_cfg = cfg["embedding"]
+    if args.quantize is not None:
+        db_cfg["quantize"] = args.quantize
+    if args.partitioning is not None:
+        db_cfg["partitioning"] = args.partitioning
 
-    model = SentenceTransformer(emb_cfg["model_name"], device=emb_cfg.get("device", "cpu"))
+    models = {}
 
-    conn_str = (
-        f"host={db_cfg['host']} port={db_cfg['port']} dbname={db_cfg['database']} "
-        f"user={db_cfg['user']} password={db_cfg['password']}"
-    )
+    def encode(texts, name=None):
+        # Loaded on first use so a run where nothing changed never touches the model
+        name = name or emb_cfg["model_name"]
+        if name not in models:
+            from sentence_transformers import SentenceTransformer
+            models[name] = SentenceTransformer(name, device=emb_cfg.get("device", "cpu"))
+        return models[name].encode(texts, normalize_embeddings=True)
+
+    conn_str = build_conn_str(db_cfg)
+    model_id = emb_cfg["model_name"]
+    encode_batch_size = args.encode_batch or emb_cfg.get("batch_size", 16)
+    write_batch = args.write_batch or db_cfg.get("write_batch_size", 2000)
+    sql = build_sql(db_cfg)
     with psycopg.connect(conn_str) as conn:
         register_vector(conn)
-        with conn.cursor() as cur:
-            cur.execute(CREATE_EXTENSION)
-            cur.execute(CREATE_TABLE.format(schema=db_cfg["schema"], table=db_cfg["table"]))
-            conn.commit()
+        if args.repartition:
+            moved = repartition(conn, db_cfg)
+            print(f"Repartitioned {db_cfg['schema']}.{db_cfg['table']}: {moved} rows moved")
+        ensure_schema(conn, db_cfg, sql, emb_cfg.get("dim", DEFAULT_DIM))
+        # During a model migration new and changed rows get both embeddings
+        shadow_model = check_embedding_model(conn, db_cfg, model_id)
+        if shadow_model:
+            print(f"Migration to {shadow_model} in progress: dual-writing {SHADOW_COLUMN}")
+
+        existing = {} if args.force else fetch_existing_hashes(conn, db_cfg)
+        seen_ids: set[str] = set()
+        skipped = embedded = 0
+
+        # The manifest records every committed write batch and the byte offset
+        # in the chunks file it covers, so --resume can seek past them.
+        chunks_path = Path(args.chunks)
+        st = chunks_path.stat()
+        ckpt = Checkpoint(chunks_path.with_name(chunks_path.name + ".index-manifest.jsonl"))
+        meta = {"chunks": str(chunks_path.resolve()), "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                "table": f"{db_cfg['schema']}.{db_cfg['table']}", "model": model_id, "force": args.force}
+        done = ckpt.start(meta, resume=args.resume)
+        start_offset = done[-1]["offset"] if done else 0
+        batch_id = done[-1]["batch"] + 1 if done else 0
+        if done:
+            # Already indexed rows still count as seen for stale-row deletion
+            seen_ids.update(row["id"] for _, row in iter_chunks(chunks_path, 0, start_offset))
+            print(f"Resuming after batch {batch_id - 1}: {len(seen_ids)} chunks already indexed")
+
+        # Encoder batches feed a larger write buffer that is flushed per COPY
+        write_rows: list[dict] = []
+        write_embs: list[np.ndarray] = []
+        shadow_embs: list[np.ndarray] = []
+        write_offset = start_offset
+
+        def flush_writes():
+            nonlocal embedded, batch_id
+            if write_rows:
+                shadow = (db_cfg, shadow_model, shadow_embs) if shadow_model else None
+                _bulk_upsert(conn, sql, write_rows, write_embs, model_id, shadow)
+                ckpt.record(batch=batch_id, offset=write_offset, rows=len(write_rows))
+                embedded += len(write_rows)
+                batch_id += 1
+                write_rows.clear(); write_embs.clear(); shadow_embs.clear()
+
+        def encode_batch(rows, offset):
+            nonlocal write_offset
+            write_rows.extend(rows)
+            write_embs.extend(encode([r["text"] for r in rows]))
+            if shadow_model:
+                shadow_embs.extend(encode([r["text"] for r in rows], shadow_model))
+            write_offset = offset
+            if len(write_rows) >= write_batch:
+                flush_writes()
 
-        batch_ids = []
-        batch_texts = []
         batch_rows = []
-        for row in load_chunks(Path(args.chunks)):
-            batch_ids.append(row["id"])
-            batch_texts.append(row["text"])
+        last_offset = start_offset
+        for last_offset, row in iter_chunks(chunks_path, start_offset):
+            seen_ids.add(row["id"])
+            row.setdefault("access_level", "public")
+            if error := tier_error(row):
+                raise SystemExit(error)
+            row["content_hash"] = content_hash(row["text"])
+            if existing.get(row["id"]) == skip_key(row, model_id):
+                skipped += 1
+                continue
             batch_rows.append(row)
-            if len(batch_texts) >= emb_cfg.get("batch_size", 16):
-                embeddings = model.encode(batch_texts, normalize_embeddings=True)
-                _upsert_batch(conn, db_cfg, batch_rows, embeddings)
-                batch_ids.clear(); batch_texts.clear(); batch_rows.clear()
-        if batch_texts:
-            embeddings = model.encode(batch_texts, normalize_embeddings=True)
-            _upsert_batch(conn, db_cfg, batch_rows, embeddings)
+            if len(batch_rows) >= encode_batch_size:
+                encode_batch(batch_rows, last_offset)
+                batch_rows = []
+        if batch_rows:
+            encode_batch(batch_rows, last_offset)
+        flush_writes()
+
+        # Chunks that vanished from a source in this file (re-chunked pages)
+        if args.force:
+            existing = fetch_existing_hashes(conn, db_cfg)
+        stale = stale_ids(existing, seen_ids)
+        if stale and not args.keep_stale:
+            with conn.cursor() as cur:
+                cur.execute(DELETE_IDS.format(schema=db_cfg["schema"], table=db_cfg["table"]), (stale,))
+        deleted = 0 if args.keep_stale else len(stale)
         conn.commit()
-    print("Embedding and upsert complete")
+        ckpt.finish()
+    print(f"Embedding and upsert complete: {embedded} embedded, {skipped} skipped (unchanged), "
+          f"{deleted} deleted")
+
 
+def _bulk_upsert(conn, sql: dict[str, str], rows, embeddings, model_id: str, shadow=None):
+    """Stream rows into the staging table with binary COPY and merge them
+    into the documents table in a single statement and transaction.
 
-def _upsert_batch(conn, db_cfg, rows, embeddings: np.ndarray):
+    `shadow` is (db_cfg, model_id, embeddings) while a model migration is
+    backfilling; those vectors are written to embedding_next in the same
+    transaction."""
     with conn.cursor() as cur:
-        for row, emb in zip(rows, embeddings):
-            cur.execute(
-                UPSERT.format(schema=db_cfg["schema"], table=db_cfg["table"]),
-                {
-                    "id": row["id"],
-                    "source_url": row["source_url"],
-                    "title": row.get("title"),
-                    "license": row.get("license"),
-                    "language": row.get("language"),
-                    "content": row["text"],
-                    "tokens": row.get("tokens", 0),
-                    "embedding": emb.tolist(),
-                },
-            )
+        with cur.copy(sql["copy"]) as copy:
+            copy.set_types(COPY_TYPES)
+            for row, emb in zip(rows, embeddings):
+                copy.write_row((
+                    row["id"], row["source_url"], row.get("title"), row.get("license"),
+                    row.get("language"), row["text"], row.get("tokens", 0),
+                    np.asarray(emb, dtype=np.float32), row["content_hash"], model_id,
+                    row.get("page_start"), row.get("page_end"), row.get("alt_source_urls"),
+                    row.get("access_level", "public"), row.get("customer_id"), chunk_ordinal(row["id"]),
+                ))
+        cur.execute(sql["merge"])
+        cur.execute(sql["truncate"])
+        if shadow is not None:
+            db_cfg, shadow_model, shadow_embs = shadow
+            write_shadow(cur, db_cfg, [(r["id"], r["content_hash"]) for r in rows], shadow_embs, shadow_model)
     conn.commit()
 
 
@@ -1,9 +1,20 @@
 import argparse
+import asyncio
+import hashlib
 import json
+import os
+import random
 import re
+import tempfile
+import time
+from bisect import bisect_left, bisect_right
+from collections import Counter, defaultdict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from functools import lru_cache
 from pathlib import Path
 from typing import Iterable
-from urllib.parse import unquote
+from urllib.parse import unquote, urlsplit
 
 import httpx
 import tiktoken
@@ -11,11 +22,25 @@ import trafilatura
 import yaml
 from pydantic import BaseModel
 
+from checkpoint import Checkpoint
+
 
 HEADERS = {
     "User-Agent": "SearchAssistant/1.0 (educational research bot; contact: admin@example.com)"
 }
 
+# Defaults for the async crawler, overridable via `fetching:` in config.yaml
+FETCH_DEFAULTS = {
+    "concurrency": 16,
+    "per_host_concurrency": 2,
+    "delay_s": 1.0,
+    "retries": 3,
+    "backoff_s": 1.0,
+    "timeout_s": 30.0,
+    "extract_workers": None,  # None = os.cpu_count()
+}
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
 
 class DocumentChunk(BaseModel):
     id: str
@@ -25,6 +50,14 @@ class DocumentChunk(BaseModel):
     language: str | None
     text: str
     tokens: int
+    # Set for paged documents (PDF); omitted from the JSONL for web pages
+    page_start: int | None = None
+    page_end: int | None = None
+    # Set by dedup_chunks.py on a canonical chunk that absorbed near-duplicates
+    alt_source_urls: list[str] | None = None
+    # Classification tier (public / proprietary / customer), see TIETOKANNAN_RIKASTUS.md
+    access_level: str = "public"
+    customer_id: str | None = None
 
 
 def load_config(path: Path) -> dict:
@@ -49,36 +82,410 @@ def _wiki_article_name(url: str) -> tuple[str, str]:
     return m.group(1), unquote(m.group(2))
 
 
-def fetch_wikipedia(url: str) -> tuple[str, str]:
-    """Fetch article plain text via Wikipedia REST API."""
+def _wiki_api_url(url: str) -> str:
     lang, title = _wiki_article_name(url)
-    api_url = f"https://{lang}.wikipedia.org/api/rest_v1/page/html/{title}"
-    with httpx.Client(timeout=30.0, follow_redirects=True, headers=HEADERS) as client:
-        resp = client.get(api_url)
-        resp.raise_for_status()
-    extracted = trafilatura.extract(resp.text, url=url) or ""
-    return url, extracted
+    return f"https://{lang}.wikipedia.org/api/rest_v1/page/html/{title}"
 
 
-def fetch_text(url: str) -> tuple[str, str]:
-    """Fetch and extract main text from a URL."""
-    if _is_wikipedia(url):
-        return fetch_wikipedia(url)
-    with httpx.Client(timeout=30.0, follow_redirects=True, headers=HEADERS) as client:
-        resp = client.get(url)
-        resp.raise_for_status()
-    extracted = trafilatura.extract(resp.text, url=url) or ""
-    return str(resp.url), extracted
+# ── Chunking ─────────────────────────────────────────────────────────
+# Bump when chunk boundaries change so cached chunks are not reused
+CHUNKER_VERSION = 3
+# How far (as a fraction of target_tokens) a window end may move back to land
+# on a paragraph, line / table row or sentence boundary
+SNAP_TOLERANCE = 0.15
 
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_LINE_RE = re.compile(r"\n")
+_SENTENCE_RE = re.compile(r"[.!?…][\"'”’)\]]*(?=\s)")
 
-def chunk_text(text: str, target_tokens: int, overlap: int) -> Iterable[str]:
-    enc = tiktoken.get_encoding("cl100k_base")
+
+@lru_cache(maxsize=1)
+def _encoder():
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def _boundaries(text: str, offsets: list[int]) -> tuple[list[int], dict[int, int]]:
+    """Token indices where a chunk may start, with a priority
+    (3 = paragraph, 2 = line / table row, 1 = sentence).
+
+    Tokens often carry neighbouring whitespace (".\n\n", " The", "\n|"), so a
+    boundary maps to the token starting exactly there, else to a token that
+    has only whitespace before the boundary, else to the first token starting
+    at most two characters after it.
+    """
+    prio: dict[int, int] = {}
+    last = len(offsets) - 1  # offsets ends with a sentinel at len(text)
+    for level, pattern in ((1, _SENTENCE_RE), (2, _LINE_RE), (3, _PARAGRAPH_RE)):
+        for m in pattern.finditer(text):
+            e = m.end()
+            i = bisect_left(offsets, e)
+            if i < last and offsets[i] == e:
+                pass
+            elif i > 1 and text[offsets[i - 1]:e].isspace():
+                i -= 1
+            elif i < last and offsets[i] - e <= 2:
+                pass
+            else:
+                continue
+            if i > 0:
+                prio[i] = max(prio.get(i, 0), level)
+    return sorted(prio), prio
+
+
+def _best_boundary(positions: list[int], prio: dict[int, int], lo: int, hi: int,
+                   prefer_late: bool) -> int | None:
+    a, b = bisect_left(positions, lo), bisect_right(positions, hi)
+    if a == b:
+        return None
+    if prefer_late:
+        return max(positions[a:b], key=lambda i: (prio[i], i))
+    return max(positions[a:b], key=lambda i: (prio[i], -i))
+
+
+def chunk_spans(text: str, target_tokens: int, overlap: int) -> Iterable[tuple[int, int, int]]:
+    """Split text into windows of at most `target_tokens` tokens.
+
+    Yields (start_char, end_char, n_tokens). The text is encoded once and
+    windows are cut at token character offsets and counted by window length,
+    with no decode/re-encode round trip. Window ends snap back to the
+    strongest boundary within SNAP_TOLERANCE, and the next window starts at a
+    boundary inside the overlap region, so overlaps are whole sentences or
+    rows instead of fragments.
+    """
+    enc = _encoder()
     tokens = enc.encode(text)
-    step = max(target_tokens - overlap, 1)
-    for start in range(0, len(tokens), step):
-        end = start + target_tokens
-        chunk_tokens = tokens[start:end]
-        yield enc.decode(chunk_tokens)
+    n = len(tokens)
+    if not n:
+        return
+    decoded, offsets = enc.decode_with_offsets(tokens)
+    offsets.append(len(decoded))
+    positions, prio = _boundaries(decoded, offsets)
+    tol = int(target_tokens * SNAP_TOLERANCE)
+
+    start = 0
+    while start < n:
+        end = min(start + target_tokens, n)
+        if end < n:
+            end = _best_boundary(positions, prio, max(end - tol, start + 1), end, prefer_late=True) or end
+        yield offsets[start], offsets[end], end - start
+        if end >= n:
+            return
+        next_start = max(end - overlap, start + 1)
+        if overlap > 0 and next_start < end:
+            # Below `end`: a boundary at the window end itself would drop the overlap
+            next_start = _best_boundary(positions, prio, next_start, end - 1, prefer_late=False) or next_start
+        start = next_start
+
+
+def chunk_text(text: str, target_tokens: int, overlap: int) -> Iterable[tuple[str, int]]:
+    """Yield (chunk, n_tokens) windows of `text`; see chunk_spans."""
+    for a, b, n_tokens in chunk_spans(text, target_tokens, overlap):
+        yield text[a:b], n_tokens
+
+
+def extract_and_chunk(html: str, url: str, target_tokens: int, overlap: int) -> list[tuple[str, int]]:
+    """Extract main text from HTML and chunk it; returns (chunk, tokens) pairs.
+
+    Module-level so it can run in a ProcessPoolExecutor worker.
+    """
+    text = trafilatura.extract(html, url=url) or ""
+    return list(chunk_text(text, target_tokens, overlap))
+
+
+def make_chunks(src: dict, final_url: str, chunks: Iterable[tuple[str, int]]) -> list[DocumentChunk]:
+    return [
+        DocumentChunk(
+            id=f"{src['url']}#c{idx}",
+            source_url=str(final_url),
+            title=src.get("title"),
+            license=src.get("license"),
+            language=src.get("language"),
+            text=chunk,
+            tokens=tokens,
+        )
+        for idx, (chunk, tokens) in enumerate(chunks)
+    ]
+
+
+def write_chunks(f, src: dict, final_url: str, chunks: Iterable[tuple[str, int]]) -> int:
+    docs = make_chunks(src, final_url, chunks)
+    for doc in docs:
+        f.write(doc.model_dump_json(exclude_defaults=True) + "\n")
+    return len(docs)
+
+
+# ── HTTP cache ───────────────────────────────────────────────────────
+def _atomic_write(path: Path, data: bytes):
+    """Write via a temp file in the same directory + rename, so readers never
+    see a partial file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+class FetchCache:
+    """Content-addressed on-disk cache of raw fetch responses.
+
+    Layout under `root`:
+      objects/ab/<sha256>            raw response bodies, keyed by content hash
+      entries/<sha1(url)>.json       per-URL validators (ETag, Last-Modified) and body hash
+      chunks/<sha256>-<t>-<o>-v<n>.json  chunks extracted from a body at given chunk settings
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def _object_path(self, sha: str) -> Path:
+        return self.root / "objects" / sha[:2] / sha
+
+    def _entry_path(self, url: str) -> Path:
+        return self.root / "entries" / f"{hashlib.sha1(url.encode('utf-8')).hexdigest()}.json"
+
+    def _chunks_path(self, sha: str, target_tokens: int, overlap: int) -> Path:
+        return self.root / "chunks" / f"{sha}-{target_tokens}-{overlap}-v{CHUNKER_VERSION}.json"
+
+    def entry(self, url: str) -> dict | None:
+        path = self._entry_path(url)
+        if not path.exists():
+            return None
+        return json.loads(path.read_text(encoding="utf-8"))
+
+    def conditional_headers(self, url: str) -> dict:
+        """If-None-Match / If-Modified-Since for a URL we hold a body for."""
+        entry = self.entry(url)
+        if not entry or not self._object_path(entry["sha256"]).exists():
+            return {}
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def record(self, url: str, final_url: str, resp: httpx.Response) -> tuple[dict, bool]:
+        """Store a 200 or 304 response. Returns (entry, body_changed)."""
+        old = self.entry(url)
+        if resp.status_code == 304:
+            entry, changed = dict(old), False
+        else:
+            body = resp.content
+            sha = hashlib.sha256(body).hexdigest()
+            obj = self._object_path(sha)
+            if not obj.exists():
+                _atomic_write(obj, body)
+            changed = old is None or old["sha256"] != sha
+            entry = {"url": url, "final_url": final_url, "sha256": sha, "encoding": resp.encoding,
+                     "etag": None, "last_modified": None}
+        # A 304 may carry refreshed validators; a 200 always replaces them
+        if resp.headers.get("ETag") or resp.status_code != 304:
+            entry["etag"] = resp.headers.get("ETag")
+        if resp.headers.get("Last-Modified") or resp.status_code != 304:
+            entry["last_modified"] = resp.headers.get("Last-Modified")
+        entry["fetched_at"] = time.time()
+        _atomic_write(self._entry_path(url), json.dumps(entry).encode("utf-8"))
+        return entry, changed
+
+    def read_body(self, entry: dict) -> str:
+        data = self._object_path(entry["sha256"]).read_bytes()
+        return data.decode(entry.get("encoding") or "utf-8", errors="replace")
+
+    def load_chunks(self, sha: str, target_tokens: int, overlap: int) -> list[tuple[str, int]] | None:
+        path = self._chunks_path(sha, target_tokens, overlap)
+        if not path.exists():
+            return None
+        return [tuple(c) for c in json.loads(path.read_text(encoding="utf-8"))]
+
+    def save_chunks(self, sha: str, target_tokens: int, overlap: int, chunks: list[tuple[str, int]]):
+        path = self._chunks_path(sha, target_tokens, overlap)
+        _atomic_write(path, json.dumps(chunks, ensure_ascii=False).encode("utf-8"))
+
+
+def resolve_cached(cache: FetchCache | None, url: str, final_url: str, resp: httpx.Response,
+                   target_tokens: int, overlap: int):
+    """Record a fetch response and look up chunks extracted earlier.
+
+    Returns (status, final_url, html, chunks, sha). `status` is "not_modified"
+    (304), "unchanged" (same content hash) or "changed". When `chunks` is set
+    they can be reused as is; otherwise `html` must be extracted and chunked.
+    """
+    if cache is None:
+        return "changed", final_url, resp.text, None, None
+    entry, changed = cache.record(url, final_url, resp)
+    status = "not_modified" if resp.status_code == 304 else ("changed" if changed else "unchanged")
+    # Chunks are keyed by body hash, so identical content under another URL is reused too
+    chunks = cache.load_chunks(entry["sha256"], target_tokens, overlap)
+    if chunks is not None:
+        return status, entry["final_url"], None, chunks, entry["sha256"]
+    html = cache.read_body(entry) if resp.status_code == 304 else resp.text
+    return "changed", entry["final_url"], html, None, entry["sha256"]
+
+
+def _emit(f, src: dict, status: str, final_url: str, chunks: list[tuple[str, int]],
+          changed_only: bool, stats: Counter, ckpt: Checkpoint | None = None):
+    stats[status] += 1
+    if not chunks:
+        print(f"Empty extract for {src['url']}")
+    elif not changed_only or status == "changed":
+        stats["chunks"] += write_chunks(f, src, final_url, chunks)
+    if ckpt:
+        # The source is done once its chunks are on disk; record where they end
+        f.flush()
+        os.fsync(f.fileno())
+        ckpt.record(url=src["url"], offset=os.fstat(f.fileno()).st_size)
+
+
+def _print_stats(stats: Counter, out_path: Path):
+    print(f"Sources: {stats['changed']} changed, {stats['unchanged']} unchanged (same hash), "
+          f"{stats['not_modified']} not modified (304), {stats['failed']} failed")
+    print(f"Wrote {stats['chunks']} chunks to {out_path}")
+
+
+# ── Async crawler ────────────────────────────────────────────────────
+class HostThrottle:
+    """Per-host concurrency limit plus a minimum delay between request starts."""
+
+    def __init__(self, per_host: int, delay_s: float):
+        self.delay_s = delay_s
+        self._sems: dict[str, asyncio.Semaphore] = defaultdict(lambda: asyncio.Semaphore(per_host))
+        self._locks: dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self._last: dict[str, float] = {}
+
+    @asynccontextmanager
+    async def slot(self, host: str):
+        async with self._sems[host]:
+            async with self._locks[host]:
+                wait = self._last.get(host, 0.0) + self.delay_s - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                self._last[host] = time.monotonic()
+            yield
+
+
+def _retry_after(resp: httpx.Response) -> float:
+    try:
+        return float(resp.headers.get("Retry-After", 0))
+    except ValueError:  # HTTP-date form; fall back to our own backoff
+        return 0.0
+
+
+def _fetch_target(url: str) -> tuple[str, bool]:
+    wiki = _is_wikipedia(url)
+    return (_wiki_api_url(url) if wiki else url), wiki
+
+
+def fetch_response(client: httpx.Client, url: str, headers: dict | None = None) -> tuple[str, httpx.Response]:
+    """Fetch a source URL (Wikipedia via its REST API). Returns (final_url, response);
+    the response is either 200 or 304 to a conditional request."""
+    target, wiki = _fetch_target(url)
+    resp = client.get(target, headers=headers)
+    if resp.status_code != 304:
+        resp.raise_for_status()
+    return (url if wiki else str(resp.url)), resp
+
+
+async def fetch_response_async(client: httpx.AsyncClient, throttle: HostThrottle, url: str,
+                               retries: int, backoff_s: float,
+                               headers: dict | None = None) -> tuple[str, httpx.Response]:
+    """Async fetch_response with per-host throttling, retrying transient
+    failures with exponential backoff and jitter."""
+    target, wiki = _fetch_target(url)
+    host = urlsplit(target).netloc
+    for attempt in range(retries + 1):
+        wait = 0.0
+        try:
+            async with throttle.slot(host):
+                resp = await client.get(target, headers=headers)
+            if resp.status_code not in RETRY_STATUS:
+                if resp.status_code != 304:
+                    resp.raise_for_status()
+                return (url if wiki else str(resp.url)), resp
+            err: Exception | str = f"HTTP {resp.status_code}"
+            wait = _retry_after(resp)
+        except httpx.TransportError as exc:
+            err = exc
+        if attempt == retries:
+            raise RuntimeError(f"{err} (gave up after {retries + 1} attempts)")
+        await asyncio.sleep(max(wait, backoff_s * 2 ** attempt + random.uniform(0, backoff_s)))
+    raise AssertionError("unreachable")
+
+
+async def crawl(sources: list[dict], f, target_tokens: int, overlap: int, fetch_cfg: dict,
+                cache: FetchCache | None = None, changed_only: bool = False,
+                client: httpx.AsyncClient | None = None, ckpt: Checkpoint | None = None) -> Counter:
+    """Fetch sources concurrently and write their chunks to `f`.
+
+    Network I/O runs on one shared AsyncClient pool; extraction and chunking
+    run in a process pool so parsing overlaps with downloads. Chunks are
+    written in source order, as in the serial path, so the output (and the
+    canonical pick of dedup_chunks.py) does not depend on response timing.
+    Pass `client` to point the crawler at a fixture server in tests.
+    """
+    opts = {**FETCH_DEFAULTS, **(fetch_cfg or {})}
+    throttle = HostThrottle(opts["per_host_concurrency"], opts["delay_s"])
+    queue: asyncio.Queue[tuple[int, dict]] = asyncio.Queue()
+    for item in enumerate(sources):
+        queue.put_nowait(item)
+    loop = asyncio.get_running_loop()
+    stats: Counter = Counter()
+    # Finished sources waiting for every earlier source; None = failed
+    done: dict[int, tuple | None] = {}
+    next_emit = 0
+
+    def emit_ready():
+        nonlocal next_emit
+        while next_emit in done:
+            result = done.pop(next_emit)
+            next_emit += 1
+            if result is not None:
+                _emit(f, *result, changed_only, stats, ckpt)
+
+    own_client = client is None
+    if own_client:
+        client = httpx.AsyncClient(
+            timeout=opts["timeout_s"], follow_redirects=True, headers=HEADERS,
+            limits=httpx.Limits(max_connections=opts["concurrency"],
+                                max_keepalive_connections=opts["concurrency"]),
+        )
+
+    async def worker():
+        while True:
+            try:
+                i, src = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            url = src["url"]
+            try:
+                cond = cache.conditional_headers(url) if cache else None
+                final_url, resp = await fetch_response_async(
+                    client, throttle, url, opts["retries"], opts["backoff_s"], cond)
+                status, final_url, html, chunks, sha = resolve_cached(
+                    cache, url, final_url, resp, target_tokens, overlap)
+                if chunks is None:
+                    chunks = await loop.run_in_executor(
+                        pool, extract_and_chunk, html, url, target_tokens, overlap)
+                    if cache:
+                        cache.save_chunks(sha, target_tokens, overlap, chunks)
+            except Exception as exc:  # log and continue, like the serial path
+                print(f"Failed to fetch {url}: {exc}")
+                stats["failed"] += 1
+                done[i] = None
+            else:
+                done[i] = (src, status, final_url, chunks)
+            emit_ready()
+
+    try:
+        with ProcessPoolExecutor(max_workers=opts["extract_workers"]) as pool:
+            await asyncio.gather(*(worker() for _ in range(opts["concurrency"])))
+    finally:
+        if own_client:
+            await client.aclose()
+    return stats
 
 
 def main():
@@ -86,6 +493,20 @@ def main():
     parser.add_argument("--config", default="config.yaml")
     parser.add_argument("--sources", default="data/sources.jsonl")
     parser.add_argument("--out", default="data/chunks.jsonl")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="Fetch concurrently with per-host rate limits")
+    parser.add_argument("--concurrency", type=int, help="Max concurrent requests overall")
+    parser.add_argument("--per-host", type=int, help="Max concurrent requests per host")
+    parser.add_argument("--delay", type=float, help="Politeness delay between requests to one host (s)")
+    parser.add_argument("--retries", type=int, help="Retries for transient failures")
+    parser.add_argument("--extract-workers", type=int, help="Processes for HTML extraction")
+    parser.add_argument("--cache-dir", default="data/cache/http",
+                        help="On-disk fetch cache for conditional re-crawls")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the fetch cache")
+    parser.add_argument("--changed-only", action="store_true",
+                        help="Only write chunks for sources whose content changed")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted run from its checkpoint manifest")
     args = parser.parse_args()
 
     cfg = load_config(Path(args.config))
@@ -95,32 +516,79 @@ def main():
 
     target_tokens = cfg["chunking"]["target_tokens"]
     overlap = cfg["chunking"]["overlap_tokens"]
+    cache = None if args.no_cache else FetchCache(Path(args.cache_dir))
 
-    enc = tiktoken.get_encoding("cl100k_base")
+    # Chunks go to a .partial file that replaces the output only when the run
+    # completes; the manifest records each finished source and its end offset.
+    partial = out_path.with_name(out_path.name + ".partial")
+    ckpt = Checkpoint(out_path.with_name(out_path.name + ".manifest.jsonl"))
+    meta = {"sources": str(Path(args.sources).resolve()), "target_tokens": target_tokens,
+            "overlap": overlap, "changed_only": args.changed_only}
+    done = ckpt.start(meta, resume=args.resume and partial.exists())
+    if done:
+        os.truncate(partial, done[-1]["offset"])  # drop a source cut off mid-write
+        completed = {r["url"] for r in done}
+        sources = [s for s in sources if s["url"] not in completed]
+        print(f"Resuming: {len(completed)} sources already done, {len(sources)} to go")
+    mode = "a" if done else "w"
 
-    with out_path.open("w", encoding="utf-8") as f:
-        for src in sources:
-            try:
-                final_url, text = fetch_text(src["url"])
-            except Exception as exc:  # rare network errors; log and continue
-                print(f"Failed to fetch {src['url']}: {exc}")
-                continue
-            if not text:
-                print(f"Empty extract for {src['url']}")
-                continue
-            for idx, chunk in enumerate(chunk_text(text, target_tokens, overlap)):
-                tokens = len(enc.encode(chunk))
-                doc = DocumentChunk(
-                    id=f"{src['url']}#c{idx}",
-                    source_url=str(final_url),
-                    title=src.get("title"),
-                    license=src.get("license"),
-                    language=src.get("language"),
-                    text=chunk,
-                    tokens=tokens,
-                )
-                f.write(doc.model_dump_json() + "\n")
-    print(f"Wrote chunks to {out_path}")
+    if args.use_async:
+        fetch_cfg = dict(cfg.get("fetching") or {})
+        for key, val in (("concurrency", args.concurrency), ("per_host_concurrency", args.per_host),
+                         ("delay_s", args.delay), ("retries", args.retries),
+                         ("extract_workers", args.extract_workers)):
+            if val is not None:
+                fetch_cfg[key] = val
+        with partial.open(mode, encoding="utf-8") as f:
+            stats = asyncio.run(crawl(sources, f, target_tokens, overlap, fetch_cfg,
+                                      cache=cache, changed_only=args.changed_only, ckpt=ckpt))
+    else:
+        stats = Counter()
+        workers = args.extract_workers or (cfg.get("fetching") or {}).get("extract_workers") or os.cpu_count() or 1
+        # Fetching stays serial; extraction runs in a process pool while the
+        # next pages download. Results are emitted in source order.
+        pending: deque = deque()
+
+        def emit_next():
+            src, status, final_url, sha, result = pending.popleft()
+            if not isinstance(result, list):
+                try:
+                    result = result.result()
+                except Exception as exc:
+                    print(f"Failed to extract {src['url']}: {exc}")
+                    stats["failed"] += 1
+                    return
+                if cache:
+                    cache.save_chunks(sha, target_tokens, overlap, result)
+            _emit(f, src, status, final_url, result, args.changed_only, stats, ckpt)
+
+        with partial.open(mode, encoding="utf-8") as f, \
+                httpx.Client(timeout=30.0, follow_redirects=True, headers=HEADERS) as client, \
+                ProcessPoolExecutor(max_workers=workers) as pool:
+            for src in sources:
+                url = src["url"]
+                try:
+                    cond = cache.conditional_headers(url) if cache else None
+                    final_url, resp = fetch_response(client, url, cond)
+                    status, final_url, html, chunks, sha = resolve_cached(
+                        cache, url, final_url, resp, target_tokens, overlap)
+                except Exception as exc:  # rare network errors; log and continue
+                    print(f"Failed to fetch {url}: {exc}")
+                    stats["failed"] += 1
+                    continue
+                if chunks is None:
+                    chunks = pool.submit(extract_and_chunk, html, url, target_tokens, overlap)
+                pending.append((src, status, final_url, sha, chunks))
+                # Emit whatever is finished at the head; block only when too far ahead
+                while pending and (len(pending) > 2 * workers or not isinstance(pending[0][4], Future)
+                                   or pending[0][4].done()):
+                    emit_next()
+            while pending:
+                emit_next()
+
+    os.replace(partial, out_path)
+    ckpt.finish()
+    _print_stats(stats, out_path)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,203 @@
+"""
+ingest_documents.py – Chunk local files (PDF, Markdown, plain text) into JSONL.
+
+Internal documents such as plant manuals are read from disk instead of the
+web. PDFs are streamed in small page ranges: each worker process opens the
+file, extracts text and tables for its pages only, releases each page after
+use and chunks the result. Memory therefore depends on `--page-batch` and
+`--workers`, not on the size of the PDF. Page numbers are kept in the chunk
+metadata (`page_start`, `page_end`).
+
+The output has the same format as fetch_and_chunk.py. Index it with
+`embed_and_index.py --chunks data/internal_chunks.jsonl`. Stale deletion
+only covers the sources present in the chunks file, and these sources are
+file:// URIs that never appear in a web run, so neither run prunes the
+other's chunks.
+"""
+
+import argparse
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pdfplumber
+
+from fetch_and_chunk import DocumentChunk, chunk_spans, load_config
+
+
+TEXT_SUFFIXES = {".txt", ".md"}
+SUFFIXES = {".pdf"} | TEXT_SUFFIXES
+
+
+def _table_markdown(rows: list[list[str | None]]) -> str:
+    """Render an extracted table as Markdown rows, one line per table row,
+    so chunk boundaries can snap to row edges."""
+    rows = [[(c or "").replace("\n", " ").strip() for c in row] for row in rows if row]
+    if not rows:
+        return ""
+    lines = ["| " + " | ".join(rows[0]) + " |", "|" + "---|" * len(rows[0])]
+    lines += ["| " + " | ".join(r) + " |" for r in rows[1:]]
+    return "\n".join(lines)
+
+
+def _page_text(page) -> str:
+    """Page text with tables rendered separately as Markdown instead of
+    flattened into the running text."""
+    tables = page.find_tables()
+    body = page
+    for t in tables:
+        body = body.outside_bbox(t.bbox, strict=False)
+    parts = [body.extract_text() or ""]
+    parts += [md for md in (_table_markdown(t.extract()) for t in tables) if md]
+    return "\n\n".join(p for p in parts if p.strip())
+
+
+def _chunk_pages(pages: list[tuple[int, str]], target_tokens: int, overlap: int) -> list[tuple]:
+    """Chunk consecutive pages as one text; returns (chunk, tokens, page_start, page_end)."""
+    text_parts, starts, pos = [], [], 0
+    for page_no, text in pages:
+        starts.append((pos, page_no))
+        text_parts.append(text)
+        pos += len(text) + 2
+    text = "\n\n".join(text_parts)
+
+    def page_at(char: int) -> int:
+        page = starts[0][1]
+        for start, page_no in starts:
+            if start > char:
+                break
+            page = page_no
+        return page
+
+    return [
+        (text[a:b], n_tokens, page_at(a), page_at(max(b - 1, a)))
+        for a, b, n_tokens in chunk_spans(text, target_tokens, overlap)
+    ]
+
+
+def extract_pdf_pages(path: str, first: int, last: int, target_tokens: int, overlap: int) -> list[tuple]:
+    """Extract and chunk pages first..last (1-based, inclusive) of a PDF.
+
+    Module-level so it can run in a ProcessPoolExecutor worker.
+    """
+    pages = []
+    with pdfplumber.open(path, pages=list(range(first, last + 1))) as pdf:
+        for page in pdf.pages:
+            pages.append((page.page_number, _page_text(page)))
+            page.close()  # drop the parsed layout before the next page
+    return _chunk_pages(pages, target_tokens, overlap)
+
+
+def extract_text_file(path: str, target_tokens: int, overlap: int) -> list[tuple]:
+    text = Path(path).read_text(encoding="utf-8", errors="replace")
+    return [(text[a:b], n, None, None) for a, b, n in chunk_spans(text, target_tokens, overlap)]
+
+
+def pdf_page_count(path: Path) -> int:
+    with pdfplumber.open(path) as pdf:
+        return len(pdf.pages)
+
+
+def iter_files(inputs: list[str]):
+    for item in inputs:
+        p = Path(item)
+        if p.is_dir():
+            yield from sorted(f for f in p.rglob("*") if f.suffix.lower() in SUFFIXES)
+        elif p.suffix.lower() in SUFFIXES:
+            yield p
+        else:
+            print(f"Skipping unsupported file {p}")
+
+
+def iter_tasks(files, page_batch: int):
+    """Yield (path, first_page, last_page) tasks; text files are one task."""
+    for path in files:
+        if path.suffix.lower() in TEXT_SUFFIXES:
+            yield path, None, None
+            continue
+        try:
+            n_pages = pdf_page_count(path)
+        except Exception as exc:
+            print(f"Failed to open {path}: {exc}")
+            continue
+        for first in range(1, n_pages + 1, page_batch):
+            yield path, first, min(first + page_batch - 1, n_pages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chunk local PDF / text documents into JSONL")
+    parser.add_argument("inputs", nargs="+", help="Files or directories to ingest")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--out", default="data/internal_chunks.jsonl")
+    parser.add_argument("--license", default="internal", help="License / classification recorded per chunk")
+    parser.add_argument("--language", default=None, help="ISO 639-1 language of the documents")
+    parser.add_argument("--access-level", default="proprietary", choices=["public", "proprietary", "customer"],
+                        help="Classification tier of the documents")
+    parser.add_argument("--customer-id", default=None, help="Customer the documents belong to (--access-level customer)")
+    parser.add_argument("--workers", type=int, default=None, help="Extraction processes (default: all cores)")
+    parser.add_argument("--page-batch", type=int, default=8, help="PDF pages per extraction task")
+    args = parser.parse_args()
+    if (args.access_level == "customer") != bool(args.customer_id):
+        parser.error("--customer-id is required with --access-level customer and only allowed there")
+
+    cfg = load_config(Path(args.config))
+    target_tokens = cfg["chunking"]["target_tokens"]
+    overlap = cfg["chunking"]["overlap_tokens"]
+    workers = args.workers or os.cpu_count() or 1
+
+    out_path = Path(args.out)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    partial = out_path.with_name(out_path.name + ".partial")
+
+    chunk_idx: dict[Path, int] = {}
+    n_chunks = 0
+    # Bounded in-flight window keeps memory flat; results are written in order
+    pending: deque = deque()
+
+    def write_next(f):
+        nonlocal n_chunks
+        path, first, fut = pending.popleft()
+        try:
+            chunks = fut.result()
+        except Exception as exc:
+            where = f" pages {first}+" if first else ""
+            print(f"Failed to extract {path}{where}: {exc}")
+            return
+        url = path.resolve().as_uri()
+        for text, tokens, page_start, page_end in chunks:
+            idx = chunk_idx.get(path, 0)
+            chunk_idx[path] = idx + 1
+            doc = DocumentChunk(
+                id=f"{url}#c{idx}",
+                source_url=url,
+                title=path.stem,
+                license=args.license,
+                language=args.language,
+                access_level=args.access_level,
+                customer_id=args.customer_id,
+                text=text,
+                tokens=tokens,
+                page_start=page_start,
+                page_end=page_end,
+            )
+            f.write(doc.model_dump_json(exclude_defaults=True) + "\n")
+            n_chunks += 1
+
+    with partial.open("w", encoding="utf-8") as f, ProcessPoolExecutor(max_workers=workers) as pool:
+        for path, first, last in iter_tasks(iter_files(args.inputs), args.page_batch):
+            if first is None:
+                fut = pool.submit(extract_text_file, str(path), target_tokens, overlap)
+            else:
+                fut = pool.submit(extract_pdf_pages, str(path), first, last, target_tokens, overlap)
+            pending.append((path, first, fut))
+            while len(pending) > 2 * workers or (pending and pending[0][2].done()):
+                write_next(f)
+        while pending:
+            write_next(f)
+    os.replace(partial, out_path)
+    print(f"Wrote {n_chunks} chunks from {len(chunk_idx)} files to {out_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+"""
+ingest_pipeline.py – Streaming end-to-end ingestion: sources → Postgres.
+
+Runs fetch_and_chunk.py and embed_and_index.py as one staged pipeline so
+that network, chunking, encoding and DB writes overlap:
+
+  reader threads ─▶ chunker procs ─▶ batcher thread ─▶ encoder procs ─▶ writer
+     (fetch)        (extract+chunk)    (hash filter)     (bge-m3)       (COPY)
+
+Every hand-off is a bounded queue, so a slow stage blocks the ones in front
+of it instead of buffering the whole corpus in memory. Encoder processes are
+pinned to disjoint core subsets. Per-stage throughput is printed periodically
+so the bottleneck is visible.
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+import httpx
+import numpy as np
+import psycopg
+from pgvector.psycopg import register_vector
+
+from embed_and_index import (
+    DEFAULT_DIM, DELETE_IDS, SHADOW_COLUMN, _bulk_upsert, build_conn_str, build_sql, check_embedding_model,
+    chunk_source, content_hash, ensure_schema, fetch_existing_hashes, skip_key, stale_ids, tier_error,
+)
+from fetch_and_chunk import (
+    HEADERS, FetchCache, extract_and_chunk, fetch_response, load_config, load_sources,
+    make_chunks, resolve_cached,
+)
+
+
+PIPELINE_DEFAULTS = {
+    "fetch_workers": 8,
+    "chunkers": 2,
+    "encoders": 1,
+    "cores_per_encoder": None,  # None = split all cores evenly between encoders
+    "queue_size": 8,            # batches / documents buffered between stages
+    "report_every_s": 5.0,
+}
+STAGE_COUNTERS = ("fetched", "chunked_docs", "chunked_tokens", "embedded", "embedded_tokens", "written")
+
+
+# ── Stage workers ────────────────────────────────────────────────────
+def _chunker_main(in_q, out_q, target_tokens, overlap, cache_root, counters):
+    cache = FetchCache(Path(cache_root)) if cache_root else None
+    while (item := in_q.get()) is not None:
+        src, final_url, html, chunks, sha = item
+        if chunks is None:
+            chunks = extract_and_chunk(html, src["url"], target_tokens, overlap)
+            if cache and sha:
+                cache.save_chunks(sha, target_tokens, overlap, chunks)
+        rows = [doc.model_dump() for doc in make_chunks(src, final_url, chunks)]
+        out_q.put((src["url"], rows))
+        with counters["chunked_docs"].get_lock():
+            counters["chunked_docs"].value += 1
+        with counters["chunked_tokens"].get_lock():
+            counters["chunked_tokens"].value += sum(r["tokens"] for r in rows)
+    out_q.put(None)
+
+
+def _encoder_main(cores, model_name, device, in_q, out_q, counters):
+    # Pin before importing torch so its thread pool sizes itself to our cores
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    if cores:
+        torch.set_num_threads(len(cores))
+    model = SentenceTransformer(model_name, device=device)
+    while (batch := in_q.get()) is not None:
+        embs = model.encode([r["text"] for r in batch], normalize_embeddings=True)
+        out_q.put((batch, np.asarray(embs, dtype=np.float32)))
+        with counters["embedded"].get_lock():
+            counters["embedded"].value += len(batch)
+        with counters["embedded_tokens"].get_lock():
+            counters["embedded_tokens"].value += sum(r.get("tokens", 0) for r in batch)
+    out_q.put(None)
+
+
+def core_sets(encoders: int, cores_per_encoder: int | None) -> list[list[int]]:
+    """Split the cores this process may run on into disjoint per-encoder sets."""
+    if hasattr(os, "sched_getaffinity"):
+        available = sorted(os.sched_getaffinity(0))
+    else:
+        available = list(range(os.cpu_count() or 1))
+    per = cores_per_encoder or max(len(available) // encoders, 1)
+    # More encoders than cores: the surplus get an empty set and run unpinned
+    return [available[i * per:(i + 1) * per] for i in range(encoders)]
+
+
+# ── Monitoring ───────────────────────────────────────────────────────
+def _qsize(q) -> str:
+    try:
+        return str(q.qsize())
+    except NotImplementedError:  # macOS
+        return "?"
+
+
+def _monitor(counters, queues: dict, every_s: float, stop: threading.Event):
+    last = {k: 0 for k in STAGE_COUNTERS}
+    last_t = time.monotonic()
+    while not stop.wait(every_s):
+        now = time.monotonic()
+        dt = max(now - last_t, 1e-9)
+        cur = {k: counters[k].value for k in STAGE_COUNTERS}
+        rate = {k: (cur[k] - last[k]) / dt for k in STAGE_COUNTERS}
+        depth = " ".join(f"{name}={_qsize(q)}" for name, q in queues.items())
+        print(
+            f"[pipeline] fetch {rate['fetched']:.1f} docs/s | "
+            f"chunk {rate['chunked_docs']:.1f} docs/s {rate['chunked_tokens']:.0f} tok/s | "
+            f"embed {rate['embedded']:.1f} vec/s {rate['embedded_tokens']:.0f} tok/s | "
+            f"write {rate['written']:.1f} rows/s | queues {depth}",
+            flush=True,
+        )
+        last, last_t = cur, now
+
+
+def _check_alive(procs):
+    for p in procs:
+        if p.exitcode not in (None, 0):
+            raise RuntimeError(f"{p.name} exited with code {p.exitcode}")
+
+
+def _get(q, procs):
+    """Blocking get that notices a crashed worker instead of waiting forever."""
+    while True:
+        try:
+            return q.get(timeout=1.0)
+        except queue.Empty:
+            _check_alive(procs)
+
+
+# ── Pipeline ─────────────────────────────────────────────────────────
+def run_pipeline(cfg: dict, sources: list[dict], opts: dict, cache: FetchCache | None,
+                 force: bool = False) -> Counter:
+    db_cfg = cfg["postgres"]
+    emb_cfg = cfg["embedding"]
+    target_tokens = cfg["chunking"]["target_tokens"]
+    overlap = cfg["chunking"]["overlap_tokens"]
+    model_id = emb_cfg["model_name"]
+    encode_batch_size = opts["encode_batch"] or emb_cfg.get("batch_size", 16)
+    write_batch = opts["write_batch"] or db_cfg.get("write_batch_size", 2000)
+    qsize = opts["queue_size"]
+    stats: Counter = Counter()
+    stats_lock = threading.Lock()
+
+    # spawn: the parent may already hold torch/OpenMP state that fork would copy
+    ctx = mp.get_context("spawn")
+    counters = {k: ctx.Value("q", 0) for k in STAGE_COUNTERS}
+    doc_q = ctx.Queue(maxsize=qsize * opts["chunkers"])
+    rows_q = ctx.Queue(maxsize=qsize * opts["chunkers"])
+    embed_q = ctx.Queue(maxsize=qsize)
+    write_q = ctx.Queue(maxsize=qsize)
+
+    chunkers = [
+        ctx.Process(target=_chunker_main, name=f"chunker-{i}", daemon=True,
+                    args=(doc_q, rows_q, target_tokens, overlap,
+                          str(cache.root) if cache else None, counters))
+        for i in range(opts["chunkers"])
+    ]
+    encoders = [
+        ctx.Process(target=_encoder_main, name=f"encoder-{i}", daemon=True,
+                    args=(cores, model_id, emb_cfg.get("device", "cpu"), embed_q, write_q, counters))
+        for i, cores in enumerate(core_sets(opts["encoders"], opts["cores_per_encoder"]))
+    ]
+    procs = chunkers + encoders
+
+    conn = psycopg.connect(build_conn_str(db_cfg))
+    register_vector(conn)
+    sql = build_sql(db_cfg)
+    ensure_schema(conn, db_cfg, sql, emb_cfg.get("dim", DEFAULT_DIM))
+    shadow_model = check_embedding_model(conn, db_cfg, model_id)
+    if shadow_model:
+        # Encoders only load the current model; rows written here are picked
+        # up by the next migrate_embeddings.py backfill pass instead
+        print(f"[pipeline] migration to {shadow_model} in progress: {SHADOW_COLUMN} is left for the backfill")
+    existing = {} if force else fetch_existing_hashes(conn, db_cfg)
+    seen_ids: set[str] = set()
+    failed_urls: set[str] = set()
+
+    # Reader: fetch threads share one connection pool and the fetch cache
+    src_q: queue.Queue[dict] = queue.Queue()
+    for src in sources:
+        src_q.put(src)
+
+    def reader(client):
+        while True:
+            try:
+                src = src_q.get_nowait()
+            except queue.Empty:
+                return
+            url = src["url"]
+            try:
+                cond = cache.conditional_headers(url) if cache else None
+                final_url, resp = fetch_response(client, url, cond)
+                status, final_url, html, chunks, sha = resolve_cached(
+                    cache, url, final_url, resp, target_tokens, overlap)
+            except Exception as exc:  # log and continue, like fetch_and_chunk.py
+                print(f"Failed to fetch {url}: {exc}")
+                with stats_lock:
+                    failed_urls.add(url)
+                    stats["failed"] += 1
+                continue
+            with stats_lock:
+                stats[status] += 1
+            doc_q.put((src, final_url, html, chunks, sha))
+            with counters["fetched"].get_lock():
+                counters["fetched"].value += 1
+
+    def run_readers():
+        with httpx.Client(timeout=30.0, follow_redirects=True, headers=HEADERS,
+                          limits=httpx.Limits(max_connections=opts["fetch_workers"])) as client:
+            threads = [threading.Thread(target=reader, args=(client,), daemon=True)
+                       for _ in range(opts["fetch_workers"])]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        for _ in chunkers:
+            doc_q.put(None)
+
+    # Batcher: drop unchanged chunks before they reach an encoder
+    def batcher():
+        batch: list[dict] = []
+        done = 0
+        while done < len(chunkers):
+            item = _get(rows_q, procs)
+            if item is None:
+                done += 1
+                continue
+            _, rows = item
+            for row in rows:
+                seen_ids.add(row["id"])
+                if error := tier_error(row):
+                    # Raising here would leave the writer waiting; the old row is kept
+                    print(f"[pipeline] skipped {error}")
+                    with stats_lock:
+                        stats["invalid"] += 1
+                    continue
+                row["content_hash"] = content_hash(row["text"])
+                if existing.get(row["id"]) == skip_key(row, model_id):
+                    with stats_lock:
+                        stats["skipped"] += 1
+                    continue
+                batch.append(row)
+                if len(batch) >= encode_batch_size:
+                    embed_q.put(batch)
+                    batch = []
+        if batch:
+            embed_q.put(batch)
+        for _ in encoders:
+            embed_q.put(None)
+
+    stop = threading.Event()
+    monitor = threading.Thread(
+        target=_monitor, daemon=True,
+        args=(counters, {"docs": doc_q, "rows": rows_q, "embed": embed_q, "write": write_q},
+              opts["report_every_s"], stop))
+
+    for p in procs:
+        p.start()
+    threads = [threading.Thread(target=run_readers, daemon=True),
+               threading.Thread(target=batcher, daemon=True)]
+    for t in threads:
+        t.start()
+    monitor.start()
+
+    # Writer runs on the main thread
+    try:
+        write_rows: list[dict] = []
+        write_embs: list[np.ndarray] = []
+        done = 0
+        while done < len(encoders):
+            item = _get(write_q, procs)
+            if item is None:
+                done += 1
+            else:
+                write_rows.extend(item[0])
+                write_embs.extend(item[1])
+            if write_rows and (len(write_rows) >= write_batch or done == len(encoders)):
+                _bulk_upsert(conn, sql, write_rows, write_embs, model_id)
+                stats["embedded"] += len(write_rows)
+                with counters["written"].get_lock():
+                    counters["written"].value += len(write_rows)
+                write_rows, write_embs = [], []
+        for t in threads:
+            t.join()
+
+        # Rows of sources that failed this run are kept, not treated as removed
+        if force:
+            existing = fetch_existing_hashes(conn, db_cfg)
+        stale = [doc_id for doc_id in stale_ids(existing, seen_ids) if chunk_source(doc_id) not in failed_urls]
+        if stale:
+            with conn.cursor() as cur:
+                cur.execute(DELETE_IDS.format(schema=db_cfg["schema"], table=db_cfg["table"]), (stale,))
+            conn.commit()
+        stats["deleted"] = len(stale)
+    finally:
+        stop.set()
+        for p in procs:
+            if p.is_alive():
+                p.terminate()
+        conn.close()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch, chunk, embed and index sources as one streaming pipeline")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--sources", default="data/sources.jsonl")
+    parser.add_argument("--fetch-workers", type=int, help="Concurrent fetch threads")
+    parser.add_argument("--chunkers", type=int, help="Extraction/chunking processes")
+    parser.add_argument("--encoders", type=int, help="Embedding processes (each loads its own model)")
+    parser.add_argument("--cores-per-encoder", type=int, help="CPU cores pinned to each encoder")
+    parser.add_argument("--queue-size", type=int, help="Bounded queue depth between stages")
+    parser.add_argument("--encode-batch", type=int, help="Texts per model.encode call (embedding.batch_size)")
+    parser.add_argument("--write-batch", type=int, help="Rows per COPY + merge (postgres.write_batch_size)")
+    parser.add_argument("--report-every", type=float, help="Seconds between throughput reports")
+    parser.add_argument("--cache-dir", default="data/cache/http")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--force", action="store_true",
+                        help="Re-embed every chunk even if its content hash is unchanged")
+    args = parser.parse_args()
+
+    cfg = load_config(Path(args.config))
+    opts = {**PIPELINE_DEFAULTS, **(cfg.get("pipeline") or {})}
+    for key, val in (("fetch_workers", args.fetch_workers), ("chunkers", args.chunkers),
+                     ("encoders", args.encoders), ("cores_per_encoder", args.cores_per_encoder),
+                     ("queue_size", args.queue_size), ("report_every_s", args.report_every)):
+        if val is not None:
+            opts[key] = val
+    opts["encode_batch"] = args.encode_batch
+    opts["write_batch"] = args.write_batch
+
+    cache = None if args.no_cache else FetchCache(Path(args.cache_dir))
+    started = time.monotonic()
+    stats = run_pipeline(cfg, load_sources(Path(args.sources)), opts, cache, force=args.force)
+    print(f"Pipeline complete in {time.monotonic() - started:.1f}s: "
+          f"{stats['changed']} changed, {stats['unchanged'] + stats['not_modified']} unchanged, "
+          f"{stats['failed']} failed sources; {stats['embedded']} embedded, "
+          f"{stats['skipped']} skipped, {stats['invalid']} invalid, {stats['deleted']} deleted chunks")
+
+
+if __name__ == "__main__":
+    main()
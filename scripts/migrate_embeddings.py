@@ -0,0 +1,378 @@
+"""
+migrate_embeddings.py – Switch the documents table to another embedding model
+without taking search down.
+
+The new model's vectors are built next to the live ones and swapped in at the
+end:
+
+    start      add embedding_next vector(<dim>) + embed_model_next and record
+               the migration in public.embedding_state
+    backfill   embed rows whose embedding_next is empty in throttled batches,
+               then build its HNSW index; safe to stop and run again
+    cutover    in one short transaction: embed the rows written since the
+               last pass, rename embedding -> embedding_prev and
+               embedding_next -> embedding, bump the generation
+    finish     drop embedding_prev once the new model has proven itself
+    abort      drop embedding_next and forget the migration
+    status     progress of the current migration
+
+While a migration runs, embed_and_index.py writes both embeddings for every
+new or changed row; ingest_pipeline.py leaves embedding_next empty and the
+next backfill pass fills it. rag_api.py reads the model from embedding_state,
+so queries switch to the new model in the same moment the columns are renamed.
+
+    python scripts/migrate_embeddings.py start --model intfloat/multilingual-e5-small
+    python scripts/migrate_embeddings.py backfill --batch 256 --pause 0.5
+    python scripts/migrate_embeddings.py cutover
+    python scripts/migrate_embeddings.py finish
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import psycopg
+from pgvector.psycopg import register_vector
+
+from embed_and_index import (
+    CREATE_EMBEDDING_STATE, SHADOW_COLUMN, SHADOW_MODEL_COLUMN, build_conn_str,
+    column_dim, load_config, load_embedding_state, partitioning, table_name, write_shadow,
+)
+
+
+# Clears a shadow vector whose row content changed after it was computed, so
+# the next backfill pass (or the cutover catch-up) embeds the new content.
+CREATE_RESET_TRIGGER = """
+CREATE OR REPLACE FUNCTION {schema}.{table}_reset_embedding_next() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF NEW.content_hash IS DISTINCT FROM OLD.content_hash THEN
+        NEW.embedding_next := NULL;
+        NEW.embed_model_next := NULL;
+    END IF;
+    RETURN NEW;
+END
+$$;
+DROP TRIGGER IF EXISTS {table}_reset_embedding_next ON {schema}.{table};
+CREATE TRIGGER {table}_reset_embedding_next BEFORE UPDATE OF content_hash ON {schema}.{table}
+    FOR EACH ROW EXECUTE FUNCTION {schema}.{table}_reset_embedding_next()
+"""
+DROP_RESET_TRIGGER = """
+DROP TRIGGER IF EXISTS {table}_reset_embedding_next ON {schema}.{table};
+DROP FUNCTION IF EXISTS {schema}.{table}_reset_embedding_next()
+"""
+SELECT_PENDING = """
+SELECT id, content_hash, content FROM {schema}.{table}
+WHERE embedding_next IS NULL AND id > %s ORDER BY id LIMIT %s
+"""
+COUNT_PENDING = "SELECT count(*) FROM {schema}.{table} WHERE embedding_next IS NULL"
+SELECT_COLUMN_INDEX = """
+SELECT i.relname FROM pg_index x
+JOIN pg_class i ON i.oid = x.indexrelid
+JOIN pg_attribute a ON a.attrelid = x.indrelid AND a.attnum = ANY(x.indkey)
+WHERE x.indrelid = %s::regclass AND a.attname = %s
+"""
+CREATE_SHADOW_INDEX = """
+CREATE INDEX {concurrently} IF NOT EXISTS {table}_embedding_next_idx ON {schema}.{table}
+    USING hnsw (embedding_next vector_cosine_ops)
+"""
+UPDATE_PROGRESS = """
+UPDATE public.embedding_state SET backfilled = backfilled + %s, status = %s, updated_at = NOW()
+WHERE table_name = %s
+"""
+QUANTIZED_NAMES = {"halfvec": "embedding_half", "binary": "embedding_bin"}
+
+
+def _names(db_cfg) -> dict[str, str]:
+    return {"schema": db_cfg["schema"], "table": db_cfg["table"]}
+
+
+def _require_migration(cur, db_cfg) -> dict:
+    state = load_embedding_state(cur, db_cfg)
+    if not state or not state["shadow_model"]:
+        raise SystemExit(f"No model migration in progress for {table_name(db_cfg)}")
+    return state
+
+
+def _column_index(cur, db_cfg, column: str) -> str | None:
+    cur.execute(SELECT_COLUMN_INDEX, (table_name(db_cfg), column))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def start(conn, db_cfg, current_model: str, model: str, dim: int) -> int:
+    """Add the shadow columns and record the migration. Returns the row count."""
+    names = _names(db_cfg)
+    with conn.transaction(), conn.cursor() as cur:
+        cur.execute(CREATE_EMBEDDING_STATE)
+        state = load_embedding_state(cur, db_cfg)
+        if state and state["shadow_model"]:
+            raise SystemExit(f"Already migrating to {state['shadow_model']}; run abort first to change it")
+        current_dim = column_dim(cur, db_cfg)
+        if current_dim is None:
+            raise SystemExit(f"{table_name(db_cfg)} has no embedding column; index it with embed_and_index.py")
+        if (state and state["model"] or current_model) == model:
+            raise SystemExit(f"{table_name(db_cfg)} already uses {model}")
+        cur.execute(f"ALTER TABLE {names['schema']}.{names['table']} "
+                    f"ADD COLUMN IF NOT EXISTS {SHADOW_COLUMN} vector({dim}), "
+                    f"ADD COLUMN IF NOT EXISTS {SHADOW_MODEL_COLUMN} TEXT")
+        cur.execute(CREATE_RESET_TRIGGER.format(**names))
+        cur.execute(f"SELECT count(*) FROM {names['schema']}.{names['table']}")
+        total = cur.fetchone()[0]
+        cur.execute(
+            """
+            INSERT INTO public.embedding_state (table_name, model, dim, shadow_model, shadow_dim, status, total)
+            VALUES (%s, %s, %s, %s, %s, 'backfilling', %s)
+            ON CONFLICT (table_name) DO UPDATE SET
+                model = COALESCE(embedding_state.model, EXCLUDED.model),
+                dim = COALESCE(embedding_state.dim, EXCLUDED.dim),
+                shadow_model = EXCLUDED.shadow_model, shadow_dim = EXCLUDED.shadow_dim,
+                status = 'backfilling', backfilled = 0, total = EXCLUDED.total, updated_at = NOW()
+            """,
+            (table_name(db_cfg), current_model, current_dim, model, dim, total),
+        )
+    return total
+
+
+def _embed_pending(conn, db_cfg, encode, model: str, batch: int, pause: float) -> int:
+    """One keyset pass over rows without a shadow vector, committing per batch."""
+    names = _names(db_cfg)
+    last_id, written, started = "", 0, time.monotonic()
+    with conn.cursor() as cur:
+        cur.execute("SELECT total FROM public.embedding_state WHERE table_name = %s", (table_name(db_cfg),))
+        total = cur.fetchone()[0]
+        cur.execute(COUNT_PENDING.format(**names))
+        pending = cur.fetchone()[0]
+    conn.commit()
+    done_before = max(total - pending, 0)
+    while True:
+        with conn.cursor() as cur:
+            cur.execute(SELECT_PENDING.format(**names), (last_id, batch))
+            rows = cur.fetchall()
+        # Do not hold a transaction open while the model runs
+        conn.commit()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        embeddings = encode([r[2] or "" for r in rows])
+        with conn.cursor() as cur:
+            n = write_shadow(cur, db_cfg, [(r[0], r[1]) for r in rows], embeddings, model)
+            cur.execute(UPDATE_PROGRESS, (n, "backfilling", table_name(db_cfg)))
+        conn.commit()
+        written += n
+        rate = written / max(time.monotonic() - started, 1e-9)
+        print(f"\r[backfill] {done_before + written}/{total} rows ({rate:.0f} rows/s)", end="", flush=True)
+        if pause:
+            time.sleep(pause)
+    if written:
+        print()
+    return written
+
+
+def backfill(conn, db_cfg, encode, batch: int, pause: float) -> int:
+    """Embed every row still missing its shadow vector, then index the column."""
+    names = _names(db_cfg)
+    with conn.cursor() as cur:
+        state = _require_migration(cur, db_cfg)
+        cur.execute(f"SELECT count(*) FROM {names['schema']}.{names['table']}")
+        cur.execute("UPDATE public.embedding_state SET total = %s, status = 'backfilling', updated_at = NOW() "
+                    "WHERE table_name = %s", (cur.fetchone()[0], table_name(db_cfg)))
+    conn.commit()
+
+    written = 0
+    # Rows inserted or changed behind the keyset cursor are caught by another
+    # pass; stop when a pass finds nothing to do.
+    while n := _embed_pending(conn, db_cfg, encode, state["shadow_model"], batch, pause):
+        written += n
+
+    with conn.cursor() as cur:
+        live_index = _column_index(cur, db_cfg, "embedding")
+    conn.commit()
+    if live_index:
+        # Partitioned parents cannot be indexed concurrently; their leaf
+        # indexes are built under a lock that blocks writes, not reads
+        concurrently = "CONCURRENTLY" if partitioning(db_cfg) == "none" else ""
+        print(f"[backfill] building {names['table']}_embedding_next_idx")
+        conn.autocommit = True
+        try:
+            conn.execute(CREATE_SHADOW_INDEX.format(concurrently=concurrently, **names))
+        finally:
+            conn.autocommit = False
+    with conn.cursor() as cur:
+        cur.execute(UPDATE_PROGRESS, (0, "ready", table_name(db_cfg)))
+    conn.commit()
+    return written
+
+
+def cutover(conn, db_cfg, encode, max_catchup: int, lock_timeout_ms: int, drop_quantized: bool) -> dict:
+    """Swap the shadow column in. Readers only wait for the renames, writers
+    for the whole transaction, which embeds at most `max_catchup` rows."""
+    names = _names(db_cfg)
+    table = f"{names['schema']}.{names['table']}"
+    with conn.transaction(), conn.cursor() as cur:
+        state = _require_migration(cur, db_cfg)
+        quantized = [col for col in QUANTIZED_NAMES.values() if column_dim(cur, db_cfg, col) is not None]
+        if quantized and not drop_quantized:
+            raise SystemExit(f"{', '.join(quantized)} are generated from the old embedding column. Set "
+                             "VECTOR_SEARCH_MODE=full and rerun with --drop-quantized, then rebuild them "
+                             "with embed_and_index.py --quantize after the cutover")
+        # Fail fast instead of queueing every reader behind a lock we cannot get
+        cur.execute(f"SET LOCAL lock_timeout = {int(lock_timeout_ms)}")
+        cur.execute(f"LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE")
+        cur.execute(COUNT_PENDING.format(**names))
+        pending = cur.fetchone()[0]
+        if pending > max_catchup:
+            raise SystemExit(f"{pending} rows still lack {SHADOW_COLUMN}; run backfill first")
+        if pending:
+            cur.execute(SELECT_PENDING.format(**names), ("", pending))
+            rows = cur.fetchall()
+            write_shadow(cur, db_cfg, [(r[0], r[1]) for r in rows], encode([r[2] or "" for r in rows]),
+                         state["shadow_model"])
+            cur.execute(COUNT_PENDING.format(**names))
+            if cur.fetchone()[0]:
+                raise SystemExit(f"Rows without {SHADOW_COLUMN} remain after the catch-up; run backfill again")
+
+        cur.execute(DROP_RESET_TRIGGER.format(**names))
+        for col in quantized:
+            cur.execute(f"ALTER TABLE {table} DROP COLUMN {col}")
+        cur.execute(f"ALTER TABLE {table} DROP COLUMN IF EXISTS embedding_prev, "
+                    f"DROP COLUMN IF EXISTS embed_model_prev")
+        cur.execute(f"ALTER TABLE {table} RENAME COLUMN embedding TO embedding_prev")
+        cur.execute(f"ALTER TABLE {table} RENAME COLUMN embed_model TO embed_model_prev")
+        cur.execute(f"ALTER TABLE {table} RENAME COLUMN {SHADOW_COLUMN} TO embedding")
+        cur.execute(f"ALTER TABLE {table} RENAME COLUMN {SHADOW_MODEL_COLUMN} TO embed_model")
+        cur.execute(f"ALTER INDEX IF EXISTS {names['schema']}.{names['table']}_embedding_idx "
+                    f"RENAME TO {names['table']}_embedding_prev_idx")
+        cur.execute(f"ALTER INDEX IF EXISTS {names['schema']}.{names['table']}_embedding_next_idx "
+                    f"RENAME TO {names['table']}_embedding_idx")
+        cur.execute(
+            """
+            UPDATE public.embedding_state SET
+                generation = generation + 1, prev_model = model, prev_dim = dim,
+                model = shadow_model, dim = shadow_dim, shadow_model = NULL, shadow_dim = NULL,
+                status = 'idle', updated_at = NOW()
+            WHERE table_name = %s
+            RETURNING generation, model, dim
+            """,
+            (table_name(db_cfg),),
+        )
+        generation, model, dim = cur.fetchone()
+        # Session summaries were embedded with the old model
+        cur.execute("SELECT to_regclass('public.sessions') IS NOT NULL")
+        if cur.fetchone()[0]:
+            cur.execute("UPDATE public.sessions SET summary_embedding = NULL WHERE summary_embedding IS NOT NULL")
+    return {"generation": generation, "model": model, "dim": dim, "caught_up": pending,
+            "dropped": quantized}
+
+
+def finish(conn, db_cfg):
+    """Drop the previous model's column (and its index with it)."""
+    names = _names(db_cfg)
+    with conn.transaction(), conn.cursor() as cur:
+        cur.execute(f"ALTER TABLE {names['schema']}.{names['table']} "
+                    f"DROP COLUMN IF EXISTS embedding_prev, DROP COLUMN IF EXISTS embed_model_prev")
+        cur.execute("UPDATE public.embedding_state SET prev_model = NULL, prev_dim = NULL, updated_at = NOW() "
+                    "WHERE table_name = %s", (table_name(db_cfg),))
+
+
+def abort(conn, db_cfg):
+    names = _names(db_cfg)
+    with conn.transaction(), conn.cursor() as cur:
+        state = _require_migration(cur, db_cfg)
+        cur.execute(DROP_RESET_TRIGGER.format(**names))
+        cur.execute(f"ALTER TABLE {names['schema']}.{names['table']} "
+                    f"DROP COLUMN IF EXISTS {SHADOW_COLUMN}, DROP COLUMN IF EXISTS {SHADOW_MODEL_COLUMN}")
+        cur.execute("UPDATE public.embedding_state SET shadow_model = NULL, shadow_dim = NULL, status = 'idle', "
+                    "backfilled = 0, updated_at = NOW() WHERE table_name = %s", (table_name(db_cfg),))
+    return state["shadow_model"]
+
+
+def print_status(conn, db_cfg):
+    with conn.cursor() as cur:
+        cur.execute(CREATE_EMBEDDING_STATE)
+        state = load_embedding_state(cur, db_cfg)
+        pending = None
+        if state and state["shadow_model"]:
+            cur.execute(COUNT_PENDING.format(**_names(db_cfg)))
+            pending = cur.fetchone()[0]
+    conn.commit()
+    if state is None:
+        print(f"{table_name(db_cfg)}: no migrations recorded")
+        return
+    print(f"{table_name(db_cfg)}: generation {state['generation']}, {state['model']} (dim {state['dim']})")
+    if state["shadow_model"]:
+        print(f"  migrating to {state['shadow_model']} (dim {state['shadow_dim']}): {state['status']}, "
+              f"{pending} of {state['total']} rows pending, updated {state['updated_at']:%Y-%m-%d %H:%M:%S}")
+    if state["prev_model"]:
+        print(f"  embedding_prev still holds {state['prev_model']} (dim {state['prev_dim']}); run finish to drop it")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate documents to another embedding model without downtime")
+    parser.add_argument("command", choices=["start", "backfill", "cutover", "finish", "abort", "status"])
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--model", help="start: the new embedding model")
+    parser.add_argument("--dim", type=int, help="start: its dimension (default: read from the model)")
+    parser.add_argument("--batch", type=int, default=256, help="backfill: rows per batch")
+    parser.add_argument("--pause", type=float, default=0.5,
+                        help="backfill: seconds to sleep between batches, to leave the database some headroom")
+    parser.add_argument("--cutover", action="store_true", help="backfill: cut over as soon as it completes")
+    parser.add_argument("--max-catchup", type=int, default=2000,
+                        help="cutover: most rows to embed inside the cutover transaction")
+    parser.add_argument("--lock-timeout-ms", type=int, default=2000,
+                        help="cutover: give up if the table lock is not granted within this time")
+    parser.add_argument("--drop-quantized", action="store_true",
+                        help="cutover: drop the halfvec/binary columns built from the old embeddings")
+    args = parser.parse_args()
+
+    cfg = load_config(Path(args.config))
+    db_cfg = cfg["postgres"]
+    emb_cfg = cfg["embedding"]
+    models = {}
+
+    def load_model(name):
+        if name not in models:
+            from sentence_transformers import SentenceTransformer
+            models[name] = SentenceTransformer(name, device=emb_cfg.get("device", "cpu"))
+        return models[name]
+
+    with psycopg.connect(build_conn_str(db_cfg)) as conn:
+        register_vector(conn)
+        with conn.cursor() as cur:
+            cur.execute(CREATE_EMBEDDING_STATE)
+            state = load_embedding_state(cur, db_cfg)
+        conn.commit()
+        shadow_model = state and state["shadow_model"]
+
+        def encode(texts):
+            return load_model(shadow_model).encode(texts, batch_size=emb_cfg.get("batch_size", 16),
+                                                   normalize_embeddings=True)
+
+        if args.command == "start":
+            if not args.model:
+                parser.error("start needs --model")
+            dim = args.dim or load_model(args.model).get_sentence_embedding_dimension()
+            total = start(conn, db_cfg, emb_cfg["model_name"], args.model, dim)
+            print(f"Migration to {args.model} (dim {dim}) started: {total} rows to backfill")
+        elif args.command == "backfill":
+            written = backfill(conn, db_cfg, encode, args.batch, args.pause)
+            print(f"Backfill complete: {written} rows embedded with {shadow_model}")
+        if args.command == "cutover" or (args.command == "backfill" and args.cutover):
+            res = cutover(conn, db_cfg, encode, args.max_catchup, args.lock_timeout_ms, args.drop_quantized)
+            print(f"Cut over to {res['model']} (dim {res['dim']}, generation {res['generation']}), "
+                  f"{res['caught_up']} rows embedded during the cutover")
+            if res["dropped"]:
+                print(f"Dropped {', '.join(res['dropped'])}; rebuild with embed_and_index.py --quantize")
+            print(f"Set embedding.model_name: {res['model']} and embedding.dim: {res['dim']} in {args.config}; "
+                  "the API switches by itself")
+        elif args.command == "finish":
+            finish(conn, db_cfg)
+            print("Dropped embedding_prev")
+        elif args.command == "abort":
+            print(f"Aborted the migration to {abort(conn, db_cfg)}")
+        elif args.command == "status":
+            print_status(conn, db_cfg)
+
+
+if __name__ == "__main__":
+    main()
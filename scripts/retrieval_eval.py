@@ -0,0 +1,288 @@
+"""
+retrieval_eval.py – Recall, MRR and latency of retrieval configurations.
+
+1. Golden set: synthetic questions per chunk of data/chunks.jsonl, stored in
+   data/eval/golden.jsonl and reused on later runs (--rebuild-golden to redo).
+   "extract" turns a sentence of the chunk into a keyword query (no API
+   calls); "vertex" asks Gemini for questions the chunk answers (cached in
+   data/cache/llm like suggest_sources.py).
+2. Ground truth: the queries are embedded with the API's model and ranked
+   against every document embedding by exact dot product in NumPy. Embeddings
+   come from the database or from a snapshot directory (scripts/snapshot.py).
+3. Every configuration runs through rag_api.fetch_matches (and rerank):
+
+       full               fp32 column (HNSW if the index exists)
+       halfvec:4          halfvec first pass, 4x oversample, fp32 rescore
+       binary:8           bit first pass, 8x oversample, fp32 rescore
+       full+rerank        widened candidate set + cross-encoder
+
+Reported per configuration: recall@k against the exact top k, MRR@k and
+hit@k of the chunk the question was generated from, and p50/p99 latency.
+
+Run from the repository root so `api` is importable:
+
+    DATABASE_URL=postgresql://... python -m scripts.retrieval_eval --queries 200 \\
+        --configs full,halfvec:4,binary:8,full+rerank
+"""
+
+import argparse
+import json
+import random
+import re
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+from api.rag_api import RERANK_CANDIDATES, _get_model, fetch_matches, get_conn, rerank
+
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+WORD_RE = re.compile(r"[^\W\d_][\w\-]*")
+STOPWORDS = {
+    # en
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "for", "from", "has", "have", "in", "is", "it",
+    "its", "of", "on", "or", "that", "the", "their", "this", "to", "was", "which", "with", "were", "will",
+    # fi
+    "ja", "on", "ovat", "oli", "ei", "se", "ne", "joka", "jotka", "kuin", "tai", "sekä", "myös", "kun",
+    "että", "jos", "voi", "sen", "niiden", "tämä", "nämä", "siitä", "mukaan",
+}
+QUESTION_PROMPT = """\
+Write {n} short search questions that the passage below answers.
+Use the language of the passage. One question per line, no numbering.
+
+{text}
+"""
+FETCH_SIZE = 5000
+QUERY_BATCH = 64
+
+
+# ── Golden set ───────────────────────────────────────────────────────
+def extract_queries(text: str, n: int, rng: random.Random) -> list[str]:
+    """Keyword queries from n random sentences of a chunk (tables, headings,
+    LaTeX and very short or long lines skipped)."""
+    sentences = sorted({
+        s.strip() for s in SENTENCE_RE.split(text)
+        if not s.lstrip().startswith(("|", "#")) and "\\" not in s and 6 <= len(s.split()) <= 40
+    })
+    queries = []
+    for sentence in rng.sample(sentences, min(n, len(sentences))):
+        words = [w for w in WORD_RE.findall(sentence) if w.lower() not in STOPWORDS]
+        if len(words) >= 3:
+            queries.append(" ".join(words[:12]))
+    return queries
+
+
+def vertex_queries(cfg: dict, cache, text: str, n: int) -> list[str]:
+    from scripts.suggest_sources import _init_vertex
+
+    model_name = cfg["vertex"]["model"]
+    prompt = QUESTION_PROMPT.format(n=n, text=text[:3000])
+    answer = cache.get(model_name, prompt)
+    if answer is None:
+        from vertexai.generative_models import GenerativeModel
+
+        _init_vertex(cfg)
+        answer = GenerativeModel(model_name).generate_content(prompt).text
+        cache.put(model_name, prompt, answer)
+    lines = [re.sub(r"^\s*(?:[-*•]|\d+[.)])\s*", "", line).strip() for line in answer.splitlines()]
+    return [line for line in lines if len(line) > 8][:n]
+
+
+def build_golden(chunks_path: Path, out: Path, n_chunks: int, per_chunk: int, generator: str,
+                 seed: int, config_path: Path | None) -> list[dict]:
+    rng = random.Random(seed)
+    with chunks_path.open(encoding="utf-8") as f:
+        chunks = [json.loads(line) for line in f if line.strip()]
+    chunks = rng.sample(chunks, min(n_chunks, len(chunks)))
+
+    cfg = cache = None
+    if generator == "vertex":
+        from scripts.suggest_sources import ResponseCache, load_config
+
+        cfg = load_config(config_path)
+        cache = ResponseCache(Path("data/cache/llm"))
+
+    golden = []
+    for chunk in chunks:
+        text = chunk.get("text") or chunk.get("content") or ""
+        queries = []
+        if generator == "vertex":
+            try:
+                queries = vertex_queries(cfg, cache, text, per_chunk)
+            except Exception as e:
+                print(f"[golden] Vertex failed for {chunk['id']} ({e}), extracting instead")
+        if not queries:
+            queries = extract_queries(text, per_chunk, rng)
+        for query in queries:
+            golden.append({"qid": len(golden), "query": query, "chunk_id": chunk["id"], "generator": generator})
+
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with out.open("w", encoding="utf-8") as f:
+        for row in golden:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    print(f"[golden] {len(golden)} questions from {len(chunks)} chunks → {out}")
+    return golden
+
+
+def load_golden(path: Path) -> list[dict]:
+    with path.open(encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# ── Ground truth ─────────────────────────────────────────────────────
+def load_embeddings(snapshot: Path | None) -> tuple[list[str], np.ndarray]:
+    """All document ids and embeddings, row-aligned."""
+    if snapshot is not None:
+        import pyarrow.parquet as pq
+
+        ids = pq.read_table(snapshot / "documents.parquet", columns=["id"]).column("id").to_pylist()
+        return ids, np.load(snapshot / "embeddings.npy", mmap_mode="r")
+
+    conn = get_conn()
+    with conn.cursor() as cur:
+        cur.execute("SELECT count(*), max(vector_dims(embedding)) FROM public.documents")
+        n, dim = cur.fetchone()
+    if not n:
+        raise SystemExit("No documents indexed")
+    ids: list[str] = []
+    matrix = np.empty((n, dim), dtype=np.float32)
+    with conn.transaction(), conn.cursor(name="eval_embeddings") as cur:
+        cur.execute("SELECT id, embedding FROM public.documents ORDER BY id")
+        while batch := cur.fetchmany(FETCH_SIZE):
+            start = len(ids)
+            ids.extend(r[0] for r in batch)
+            matrix[start:len(ids)] = np.stack([np.asarray(r[1], dtype=np.float32) for r in batch])
+    return ids, matrix[:len(ids)]
+
+
+def exact_top_k(doc_vectors: np.ndarray, query_vectors: np.ndarray, k: int) -> tuple[np.ndarray, float]:
+    """Exact top-k row indices per query (embeddings are normalised, so dot
+    product = cosine similarity) and the mean brute-force time per query."""
+    top = np.empty((len(query_vectors), k), dtype=np.int64)
+    t0 = time.perf_counter()
+    for start in range(0, len(query_vectors), QUERY_BATCH):
+        sims = query_vectors[start:start + QUERY_BATCH] @ doc_vectors.T
+        part = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        order = np.take_along_axis(sims, part, axis=1).argsort(axis=1)[:, ::-1]
+        top[start:start + QUERY_BATCH] = np.take_along_axis(part, order, axis=1)
+    return top, (time.perf_counter() - t0) * 1000 / max(len(query_vectors), 1)
+
+
+# ── Configurations ───────────────────────────────────────────────────
+def parse_config(spec: str) -> dict:
+    """'halfvec:4+rerank' -> {"mode": "halfvec", "oversample": 4, "rerank": True}"""
+    base, _, extra = spec.partition("+")
+    mode, _, oversample = base.partition(":")
+    if extra not in ("", "rerank"):
+        raise SystemExit(f"Unknown configuration option '+{extra}' in {spec}")
+    return {"name": spec, "mode": mode, "oversample": int(oversample) if oversample else None,
+            "rerank": extra == "rerank"}
+
+
+def run_config(config: dict, golden: list[dict], query_vectors: np.ndarray, k: int) -> tuple[list, list]:
+    results, latencies = [], []
+    for g, vec in zip(golden, query_vectors):
+        t0 = time.perf_counter()
+        if config["rerank"]:
+            rows = fetch_matches(vec, limit=max(k, RERANK_CANDIDATES), mode=config["mode"],
+                                 oversample=config["oversample"])
+            rows = rerank(g["query"], rows, k)
+        else:
+            rows = fetch_matches(vec, limit=k, mode=config["mode"], oversample=config["oversample"])
+        latencies.append((time.perf_counter() - t0) * 1000)
+        results.append([r[0] for r in rows])
+    return results, latencies
+
+
+def score(results: list[list[str]], truth: list[set[str]], golden: list[dict], k: int) -> dict:
+    recalls, reciprocal_ranks = [], []
+    for ids, exact, g in zip(results, truth, golden):
+        recalls.append(len(set(ids[:k]) & exact) / max(len(exact), 1))
+        rank = ids[:k].index(g["chunk_id"]) + 1 if g["chunk_id"] in ids[:k] else None
+        reciprocal_ranks.append(1 / rank if rank else 0.0)
+    return {
+        f"recall@{k}": round(float(np.mean(recalls)), 4),
+        f"mrr@{k}": round(float(np.mean(reciprocal_ranks)), 4),
+        f"hit@{k}": round(float(np.mean([rr > 0 for rr in reciprocal_ranks])), 4),
+    }
+
+
+def latency_stats(latencies: list[float]) -> dict:
+    return {
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 2),
+        "mean_ms": round(float(np.mean(latencies)), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrieval recall / MRR / latency against exact ground truth")
+    parser.add_argument("--chunks", default="data/chunks.jsonl")
+    parser.add_argument("--golden", default="data/eval/golden.jsonl")
+    parser.add_argument("--rebuild-golden", action="store_true")
+    parser.add_argument("--queries", type=int, default=200, help="Chunks sampled for the golden set")
+    parser.add_argument("--per-chunk", type=int, default=1, help="Questions per sampled chunk")
+    parser.add_argument("--generator", choices=["extract", "vertex"], default="extract")
+    parser.add_argument("--config", default="config.yaml", help="Vertex settings for --generator vertex")
+    parser.add_argument("--snapshot", help="Read document embeddings from a snapshot directory instead of the DB")
+    parser.add_argument("--configs", default="full,halfvec:4,binary:8",
+                        help="Comma-separated: mode[:oversample][+rerank]")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=13)
+    parser.add_argument("--out", default="data/eval/retrieval_report.json")
+    args = parser.parse_args()
+
+    golden_path = Path(args.golden)
+    if args.rebuild_golden or not golden_path.exists():
+        golden = build_golden(Path(args.chunks), golden_path, args.queries, args.per_chunk,
+                              args.generator, args.seed, Path(args.config))
+    else:
+        golden = load_golden(golden_path)
+
+    ids, doc_vectors = load_embeddings(Path(args.snapshot) if args.snapshot else None)
+    known = set(ids)
+    dropped = sum(g["chunk_id"] not in known for g in golden)
+    golden = [g for g in golden if g["chunk_id"] in known]
+    if dropped:
+        print(f"[golden] {dropped} questions skipped: their chunk is not indexed")
+    if not golden:
+        raise SystemExit("No golden question refers to an indexed chunk")
+    k = min(args.k, len(ids))
+
+    model = _get_model()
+    query_vectors = np.asarray(
+        model.encode([g["query"] for g in golden], batch_size=32, normalize_embeddings=True), dtype=np.float32)
+    top, exact_ms = exact_top_k(doc_vectors, query_vectors, k)
+    truth = [{ids[i] for i in row} for row in top]
+
+    report_rows = [{"config": "exact (numpy)", **score([[ids[i] for i in row] for row in top], truth, golden, k),
+                    "p50_ms": round(exact_ms, 2), "p99_ms": None, "mean_ms": round(exact_ms, 2)}]
+    for spec in [s.strip() for s in args.configs.split(",") if s.strip()]:
+        config = parse_config(spec)
+        results, latencies = run_config(config, golden, query_vectors, k)
+        report_rows.append({"config": spec, **score(results, truth, golden, k), **latency_stats(latencies)})
+
+    print(f"{'config':<18} {'recall@' + str(k):>10} {'mrr@' + str(k):>8} {'hit@' + str(k):>8} "
+          f"{'p50 ms':>8} {'p99 ms':>8}")
+    for r in report_rows:
+        p99 = f"{r['p99_ms']:>8.2f}" if r["p99_ms"] is not None else f"{'-':>8}"
+        print(f"{r['config']:<18} {r[f'recall@{k}']:>10.3f} {r[f'mrr@{k}']:>8.3f} {r[f'hit@{k}']:>8.3f} "
+              f"{r['p50_ms']:>8.2f} {p99}")
+
+    out = Path(args.out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps({
+        "created": datetime.now(timezone.utc).isoformat(),
+        "golden": str(golden_path),
+        "generator": golden[0]["generator"],
+        "queries": len(golden),
+        "corpus": len(ids),
+        "k": k,
+        "results": report_rows,
+    }, indent=2), encoding="utf-8")
+    print(f"Wrote {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+snapshot.py – Export and import the documents table without re-embedding.
+
+A snapshot is a directory with three files:
+
+    documents.parquet   every column except the embedding, ordered by id
+    embeddings.npy      float32 matrix, row i belongs to Parquet row i
+    meta.json           model ids, dimension, row count and source table
+
+Export streams the table with binary COPY. Import bulk-loads the snapshot
+through the same staging table and merge as embed_and_index.py, so a new
+environment or a benchmark database is populated without loading the model.
+
+    python scripts/snapshot.py export data/snapshot
+    python scripts/snapshot.py import data/snapshot [--truncate]
+"""
+
+import argparse
+import json
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import psycopg
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pgvector.psycopg import register_vector
+
+from embed_and_index import (COLUMNS, COPY_TYPES, build_conn_str, build_sql, chunk_ordinal, ensure_schema,
+                             load_config)
+
+
+SNAPSHOT_VERSION = 1
+META_COLUMNS = [c for c in COLUMNS if c != "embedding"]
+PARQUET_SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("source_url", pa.string()),
+    ("title", pa.string()),
+    ("license", pa.string()),
+    ("language", pa.string()),
+    ("content", pa.string()),
+    ("tokens", pa.int32()),
+    ("content_hash", pa.string()),
+    ("embed_model", pa.string()),
+    ("page_start", pa.int32()),
+    ("page_end", pa.int32()),
+    ("alt_source_urls", pa.list_(pa.string())),
+    ("access_level", pa.string()),
+    ("customer_id", pa.string()),
+    ("chunk_index", pa.int32()),
+])
+# Values for columns that snapshots from older schemas do not have
+COLUMN_DEFAULTS = {"access_level": "public"}
+EMBED_COL = COLUMNS.index("embedding")
+
+
+def export_snapshot(conn, db_cfg, out_dir: Path, batch_size: int) -> dict:
+    table = f"{db_cfg['schema']}.{db_cfg['table']}"
+    out_dir.mkdir(parents=True, exist_ok=True)
+    # One snapshot of the table for both the row count and the COPY
+    conn.commit()
+    conn.isolation_level = psycopg.IsolationLevel.REPEATABLE_READ
+    with conn.transaction(), conn.cursor() as cur:
+        cur.execute(f"SELECT count(*) FROM {table}")
+        n_rows = cur.fetchone()[0]
+        if not n_rows:
+            raise SystemExit(f"{table} is empty, nothing to export")
+        cur.execute(f"SELECT vector_dims(embedding) FROM {table} LIMIT 1")
+        dim = cur.fetchone()[0]
+        cur.execute(f"SELECT DISTINCT embed_model FROM {table}")
+        models = sorted(r[0] for r in cur.fetchall() if r[0])
+
+        # Preallocated .npy on disk, filled in COPY order
+        embs = np.lib.format.open_memmap(out_dir / "embeddings.npy", mode="w+",
+                                         dtype=np.float32, shape=(n_rows, dim))
+        writer = pq.ParquetWriter(out_dir / "documents.parquet", PARQUET_SCHEMA, compression="zstd")
+        buf: list[tuple] = []
+        i = 0
+
+        def flush():
+            nonlocal i
+            cols = list(zip(*buf))
+            data = {c: list(cols[COLUMNS.index(c)]) for c in META_COLUMNS}
+            writer.write_table(pa.Table.from_pydict(data, schema=PARQUET_SCHEMA))
+            embs[i:i + len(buf)] = np.stack(cols[EMBED_COL])
+            i += len(buf)
+            buf.clear()
+
+        copy_sql = f"COPY (SELECT {', '.join(COLUMNS)} FROM {table} ORDER BY id) TO STDOUT (FORMAT BINARY)"
+        with cur.copy(copy_sql) as copy:
+            copy.set_types(COPY_TYPES)
+            for row in copy.rows():
+                buf.append(row)
+                if len(buf) >= batch_size:
+                    flush()
+        if buf:
+            flush()
+        writer.close()
+        embs.flush()
+        del embs
+
+    meta = {
+        "version": SNAPSHOT_VERSION,
+        "rows": i,
+        "dim": dim,
+        "models": models,
+        "table": table,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+    (out_dir / "meta.json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    return meta
+
+
+def import_snapshot(conn, db_cfg, snap_dir: Path, batch_size: int, truncate: bool) -> int:
+    meta = json.loads((snap_dir / "meta.json").read_text(encoding="utf-8"))
+    if meta.get("version") != SNAPSHOT_VERSION:
+        raise SystemExit(f"Unsupported snapshot version {meta.get('version')}")
+    embs = np.load(snap_dir / "embeddings.npy", mmap_mode="r")
+    pf = pq.ParquetFile(snap_dir / "documents.parquet")
+    if embs.shape[0] != pf.metadata.num_rows or embs.shape[0] != meta["rows"]:
+        raise SystemExit(f"Snapshot is inconsistent: {pf.metadata.num_rows} rows, "
+                         f"{embs.shape[0]} embeddings, meta says {meta['rows']}")
+
+    sql = build_sql(db_cfg)
+    ensure_schema(conn, db_cfg, sql, meta["dim"])
+    table = f"{db_cfg['schema']}.{db_cfg['table']}"
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT atttypmod FROM pg_attribute WHERE attrelid = %s::regclass AND attname = 'embedding'",
+            (table,),
+        )
+        table_dim = cur.fetchone()[0]
+        if table_dim != meta["dim"]:
+            raise SystemExit(f"Snapshot dimension {meta['dim']} does not match {table} ({table_dim})")
+        if truncate:
+            cur.execute(f"TRUNCATE {table}")
+    conn.commit()
+
+    present = [c for c in META_COLUMNS if c in pf.schema_arrow.names]
+    i = 0
+    for batch in pf.iter_batches(batch_size=batch_size, columns=present):
+        cols = {name: batch.column(name).to_pylist() for name in present}
+        for name in META_COLUMNS:
+            cols.setdefault(name, [COLUMN_DEFAULTS.get(name)] * batch.num_rows)
+        if "chunk_index" not in present:
+            cols["chunk_index"] = [chunk_ordinal(doc_id) for doc_id in cols["id"]]
+        with conn.cursor() as cur:
+            with cur.copy(sql["copy"]) as copy:
+                copy.set_types(COPY_TYPES)
+                for j in range(batch.num_rows):
+                    row = [cols[c][j] if c != "embedding" else np.asarray(embs[i + j]) for c in COLUMNS]
+                    copy.write_row(row)
+            cur.execute(sql["merge"])
+            cur.execute(sql["truncate"])
+        conn.commit()
+        i += batch.num_rows
+        print(f"Imported {i}/{meta['rows']} rows", end="\r", flush=True)
+    print()
+    return i
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export / import documents with embeddings (Parquet + .npy)")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("path", help="Snapshot directory")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--batch", type=int, default=None, help="Rows per batch (postgres.write_batch_size)")
+    parser.add_argument("--truncate", action="store_true", help="Import: empty the table first")
+    parser.add_argument("--allow-model-mismatch", action="store_true",
+                        help="Import: load even if the snapshot model differs from embedding.model_name")
+    args = parser.parse_args()
+
+    cfg = load_config(Path(args.config))
+    db_cfg = cfg["postgres"]
+    batch_size = args.batch or db_cfg.get("write_batch_size", 2000)
+    snap_dir = Path(args.path)
+
+    with psycopg.connect(build_conn_str(db_cfg)) as conn:
+        register_vector(conn)
+        if args.command == "export":
+            meta = export_snapshot(conn, db_cfg, snap_dir, batch_size)
+            print(f"Exported {meta['rows']} rows (dim {meta['dim']}, models {meta['models']}) to {snap_dir}")
+            return
+
+        meta = json.loads((snap_dir / "meta.json").read_text(encoding="utf-8"))
+        model = cfg["embedding"]["model_name"]
+        if meta["models"] != [model] and not args.allow_model_mismatch:
+            # Query embeddings would come from a different model than the stored ones
+            raise SystemExit(f"Snapshot models {meta['models']} differ from configured {model!r}; "
+                             "use --allow-model-mismatch to load anyway")
+        n = import_snapshot(conn, db_cfg, snap_dir, batch_size, args.truncate)
+    print(f"Imported {n} rows from {snap_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,22 @@
 suggest_sources.py – Ask Vertex AI (Gemini) for open-source URLs about
 electrochemical surface treatment.  Falls back to a built-in seed list
 when no Vertex credentials are available.
+
+Several topics (--topic repeated or --topics-file) are queried in parallel.
+Responses are cached on disk per (model, prompt). URLs are normalized and
+deduplicated across topics, against the existing output file and against
+sources already indexed, and new candidates are appended to the output.
 """
 
 import argparse
+import hashlib
 import json
+import os
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
 import yaml
 from pydantic import BaseModel
@@ -167,6 +177,9 @@ SEED_SOURCES: list[dict] = [
 ]
 
 
+TRACKING_PARAM_PREFIXES = ("utm_", "fbclid", "gclid", "mc_")
+
+
 def load_config(path: Path) -> dict:
     with path.open("r", encoding="utf-8") as f:
         return yaml.safe_load(f)
@@ -182,54 +195,194 @@ def _extract_json_array(text: str) -> list[dict]:
     return json.loads(text)
 
 
-def suggest_via_vertex(cfg: dict, topic: str) -> list[SourceCandidate]:
-    """Call Gemini via Vertex AI and return parsed candidates."""
-    from vertexai.generative_models import GenerativeModel
+def normalize_url(url: str) -> str:
+    """Canonical form for deduplication: lower-case scheme and host, no
+    default port, fragment, tracking parameters or trailing slash, and
+    sorted query parameters."""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and (scheme, parts.port) not in (("http", 80), ("https", 443)):
+        host = f"{host}:{parts.port}"
+    path = parts.path.rstrip("/") or "/"
+    query = urlencode(sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith(TRACKING_PARAM_PREFIXES)
+    ))
+    return urlunsplit((scheme, host, path, query, ""))
+
+
+# ── Model response cache ─────────────────────────────────────────────
+class ResponseCache:
+    """Raw model responses on disk, keyed by (model, prompt).
+
+    Re-runs over the same topics cost nothing, and a populated cache lets
+    the script run offline.
+    """
+
+    def __init__(self, root: Path | None):
+        self.root = Path(root) if root else None
+
+    def _path(self, model: str, prompt: str) -> Path:
+        key = hashlib.sha256(f"{model}\n{prompt}".encode("utf-8")).hexdigest()
+        return self.root / f"{key}.json"
+
+    def get(self, model: str, prompt: str) -> str | None:
+        if self.root is None:
+            return None
+        path = self._path(model, prompt)
+        if not path.exists():
+            return None
+        return json.loads(path.read_text(encoding="utf-8"))["text"]
+
+    def put(self, model: str, prompt: str, text: str):
+        if self.root is None:
+            return
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self._path(model, prompt)
+        tmp = path.with_name(path.name + f".{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps({"model": model, "prompt": prompt, "text": text}, ensure_ascii=False),
+                       encoding="utf-8")
+        os.replace(tmp, path)
+
+
+_vertex_lock = threading.Lock()
+_vertex_ready = False
+
+
+def _init_vertex(cfg: dict):
+    global _vertex_ready
     import vertexai
 
-    v = cfg["vertex"]
-    vertexai.init(project=v["project_id"], location=v["location"])
-    model = GenerativeModel(v["model"])
+    with _vertex_lock:
+        if not _vertex_ready:
+            vertexai.init(project=cfg["vertex"]["project_id"], location=cfg["vertex"]["location"])
+            _vertex_ready = True
+
 
+def suggest_via_vertex(cfg: dict, topic: str, cache: ResponseCache | None = None) -> list[SourceCandidate]:
+    """Call Gemini via Vertex AI (or the response cache) and return parsed candidates."""
+    model_name = cfg["vertex"]["model"]
     prompt = PROMPT_TEMPLATE.format(
         max_per_topic=cfg["sources"]["max_per_topic"],
         topic=topic,
     )
-    response = model.generate_content(prompt)
-    parsed = _extract_json_array(response.text)
+    text = cache.get(model_name, prompt) if cache else None
+    if text is None:
+        from vertexai.generative_models import GenerativeModel
+
+        _init_vertex(cfg)
+        text = GenerativeModel(model_name).generate_content(prompt).text
+        parsed = _extract_json_array(text)  # only cache parseable responses
+        if cache:
+            cache.put(model_name, prompt, text)
+    else:
+        parsed = _extract_json_array(text)
     return [SourceCandidate(**item) for item in parsed]
 
 
-def suggest_sources(cfg: dict, topic: str) -> list[SourceCandidate]:
+def suggest_sources(cfg: dict, topic: str, cache: ResponseCache | None = None) -> list[SourceCandidate]:
     """Try Vertex first; fall back to built-in seed list."""
     try:
-        candidates = suggest_via_vertex(cfg, topic)
+        candidates = suggest_via_vertex(cfg, topic, cache)
         if candidates:
-            print(f"Vertex AI returned {len(candidates)} candidates")
+            print(f"[{topic}] Vertex AI returned {len(candidates)} candidates")
             return candidates
     except Exception as exc:
-        print(f"Vertex AI unavailable ({exc}), using built-in seed list")
+        print(f"[{topic}] Vertex AI unavailable ({exc}), using built-in seed list")
 
     # Fallback: return seed list
     return [SourceCandidate(**s) for s in SEED_SOURCES]
 
 
+def suggest_many(cfg: dict, topics: list[str], concurrency: int,
+                 cache: ResponseCache | None = None) -> list[list[SourceCandidate]]:
+    """Query all topics with at most `concurrency` requests in flight;
+    results keep the order of `topics`."""
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        return list(pool.map(lambda t: suggest_sources(cfg, t, cache), topics))
+
+
+def indexed_urls(cfg: dict) -> set[str]:
+    """Normalized source URLs already in the documents table (empty if the
+    database is unreachable)."""
+    import psycopg
+
+    db = cfg["postgres"]
+    conn_str = (f"host={db['host']} port={db['port']} dbname={db['database']} "
+                f"user={db['user']} password={db['password']}")
+    try:
+        with psycopg.connect(conn_str, connect_timeout=5) as conn, conn.cursor() as cur:
+            cur.execute(
+                f"SELECT source_url FROM {db['schema']}.{db['table']} "
+                f"UNION SELECT unnest(alt_source_urls) FROM {db['schema']}.{db['table']}"
+            )
+            return {normalize_url(r[0]) for r in cur if r[0]}
+    except Exception as exc:
+        print(f"Could not read indexed sources ({exc}), skipping that check")
+        return set()
+
+
+def read_topics(topics: list[str] | None, topics_file: str | None) -> list[str]:
+    out = list(topics or [])
+    if topics_file:
+        for line in Path(topics_file).read_text(encoding="utf-8").splitlines():
+            line = line.strip()
+            if line and not line.startswith("#"):
+                out.append(line)
+    return list(dict.fromkeys(out)) or ["electrochemical surface treatment"]
+
+
 def main():
     parser = argparse.ArgumentParser(description="Suggest open resources via Vertex AI")
     parser.add_argument("--config", default="config.yaml", help="Path to config YAML")
-    parser.add_argument("--topic", default="electrochemical surface treatment", help="Topic to search")
-    parser.add_argument("--out", default="data/sources.jsonl", help="Output JSONL path")
+    parser.add_argument("--topic", action="append", help="Topic to search (repeatable)")
+    parser.add_argument("--topics-file", help="File with one topic per line (# comments allowed)")
+    parser.add_argument("--concurrency", type=int, default=None,
+                        help="Parallel model requests (sources.concurrency)")
+    parser.add_argument("--out", default="data/sources.jsonl", help="Output JSONL path (merged, not overwritten)")
+    parser.add_argument("--cache-dir", default="data/cache/llm", help="Model response cache")
+    parser.add_argument("--no-cache", action="store_true", help="Always call the model")
+    parser.add_argument("--no-db", action="store_true", help="Do not skip URLs already in the documents table")
     args = parser.parse_args()
 
     cfg = load_config(Path(args.config))
-    candidates = suggest_sources(cfg, args.topic)
+    topics = read_topics(args.topic, args.topics_file)
+    concurrency = args.concurrency or cfg["sources"].get("concurrency", 4)
+    cache = ResponseCache(None if args.no_cache else Path(args.cache_dir))
 
     out_path = Path(args.out)
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    with out_path.open("w", encoding="utf-8") as f:
+    existing_lines: list[str] = []
+    if out_path.exists():
+        existing_lines = [l for l in out_path.read_text(encoding="utf-8").splitlines() if l.strip()]
+    known = {normalize_url(json.loads(l)["url"]) for l in existing_lines}
+    indexed = set() if args.no_db else indexed_urls(cfg)
+
+    new: list[SourceCandidate] = []
+    new_keys: set[str] = set()
+    dup_run = dup_existing = 0
+    for candidates in suggest_many(cfg, topics, concurrency, cache):
         for c in candidates:
+            key = normalize_url(c.url)
+            if key in new_keys:
+                dup_run += 1
+            elif key in known or key in indexed:
+                dup_existing += 1
+            else:
+                new.append(c)
+                new_keys.add(key)
+
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out_path.with_name(out_path.name + ".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        for line in existing_lines:
+            f.write(line + "\n")
+        for c in new:
             f.write(c.model_dump_json() + "\n")
-    print(f"Wrote {len(candidates)} candidates to {out_path}")
+    os.replace(tmp, out_path)
+    print(f"{len(topics)} topics: {len(new)} new candidates merged into {out_path} "
+          f"({len(existing_lines)} kept, {dup_run} duplicates within this run, "
+          f"{dup_existing} already listed or indexed)")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,102 @@
+"""
+vector_modes_report.py – Recall and latency of compressed vector search modes.
+
+Compares rag_api.fetch_matches in "full" mode (exact fp32 cosine) with the
+"halfvec" and "binary" first-pass + rescore modes, at several oversample
+factors, on the indexed data. Stored chunk embeddings serve as queries, so
+no embedding model is needed. Also reports per-row column size and index
+size for each representation.
+
+Run from the repository root so `api` is importable:
+
+    DATABASE_URL=postgresql://... python -m scripts.vector_modes_report --queries 200
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+from api.rag_api import fetch_matches, get_conn
+
+MODE_COLUMNS = {"full": "embedding", "halfvec": "embedding_half", "binary": "embedding_bin"}
+
+
+def sample_queries(n: int) -> list:
+    with get_conn().cursor() as cur:
+        cur.execute("SELECT embedding FROM public.documents ORDER BY random() LIMIT %s", (n,))
+        return [r[0] for r in cur.fetchall()]
+
+
+def storage_stats(modes: list[str]) -> dict:
+    stats = {}
+    with get_conn().cursor() as cur:
+        for mode in modes:
+            col = MODE_COLUMNS[mode]
+            cur.execute(f"SELECT avg(pg_column_size({col})) FROM public.documents")
+            stats[mode] = {"avg_bytes_per_row": float(cur.fetchone()[0] or 0)}
+        cur.execute(
+            "SELECT indexrelname, pg_relation_size(indexrelid) FROM pg_stat_user_indexes "
+            "WHERE relname = 'documents'"
+        )
+        stats["indexes"] = {name: size for name, size in cur.fetchall()}
+    return stats
+
+
+def evaluate(queries: list, k: int, modes: list[str], oversamples: list[int]) -> list[dict]:
+    truth = [{r[0] for r in fetch_matches(q, limit=k, mode="full")} for q in queries]
+    results = []
+    for mode in modes:
+        for oversample in ([None] if mode == "full" else oversamples):
+            latencies, recalls = [], []
+            for q, exact in zip(queries, truth):
+                t0 = time.perf_counter()
+                rows = fetch_matches(q, limit=k, mode=mode, oversample=oversample)
+                latencies.append((time.perf_counter() - t0) * 1000)
+                recalls.append(len({r[0] for r in rows} & exact) / max(len(exact), 1))
+            results.append({
+                "mode": mode,
+                "oversample": oversample,
+                f"recall@{k}": float(np.mean(recalls)),
+                "p50_ms": float(np.percentile(latencies, 50)),
+                "p95_ms": float(np.percentile(latencies, 95)),
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare full / halfvec / binary vector search")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--modes", default="full,halfvec,binary")
+    parser.add_argument("--oversample", default="1,2,4,8", help="Comma-separated oversample factors")
+    parser.add_argument("--out", default="data/vector_modes_report.json")
+    args = parser.parse_args()
+
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    oversamples = [int(x) for x in args.oversample.split(",")]
+    queries = sample_queries(args.queries)
+    if not queries:
+        raise SystemExit("No documents indexed")
+
+    results = evaluate(queries, args.k, modes, oversamples)
+    storage = storage_stats(modes)
+
+    print(f"{'mode':<8} {'oversample':>10} {'recall@' + str(args.k):>10} {'p50 ms':>8} {'p95 ms':>8} {'bytes/row':>10}")
+    for r in results:
+        print(f"{r['mode']:<8} {r['oversample'] or '-':>10} {r[f'recall@{args.k}']:>10.3f} "
+              f"{r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {storage[r['mode']]['avg_bytes_per_row']:>10.0f}")
+    for name, size in storage["indexes"].items():
+        print(f"index {name}: {size / 1e6:.1f} MB")
+
+    out = Path(args.out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps({"queries": len(queries), "k": args.k, "results": results,
+                               "storage": storage}, indent=2), encoding="utf-8")
+    print(f"Wrote {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+import re
+import sys
+from pathlib import Path
+
+import pytest
+
+# The scripts import their siblings by module name
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+
+class WordEncoder:
+    """One token per word with its leading whitespace, like cl100k's " word" tokens."""
+
+    def encode(self, text):
+        self.pieces = re.findall(r"\s*\S+|\s+$", text)
+        return list(range(len(self.pieces)))
+
+    def decode_with_offsets(self, tokens):
+        offsets, pos = [], 0
+        for i in tokens:
+            offsets.append(pos)
+            pos += len(self.pieces[i])
+        return "".join(self.pieces[i] for i in tokens), offsets
+
+
+@pytest.fixture
+def word_tokens(monkeypatch):
+    """Replace the tiktoken encoder (its BPE file is downloaded on first use)."""
+    fetch_and_chunk = pytest.importorskip("fetch_and_chunk")
+    monkeypatch.setattr(fetch_and_chunk, "_encoder", lambda: WordEncoder())
@@ -0,0 +1,28 @@
+import pytest
+
+for module in ("httpx", "tiktoken", "trafilatura", "yaml", "pydantic"):
+    pytest.importorskip(module)
+
+import fetch_and_chunk  # noqa: E402
+
+
+def _paragraphs(n_paragraphs, sentences=4, words=9):
+    sentence = " ".join(f"w{i}" for i in range(words)) + "."
+    return "\n\n".join(" ".join([sentence] * sentences) for _ in range(n_paragraphs))
+
+
+@pytest.mark.parametrize("target, overlap", [(40, 10), (60, 15), (100, 20)])
+def test_consecutive_chunks_overlap(word_tokens, target, overlap):
+    spans = list(fetch_and_chunk.chunk_spans(_paragraphs(12), target, overlap))
+    assert len(spans) > 2
+    for (_, prev_end, _), (next_start, _, _) in zip(spans, spans[1:]):
+        assert next_start < prev_end
+
+
+def test_paragraph_at_window_end_keeps_overlap(word_tokens):
+    # The window ends on a paragraph break, the strongest boundary in the
+    # overlap region; the next chunk must still start before it
+    text = _paragraphs(2, sentences=2, words=10)
+    spans = list(fetch_and_chunk.chunk_spans(text, 22, 6))
+    assert text[spans[0][1]:].startswith("\n\n")
+    assert spans[1][0] < spans[0][1]
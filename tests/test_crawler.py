@@ -0,0 +1,145 @@
+import asyncio
+import io
+import json
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+for module in ("httpx", "tiktoken", "trafilatura", "yaml", "pydantic"):
+    pytest.importorskip(module)
+
+import fetch_and_chunk  # noqa: E402
+
+PAGE_DELAY_S = 0.15
+FETCH_CFG = {"concurrency": 8, "per_host_concurrency": 2, "delay_s": 0.1, "retries": 2, "backoff_s": 0.01}
+
+
+def _html(title: str) -> bytes:
+    paragraphs = "".join(
+        f"<p>{title} kappale {i}. " + " ".join(f"sana{j}" for j in range(60)) + ".</p>" for i in range(4))
+    return f"<html><head><title>{title}</title></head><body><article><h1>{title}</h1>{paragraphs}" \
+           f"</article></body></html>".encode("utf-8")
+
+
+class FixtureHost:
+    """One local HTTP server = one host for the crawler's throttle.
+
+    /page/<n>    200 after PAGE_DELAY_S (the first page is slowest)
+    /flaky       503 once, then 200
+    /limited     429 with Retry-After: 0 once, then 200
+    /gone        404
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.starts: list[float] = []
+        self.hits: dict[str, int] = defaultdict(int)
+        host = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with host.lock:
+                    host.active += 1
+                    host.max_active = max(host.max_active, host.active)
+                    host.starts.append(time.monotonic())
+                    host.hits[self.path] += 1
+                    hits = host.hits[self.path]
+                try:
+                    self._respond(hits)
+                finally:
+                    with host.lock:
+                        host.active -= 1
+
+            def _respond(self, hits):
+                status, headers = 200, {}
+                if self.path == "/gone":
+                    status = 404
+                elif self.path == "/flaky" and hits == 1:
+                    status = 503
+                elif self.path == "/limited" and hits == 1:
+                    status, headers = 429, {"Retry-After": "0"}
+                elif self.path.startswith("/page/"):
+                    time.sleep(PAGE_DELAY_S * (3 if self.path == "/page/0" else 1))
+                body = _html(self.path) if status == 200 else b"error"
+                self.send_response(status)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def hosts():
+    pair = FixtureHost(), FixtureHost()
+    yield pair
+    for host in pair:
+        host.close()
+
+
+@pytest.fixture
+def crawl_result(hosts, word_tokens, monkeypatch):
+    # Threads instead of processes: the patched encoder must reach the extractors
+    monkeypatch.setattr(fetch_and_chunk, "ProcessPoolExecutor", ThreadPoolExecutor)
+    a, b = hosts
+    urls = [f"{a.url}/page/{i}" for i in range(5)] + [f"{b.url}/page/{i}" for i in range(5)]
+    urls += [f"{a.url}/flaky", f"{b.url}/limited", f"{a.url}/gone"]
+    sources = [{"url": url, "title": url, "license": "test", "language": "fi"} for url in urls]
+    out = io.StringIO()
+    stats = asyncio.run(fetch_and_chunk.crawl(sources, out, 40, 8, FETCH_CFG))
+    rows = [json.loads(line) for line in out.getvalue().splitlines()]
+    return urls, stats, rows
+
+
+def test_per_host_concurrency_and_delay(hosts, crawl_result):
+    for host in hosts:
+        assert host.max_active <= FETCH_CFG["per_host_concurrency"]
+        gaps = [b - a for a, b in zip(host.starts, host.starts[1:])]
+        assert min(gaps) >= FETCH_CFG["delay_s"] - 0.02
+
+
+def test_hosts_are_fetched_in_parallel(hosts, crawl_result):
+    # The throttle is per host: requests to the two hosts interleave
+    a, b = hosts
+    assert a.starts[0] < b.starts[-1] and b.starts[0] < a.starts[-1]
+    assert max(a.max_active, b.max_active) == FETCH_CFG["per_host_concurrency"]
+
+
+def test_retries_transient_statuses_only(hosts, crawl_result):
+    a, b = hosts
+    _, stats, rows = crawl_result
+    assert a.hits["/flaky"] == 2
+    assert b.hits["/limited"] == 2
+    assert a.hits["/gone"] == 1
+    assert stats["failed"] == 1
+    sources = {row["source_url"] for row in rows}
+    assert f"{a.url}/flaky" in sources and f"{b.url}/limited" in sources
+
+
+def test_output_follows_source_order(crawl_result):
+    urls, _, rows = crawl_result
+    ids = [row["id"] for row in rows]
+    order = list(dict.fromkeys(i.rsplit("#c", 1)[0] for i in ids))
+    assert order == [url for url in urls if not url.endswith("/gone")]
+    for url in order:
+        indices = [int(i.rsplit("#c", 1)[1]) for i in ids if i.startswith(url + "#")]
+        assert indices == list(range(len(indices)))
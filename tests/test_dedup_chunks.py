@@ -0,0 +1,31 @@
+import dedup_chunks
+
+
+def _text(i: int) -> str:
+    return " ".join(f"sana{i}x{j}" for j in range(30))
+
+
+def test_finds_duplicates_in_order():
+    texts = [_text(0), _text(1), _text(0), _text(2), _text(1)]
+    dups, n = dedup_chunks.find_duplicates(texts, workers=2)
+    assert n == 5
+    assert dups == {2: 0, 4: 1}
+
+
+def test_reads_texts_lazily(monkeypatch):
+    monkeypatch.setattr(dedup_chunks, "BATCH_SIZE", 10)
+    consumed = 0
+
+    def texts():
+        nonlocal consumed
+        for i in range(1000):
+            consumed += 1
+            yield _text(i)
+
+    with dedup_chunks.ProcessPoolExecutor(max_workers=2, initializer=dedup_chunks._init_worker,
+                                          initargs=(64,)) as pool:
+        it = dedup_chunks._iter_signatures(pool, texts(), workers=2)
+        next(it)
+        # Two batches per worker in flight, plus the one being read
+        assert consumed <= 5 * 10
+        assert sum(1 for _ in it) == 999
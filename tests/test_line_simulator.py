@@ -0,0 +1,31 @@
+import pytest
+
+from calc.line_simulator import MAX_DURATION_H, MAX_REPLICATIONS, plating_line_simulation
+
+STATIONS = [{"name": "Rasvanpoisto", "time_s": 300}, {"name": "Huuhtelu", "time_s": 60}]
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"duration_h": MAX_DURATION_H + 1},
+    {"duration_h": 0},
+    {"replications": MAX_REPLICATIONS + 1},
+    {"replications": 0},
+])
+def test_rejects_out_of_range_run_length(kwargs):
+    result = plating_line_simulation(STATIONS, **kwargs)
+    assert set(result) == {"error"}
+
+
+def test_unknown_material_is_named():
+    stations = STATIONS + [{"name": "Pinnoitus", "plating": {
+        "material": "unobtainium", "thickness_um": 10, "current_density_a_dm2": 2}}]
+    result = plating_line_simulation(stations, duration_h=1, replications=1)
+    assert "unobtainium" in result["error"]
+    assert "molar_mass" not in result["error"]
+
+
+def test_known_material_runs():
+    stations = STATIONS + [{"name": "Pinnoitus", "plating": {
+        "material": "nikkeli", "thickness_um": 10, "current_density_a_dm2": 2}}]
+    result = plating_line_simulation(stations, duration_h=1, replications=1)
+    assert "error" not in result
@@ -0,0 +1,28 @@
+import pytest
+
+from calc.material_data import find_material, material_lookup, with_material
+from calc.surface_treatment import faraday_mass_calculation
+
+
+@pytest.mark.parametrize("name, key", [
+    ("Cu", "Cu"),
+    ("kupari", "Cu"),
+    ("kuparin", "Cu"),
+    ("nikel", "Ni"),
+    ("nikkeliä", "Ni"),
+    ("happokuparin", "acid_copper"),
+    ("Watts nickel", "watts_nickel"),
+])
+def test_known_names_resolve(name, key):
+    assert find_material(name)["key"] == key
+
+
+@pytest.mark.parametrize("name", ["Ti", "iron-nickel", "electroless nickel", "trivalent chrome", "volframi"])
+def test_unknown_names_are_not_guessed(name):
+    assert find_material(name) is None
+    assert material_lookup(name)["error"].startswith(f"Tuntematon materiaali '{name}'")
+
+
+def test_with_material_reports_unknown_material():
+    result = with_material(faraday_mass_calculation)(current_a=10, time_s=60, material="trivalent chrome")
+    assert "Tuntematon materiaali 'trivalent chrome'" in result["error"]
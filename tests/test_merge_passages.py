@@ -0,0 +1,34 @@
+import pytest
+
+for module in ("fastapi", "psycopg", "openai", "orjson"):
+    pytest.importorskip(module)
+
+from api import rag_api  # noqa: E402
+
+SOURCE = "https://example.org/a"
+
+
+def _rows(rank, hit_index, indexes):
+    # (rank, score, hit id, id, source_url, title, license, language, content, chunk_index)
+    return [(rank, 1.0 / rank, f"{SOURCE}#c{hit_index}", f"{SOURCE}#c{i}", SOURCE,
+             "A", "test", "fi", f"Kappale {i}.", i) for i in indexes]
+
+
+def test_adjacent_chunks_form_one_passage():
+    (passage,) = rag_api._merge_passages(_rows(1, 3, [2, 3, 4]))
+    assert passage[5] == "Kappale 2.\nKappale 3.\nKappale 4."
+    assert rag_api._GAP_SEPARATOR not in passage[5]
+
+
+def test_missing_chunk_is_marked():
+    # Chunk 3 was removed by dedup or the access filter
+    (passage,) = rag_api._merge_passages(_rows(1, 2, [1, 2, 4]))
+    assert passage[0] == f"{SOURCE}#c2"
+    assert passage[5] == "Kappale 1.\nKappale 2." + rag_api._GAP_SEPARATOR + "Kappale 4."
+
+
+def test_touching_windows_merge_without_gap():
+    rows = _rows(1, 2, [1, 2, 3]) + _rows(2, 5, [4, 5, 6])
+    (passage,) = rag_api._merge_passages(rows)
+    assert passage[0] == f"{SOURCE}#c2"
+    assert rag_api._GAP_SEPARATOR not in passage[5]
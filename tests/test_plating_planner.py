@@ -0,0 +1,28 @@
+import pytest
+
+from calc.plating_planner import plating_plan
+
+CU = (25, 63.546, 2, 8.96)
+
+
+def test_area_counts_whole_parts():
+    result = plating_plan(*CU, solve_for="area", time_s=[3600], current_a=100, area_dm2=0.5)
+    best = result["optimum"]
+    assert best["parts"] == int(best["area_dm2"] // 0.5)
+    assert best["parts"] > 0
+
+
+def test_area_without_part_area_has_no_parts():
+    result = plating_plan(*CU, solve_for="area", time_s=[3600], current_a=100)
+    assert "parts" not in result["optimum"]
+
+
+@pytest.mark.parametrize("area_dm2", [[0.5, 2], {"min": 0.5, "max": 2, "steps": 4}, -1])
+def test_area_rejects_part_area_grids(area_dm2):
+    result = plating_plan(*CU, solve_for="area", time_s=[3600], current_a=100, area_dm2=area_dm2)
+    assert "area_dm2" in result["error"]
+
+
+def test_mixed_efficiency_units_are_rejected():
+    result = plating_plan(*CU, current_density_a_dm2=[2], current_efficiency=[0.95, 98], area_dm2=1)
+    assert "current_efficiency" in result["error"]